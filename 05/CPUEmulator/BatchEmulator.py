@@ -0,0 +1,173 @@
+from CPUEmulator import CPUEmulator, alu, MEMORY_SIZE, OP_A, OP_HALT, OP_WRAP, JUMP_LT, JUMP_EQ, JUMP_GT
+import argparse
+import numpy as np
+import time
+
+
+class BatchEmulator:
+    """
+    N independent Hack machines running the same ROM in lockstep.
+
+    PC, A and D are int32 vectors of length N and RAM is an (N, 32768) uint16
+    matrix, with every value kept in 0..65535. Each step groups the running
+    machines by PC and executes each distinct instruction once, as NumPy
+    operations over the machines in its group. Machines that run the same control
+    flow stay in one group, so a step costs a handful of vector operations however
+    many machines there are; divergent ones cost one group per distinct PC.
+    """
+
+    def __init__(self, n, rom=None):
+        """
+        @attr self.program (list of tuple): the ROM predecoded by CPUEmulator, shared by every machine
+        @attr self.pc, self.a, self.d (ndarray): the registers of every machine
+        @attr self.ram (ndarray): the RAM of every machine, one row each
+        @attr self.halted (ndarray): True for machines that reached their end-of-program loop
+        @attr self.cycles (ndarray): instructions executed by each machine
+        """
+        self.n = n
+        self.pc = np.zeros(n, np.int32)
+        self.a = np.zeros(n, np.int32)
+        self.d = np.zeros(n, np.int32)
+        self.ram = np.zeros((n, MEMORY_SIZE), np.uint16)
+        self.halted = np.zeros(n, bool)
+        self.cycles = np.zeros(n, np.int64)
+        self.load_rom(rom or ())
+
+    def load(self, filename):
+        """Loads a program from a .hack, .hackb or .asm file into every machine's ROM."""
+        cpu = CPUEmulator()
+        cpu.load(filename)
+        self._use_program(cpu.program)
+
+    def load_rom(self, words):
+        """Loads instruction words into every machine's ROM and resets them."""
+        self._use_program(CPUEmulator(words).program)
+
+    def _use_program(self, program):
+        """Takes over a program predecoded by CPUEmulator and resets."""
+        self.program = program
+        self.reset()
+
+    def reset(self):
+        """Restarts every machine at address 0, keeping RAM."""
+        self.pc[:] = 0
+        self.halted[:] = False
+        self.cycles[:] = 0
+
+    def step(self):
+        """Executes one instruction on every machine that has not halted. Returns how many ran."""
+        running = np.flatnonzero(~self.halted)
+        if running.size == 0:
+            return 0
+        pcs = self.pc[running]
+        first = pcs[0]
+        if (pcs == first).all():
+            self._execute(int(first), running)
+        else:
+            order = np.argsort(pcs, kind="stable")
+            pcs = pcs[order]
+            starts = np.flatnonzero(np.r_[True, pcs[1:] != pcs[:-1]])
+            for start, end in zip(starts, np.r_[starts[1:], pcs.size]):
+                self._execute(int(pcs[start]), running[order[start:end]])
+        self.cycles[running] += 1
+        return running.size
+
+    def _execute(self, pc, rows):
+        """Executes the instruction at address pc on the machines in rows."""
+        op, arg, dest, jump = self.program[pc]
+        if op == OP_WRAP:
+            self.pc[rows] = 0
+            pc = 0
+            op, arg, dest, jump = self.program[0]
+        if op == OP_A:
+            self.a[rows] = arg
+            self.pc[rows] = (pc + 1) & 0x7FFF
+            return
+        a = self.a[rows]
+        address = a & 0x7FFF
+        y = self.ram[rows, address].astype(np.int32) if arg & 0b1000000 else a
+        out = alu(arg & 0b111111, self.d[rows], y)
+        if np.isscalar(out) or out.ndim == 0:
+            out = np.full(rows.size, out, np.int32)
+        if dest & 1:
+            self.ram[rows, address] = out
+        if dest & 2:
+            self.d[rows] = out
+        if dest & 4:
+            self.a[rows] = out
+        if op == OP_HALT:
+            self.halted[rows] = True
+            self.pc[rows] = pc - 1
+        elif jump:
+            negative = (out & 0x8000) != 0
+            zero = out == 0
+            taken = np.zeros(rows.size, bool)
+            if jump & JUMP_LT:
+                taken |= negative
+            if jump & JUMP_EQ:
+                taken |= zero
+            if jump & JUMP_GT:
+                taken |= ~negative & ~zero
+            self.pc[rows] = np.where(taken, address, (pc + 1) & 0x7FFF)
+        else:
+            self.pc[rows] = (pc + 1) & 0x7FFF
+
+    def run(self, max_steps=None):
+        """
+        Steps every machine until all have halted or max_steps steps were taken.
+        Returns the total number of instructions executed over all machines.
+        """
+        total = 0
+        steps = 0
+        while max_steps is None or steps < max_steps:
+            executed = self.step()
+            if not executed:
+                break
+            total += executed
+            steps += 1
+        return total
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description="Run a program on every pair of inputs in RAM[0] and RAM[1], e.g. 04/mult/Mult.asm.")
+    argparser.add_argument("filename", help="the Xxx.hack, Xxx.hackb or Xxx.asm program to run")
+    argparser.add_argument("--range", type=int, default=32, help="try RAM[0], RAM[1] in 0..RANGE-1")
+    argparser.add_argument("--steps", type=int, default=10 ** 6, help="give up after this many lockstep steps")
+    argparser.add_argument("--product", action="store_true", help="check that RAM[2] == RAM[0] * RAM[1] afterwards")
+    args = argparser.parse_args()
+
+    r0, r1 = np.divmod(np.arange(args.range * args.range), args.range)
+    batch = BatchEmulator(r0.size)
+    batch.load(args.filename)
+    batch.ram[:, 0] = r0
+    batch.ram[:, 1] = r1
+    start = time.perf_counter()
+    total = batch.run(args.steps)
+    batch_time = time.perf_counter() - start
+    print("batch:  %d machines, %d instructions in %.3f s (%.2f M instructions/s), %d halted" % (
+        batch.n, total, batch_time, total / batch_time / 1e6, batch.halted.sum()))
+
+    start = time.perf_counter()
+    scalar_total = 0
+    cpu = CPUEmulator()
+    cpu.load(args.filename)
+    for i in range(batch.n):
+        cpu.ram[0], cpu.ram[1], cpu.ram[2] = int(r0[i]), int(r1[i]), 0
+        cpu.reset()
+        scalar_total += cpu.run(int(batch.cycles[i]))
+        assert cpu.ram[2] == batch.ram[i, 2], "machine %d differs from the scalar emulator" % i
+    scalar_time = time.perf_counter() - start
+    print("scalar: %d runs, %d instructions in %.3f s (%.2f M instructions/s)" % (
+        batch.n, scalar_total, scalar_time, scalar_total / scalar_time / 1e6))
+    print("speedup %.2fx" % (scalar_time / batch_time))
+
+    if args.product:
+        wrong = np.flatnonzero(batch.ram[:, 2] != ((r0 * r1) & 0xFFFF))
+        for i in wrong[:10]:
+            print("R0=%d R1=%d: R2=%d" % (r0[i], r1[i], batch.ram[i, 2]))
+        print("%d of %d products wrong" % (wrong.size, batch.n))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+from CPUEmulator import (CPUEmulator, alu, OP_A, OP_Y, OP_X, OP_Y_MINUS_1, OP_Y_PLUS_1, OP_X_PLUS_Y,
+                         OP_Y_MINUS_X, OP_X_MINUS_Y, OP_ZERO, OP_ONE, OP_MINUS_ONE, OP_NOT_X, OP_NOT_Y,
+                         OP_NEG_X, OP_NEG_Y, OP_X_PLUS_1, OP_X_MINUS_1, OP_X_AND_Y, OP_X_OR_Y, OP_GENERIC)
+import argparse
+import time
+
+# Python expression of each ALU operation, with {x} and {y} standing for its inputs
+EXPRESSIONS = {
+    OP_Y: "{y}",
+    OP_X: "{x}",
+    OP_Y_MINUS_1: "({y} - 1) & 65535",
+    OP_Y_PLUS_1: "({y} + 1) & 65535",
+    OP_X_PLUS_Y: "({x} + {y}) & 65535",
+    OP_Y_MINUS_X: "({y} - {x}) & 65535",
+    OP_X_MINUS_Y: "({x} - {y}) & 65535",
+    OP_ZERO: "0",
+    OP_ONE: "1",
+    OP_MINUS_ONE: "65535",
+    OP_NOT_X: "{x} ^ 65535",
+    OP_NOT_Y: "{y} ^ 65535",
+    OP_NEG_X: "-{x} & 65535",
+    OP_NEG_Y: "-{y} & 65535",
+    OP_X_PLUS_1: "({x} + 1) & 65535",
+    OP_X_MINUS_1: "({x} - 1) & 65535",
+    OP_X_AND_Y: "{x} & {y}",
+    OP_X_OR_Y: "{x} | {y}",
+}
+
+# Python condition on the ALU output o for each jump mask
+CONDITIONS = {
+    0b001: "0 < o < 32768",
+    0b010: "o == 0",
+    0b011: "o < 32768",
+    0b100: "o & 32768",
+    0b101: "o != 0",
+    0b110: "o == 0 or o & 32768",
+    0b111: "True",
+}
+
+# Longest run of instructions compiled into one block
+MAX_BLOCK = 256
+
+
+class BlockTranslator(CPUEmulator):
+    """
+    A CPUEmulator that runs basic blocks instead of single instructions.
+
+    The ROM is split into basic blocks at jump targets and after jumps. The first
+    time the PC reaches a block it is translated into Python source, one line or
+    two per instruction with constant A values folded in, compiled with exec and
+    cached by its start address. Running a block is then a single call that returns
+    the next PC. Blocks entered through computed jumps (return addresses) are
+    translated from wherever they start. Anything that cannot be run as a whole
+    block (the end-of-program loop, the end of ROM, or a block longer than the
+    cycles left to run) falls back to the instruction interpreter.
+    """
+
+    def load_rom(self, words):
+        """Loads the ROM like CPUEmulator.load_rom and drops every translated block."""
+        CPUEmulator.load_rom(self, words)
+        self.leaders = self._find_leaders()
+        self.blocks = {}
+        self.translated = 0
+        self.fallbacks = 0
+
+    def _find_leaders(self):
+        """Returns the addresses that start a basic block: 0, the targets of "@n" + jump pairs and the instructions after jumps."""
+        leaders = {0}
+        program = self.program
+        for address in range(1, len(program) - 1):
+            op, arg, dest, jump = program[address]
+            if op != OP_A and jump:
+                leaders.add(address + 1)
+                prev_op, target = program[address - 1][:2]
+                if prev_op == OP_A:
+                    leaders.add(target)
+        return leaders
+
+    def _translate(self, start):
+        """
+        Compiles the block starting at start into a function (ram, a, d) -> (pc, a, d).
+        Returns (function, instruction count), or None if the block must be interpreted.
+        """
+        program = self.program
+        lines = ["def block(ram, a, d):"]
+        known_a = None
+        pc = start
+        while True:
+            op, arg, dest, jump = program[pc]
+            if op > OP_GENERIC or (pc != start and pc in self.leaders) or pc - start >= MAX_BLOCK:
+                # halt, end of ROM, next block or too long: stop before this instruction
+                if pc == start:
+                    return None
+                lines.append("    return %d, a, d" % pc)
+                break
+            if op == OP_A:
+                lines.append("    a = %d" % arg)
+                known_a = arg
+                pc += 1
+                continue
+
+            address = str(known_a) if known_a is not None else "a & 32767"
+            y = "ram[%s]" % address if arg & 0b1000000 else ("%d" % known_a if known_a is not None else "a")
+            if op == OP_GENERIC:
+                expression = "alu(%d, d, %s)" % (arg & 0b111111, y)
+            else:
+                expression = EXPRESSIONS[op].format(x="d", y=y)
+            target = "%d" % known_a if known_a is not None else "t"
+            if jump and known_a is None:
+                lines.append("    t = a & 32767")
+            if dest in (1, 2, 4) and not jump:
+                lhs = {1: "ram[%s]" % address, 2: "d", 4: "a"}[dest]
+                lines.append("    %s = %s" % (lhs, expression))
+            else:
+                lines.append("    o = %s" % expression)
+                if dest & 1:
+                    lines.append("    ram[%s] = o" % address)
+                if dest & 2:
+                    lines.append("    d = o")
+                if dest & 4:
+                    lines.append("    a = o")
+            if dest & 4:
+                known_a = None
+            pc += 1
+            if jump:
+                if jump == 0b111:
+                    lines.append("    return %s, a, d" % target)
+                else:
+                    lines.append("    if %s:" % CONDITIONS[jump])
+                    lines.append("        return %s, a, d" % target)
+                    lines.append("    return %d, a, d" % pc)
+                break
+        namespace = {"alu": alu}
+        exec(compile("\n".join(lines), "<block %d>" % start, "exec"), namespace)
+        self.translated += 1
+        return namespace["block"], pc - start
+
+    def run(self, max_cycles=None):
+        """Runs like CPUEmulator.run, a whole translated block at a time."""
+        blocks = self.blocks
+        ram = self.ram
+        pc = self.pc
+        a = self.a
+        d = self.d
+        limit = max_cycles if max_cycles is not None else float("inf")
+        n = 0
+        interpreted = 0
+        while n < limit:
+            entry = blocks.get(pc)
+            if entry is None:
+                entry = blocks[pc] = self._translate(pc) or (None, 0)
+            block, length = entry
+            if block is None or n + length > limit:
+                self.pc, self.a, self.d = pc, a, d
+                self.step()
+                pc, a, d = self.pc, self.a, self.d
+                n += 1
+                interpreted += 1
+                if self.halted:
+                    break
+                continue
+            pc, a, d = block(ram, a, d)
+            n += length
+        self.pc = pc & 0x7FFF
+        self.a = a
+        self.d = d
+        # step() already counted the instructions it ran
+        self.cycles += n - interpreted
+        self.fallbacks += interpreted
+        return n
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Compare the block translator against the plain interpreter.")
+    argparser.add_argument("filename", help="the Xxx.hack, Xxx.hackb or Xxx.asm program to run")
+    argparser.add_argument("--cycles", type=int, default=10 ** 7, help="instructions to run in each engine")
+    args = argparser.parse_args()
+
+    timings = {}
+    machines = {}
+    for engine in (CPUEmulator, BlockTranslator):
+        cpu = engine()
+        cpu.load(args.filename)
+        start = time.perf_counter()
+        cycles = cpu.run(args.cycles)
+        timings[engine] = time.perf_counter() - start
+        machines[engine] = cpu
+        print("%-16s %d instructions in %.3f s (%.2f M instructions/s)" % (
+            engine.__name__, cycles, timings[engine], cycles / timings[engine] / 1e6))
+    interpreter, translator = machines[CPUEmulator], machines[BlockTranslator]
+    assert (interpreter.pc, interpreter.a, interpreter.d) == (translator.pc, translator.a, translator.d), "registers differ"
+    assert interpreter.ram == translator.ram, "RAM differs"
+    print("speedup %.2fx, %d blocks translated, %d instructions interpreted" % (
+        timings[CPUEmulator] / timings[BlockTranslator], translator.translated, translator.fallbacks))
+
+
+if __name__ == "__main__":
+    main()
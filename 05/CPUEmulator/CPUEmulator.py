@@ -0,0 +1,371 @@
+from array import array
+import argparse
+import os
+import sys
+import time
+
+# The assembler's modules (RomImage, SourceMap, HackAssembler) live in 06/assembler
+ASSEMBLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "06", "assembler")
+if ASSEMBLER_DIR not in sys.path:
+    sys.path.append(ASSEMBLER_DIR)
+
+from RomImage import load_rom
+
+MEMORY_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+
+# Predecoded operation kinds. OP_A loads A; the rest are C commands, named after
+# what the ALU computes with x = D and y = A or M, roughly in order of frequency
+# in VM-generated code so the dispatch chain in run() stays short.
+OP_A = 0
+OP_Y = 1
+OP_X = 2
+OP_Y_MINUS_1 = 3
+OP_Y_PLUS_1 = 4
+OP_X_PLUS_Y = 5
+OP_Y_MINUS_X = 6
+OP_X_MINUS_Y = 7
+OP_ZERO = 8
+OP_ONE = 9
+OP_MINUS_ONE = 10
+OP_NOT_X = 11
+OP_NOT_Y = 12
+OP_NEG_X = 13
+OP_NEG_Y = 14
+OP_X_PLUS_1 = 15
+OP_X_MINUS_1 = 16
+OP_X_AND_Y = 17
+OP_X_OR_Y = 18
+OP_GENERIC = 19
+OP_HALT = 20
+# Placed one past the end of ROM, so running off the end wraps the PC to 0 like the hardware
+OP_WRAP = 21
+# Installed over an instruction by a subclass (see HLE.py) to hand control to its trap() method
+OP_TRAP = 22
+
+# c1..c6 bits of the comp field -> operation
+COMP_OPS = {
+    0b101010: OP_ZERO,
+    0b111111: OP_ONE,
+    0b111010: OP_MINUS_ONE,
+    0b001100: OP_X,
+    0b110000: OP_Y,
+    0b001101: OP_NOT_X,
+    0b110001: OP_NOT_Y,
+    0b001111: OP_NEG_X,
+    0b110011: OP_NEG_Y,
+    0b011111: OP_X_PLUS_1,
+    0b110111: OP_Y_PLUS_1,
+    0b001110: OP_X_MINUS_1,
+    0b110010: OP_Y_MINUS_1,
+    0b000010: OP_X_PLUS_Y,
+    0b010011: OP_X_MINUS_Y,
+    0b000111: OP_Y_MINUS_X,
+    0b000000: OP_X_AND_Y,
+    0b010101: OP_X_OR_Y,
+}
+
+# Jump-mask bit that an ALU output satisfies: j1 if negative, j2 if zero, j3 if positive
+JUMP_LT = 4
+JUMP_EQ = 2
+JUMP_GT = 1
+
+
+def alu(c, x, y):
+    """Computes any of the 64 c1..c6 ALU functions on 16-bit x and y, the way 02/ALU.hdl does."""
+    if c & 0b100000:
+        x = 0
+    if c & 0b010000:
+        x ^= 0xFFFF
+    if c & 0b001000:
+        y = 0
+    if c & 0b000100:
+        y ^= 0xFFFF
+    out = (x + y) & 0xFFFF if c & 0b000010 else x & y
+    if c & 0b000001:
+        out ^= 0xFFFF
+    return out
+
+
+def compute(op, arg, x, y):
+    """Returns the ALU output of a predecoded C command."""
+    if op == OP_Y:
+        return y
+    elif op == OP_X:
+        return x
+    elif op == OP_Y_MINUS_1:
+        return (y - 1) & 0xFFFF
+    elif op == OP_Y_PLUS_1:
+        return (y + 1) & 0xFFFF
+    elif op == OP_X_PLUS_Y:
+        return (x + y) & 0xFFFF
+    elif op == OP_Y_MINUS_X:
+        return (y - x) & 0xFFFF
+    elif op == OP_X_MINUS_Y:
+        return (x - y) & 0xFFFF
+    elif op == OP_ZERO:
+        return 0
+    elif op == OP_ONE:
+        return 1
+    elif op == OP_MINUS_ONE:
+        return 0xFFFF
+    elif op == OP_NOT_X:
+        return x ^ 0xFFFF
+    elif op == OP_NOT_Y:
+        return y ^ 0xFFFF
+    elif op == OP_NEG_X:
+        return -x & 0xFFFF
+    elif op == OP_NEG_Y:
+        return -y & 0xFFFF
+    elif op == OP_X_PLUS_1:
+        return (x + 1) & 0xFFFF
+    elif op == OP_X_MINUS_1:
+        return (x - 1) & 0xFFFF
+    elif op == OP_X_AND_Y:
+        return x & y
+    elif op == OP_X_OR_Y:
+        return x | y
+    return alu(arg & 0b111111, x, y)
+
+
+def jump_taken(jump, out):
+    """Returns True if a jump mask fires for the ALU output out."""
+    if out & 0x8000:
+        return jump & JUMP_LT
+    return jump & (JUMP_EQ if out == 0 else JUMP_GT)
+
+
+def to_signed(value):
+    """Returns the 16-bit word value as a signed int."""
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def predecode(word, address=None, rom=None):
+    """
+    Decodes one instruction word into (op, arg, dest, jump):
+    for A commands op is OP_A and arg the value loaded; for C commands arg is the
+    7-bit comp field (its top bit says whether y is M), dest the d1d2d3 mask
+    (A=4, D=2, M=1) and jump the j1j2j3 mask. An unconditional "0;JMP" straight
+    back to the "@address" in front of it is the usual end-of-program loop and
+    is decoded as OP_HALT.
+    """
+    if not word & 0x8000:
+        return (OP_A, word, 0, 0)
+    comp = (word >> 6) & 0b1111111
+    dest = (word >> 3) & 0b111
+    jump = word & 0b111
+    if (rom is not None and jump == 0b111 and dest == 0 and address
+            and rom[address - 1] == address - 1):
+        return (OP_HALT, comp, dest, jump)
+    return (COMP_OPS.get(comp & 0b111111, OP_GENERIC), comp, dest, jump)
+
+
+class CPUEmulator:
+    """
+    A Hack computer in Python: 32K words of ROM and RAM held in array('H'), the
+    A, D and PC registers, and a fetch/execute loop over instructions that were
+    decoded once when the ROM was loaded. Screen and keyboard are just their
+    memory maps in RAM (16384-24575 and 24576). All words are kept unsigned.
+    """
+
+    def __init__(self, rom=None):
+        """
+        @attr self.rom (array): the 32K instruction words
+        @attr self.program (list of tuple): self.rom predecoded by predecode()
+        @attr self.ram (array): the 32K data words
+        @attr self.cycles (int): instructions executed since the last reset
+        @attr self.halted (bool): True once the program reached its end-of-program loop
+        """
+        self.rom = array("H", bytes(2 * MEMORY_SIZE))
+        self.ram = array("H", bytes(2 * MEMORY_SIZE))
+        self.program = []
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        self.halted = False
+        self.load_rom(rom or ())
+
+    def load(self, filename):
+        """Loads a program from a .hack, .hackb or .asm file into ROM."""
+        if filename.endswith(".asm"):
+            from HackAssembler import assemble
+            with open(filename, "r") as f:
+                self.load_rom(assemble(f))
+        else:
+            self.load_rom(load_rom(filename))
+
+    def load_rom(self, words):
+        """Loads instruction words into ROM, clears the rest of it, predecodes it and resets the CPU."""
+        words = array("H", words)
+        assert len(words) <= MEMORY_SIZE, "program does not fit in the 32K ROM"
+        self.rom[:len(words)] = words
+        self.rom[len(words):] = array("H", bytes(2 * (MEMORY_SIZE - len(words))))
+        self.program = [predecode(word, address, self.rom) for address, word in enumerate(self.rom)]
+        self.program.append((OP_WRAP, 0, 0, 0))
+        self.reset()
+
+    def reset(self):
+        """Restarts the program at address 0. RAM and the A and D registers are kept, as on the hardware."""
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+
+    def step(self):
+        """
+        Executes a single instruction. Returns the RAM address written by it, or -1
+        if it did not write memory.
+        """
+        self.pc &= 0x7FFF
+        op, arg, dest, jump = self.program[self.pc]
+        if op == OP_TRAP:
+            self.trap()
+            return -1
+        self.cycles += 1
+        if op == OP_A:
+            self.a = arg
+            self.pc = (self.pc + 1) & 0x7FFF
+            return -1
+        a = self.a
+        y = self.ram[a & 0x7FFF] if arg & 0b1000000 else a
+        out = compute(op, arg, self.d, y)
+        written = -1
+        if dest & 1:
+            written = a & 0x7FFF
+            self.ram[written] = out
+        if dest & 2:
+            self.d = out
+        if dest & 4:
+            self.a = out
+        if op == OP_HALT:
+            self.halted = True
+            self.pc -= 1
+        elif jump and jump_taken(jump, out):
+            self.pc = a & 0x7FFF
+        else:
+            self.pc = (self.pc + 1) & 0x7FFF
+        return written
+
+    def trap(self):
+        """Called instead of executing an OP_TRAP instruction; subclasses that install traps override it."""
+        raise NotImplementedError("no trap handler for address %d" % self.pc)
+
+    def run(self, max_cycles=None):
+        """
+        Runs until the program halts or max_cycles instructions have executed,
+        and returns the number executed by this call.
+        """
+        program = self.program
+        ram = self.ram
+        pc = self.pc
+        a = self.a
+        d = self.d
+        limit = max_cycles if max_cycles is not None else float("inf")
+        n = 0
+        while n < limit:
+            op, arg, dest, jump = program[pc]
+            n += 1
+            if op == OP_A:
+                a = arg
+                pc += 1
+                continue
+            y = ram[a & 0x7FFF] if arg & 0b1000000 else a
+            if op == OP_Y:
+                out = y
+            elif op == OP_X:
+                out = d
+            elif op == OP_Y_MINUS_1:
+                out = (y - 1) & 0xFFFF
+            elif op == OP_Y_PLUS_1:
+                out = (y + 1) & 0xFFFF
+            elif op == OP_X_PLUS_Y:
+                out = (d + y) & 0xFFFF
+            elif op == OP_Y_MINUS_X:
+                out = (y - d) & 0xFFFF
+            elif op == OP_X_MINUS_Y:
+                out = (d - y) & 0xFFFF
+            elif op == OP_HALT:
+                self.halted = True
+                pc -= 1
+                break
+            elif op == OP_WRAP:
+                pc = 0
+                n -= 1
+                continue
+            elif op == OP_TRAP:
+                # not an instruction itself; whatever the trap runs through step() is counted
+                n -= 1
+                self.pc, self.a, self.d = pc, a, d
+                before = self.cycles
+                self.trap()
+                n += self.cycles - before
+                self.cycles = before
+                pc, a, d = self.pc, self.a, self.d
+                continue
+            else:
+                out = compute(op, arg, d, y)
+            if dest:
+                if dest & 1:
+                    ram[a & 0x7FFF] = out
+                if dest & 2:
+                    d = out
+                if jump:
+                    target = a
+                    if dest & 4:
+                        a = out
+                    if jump_taken(jump, out):
+                        pc = target & 0x7FFF
+                        continue
+                elif dest & 4:
+                    a = out
+            elif jump:
+                if out & 0x8000:
+                    taken = jump & JUMP_LT
+                else:
+                    taken = jump & (JUMP_EQ if out == 0 else JUMP_GT)
+                if taken:
+                    pc = a & 0x7FFF
+                    continue
+            pc += 1
+        self.pc = pc & 0x7FFF
+        self.a = a
+        self.d = d
+        self.cycles += n
+        return n
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run a Hack program headless.")
+    argparser.add_argument("filename", help="the Xxx.hack, Xxx.hackb or Xxx.asm program to run")
+    argparser.add_argument("--cycles", type=int, default=10 ** 7, help="stop after this many instructions")
+    argparser.add_argument("--set", nargs=2, type=int, action="append", default=[], metavar=("ADDRESS", "VALUE"),
+                           help="store VALUE in RAM[ADDRESS] before running; may be repeated")
+    argparser.add_argument("--dump", nargs=2, type=int, metavar=("START", "END"),
+                           help="print RAM[START..END) afterwards")
+    argparser.add_argument("--restore", metavar="FILE", help="start from the snapshot in FILE instead of address 0")
+    argparser.add_argument("--save", metavar="FILE", help="write a snapshot of the machine to FILE afterwards")
+    args = argparser.parse_args()
+
+    cpu = CPUEmulator()
+    cpu.load(args.filename)
+    if args.restore:
+        from Snapshot import load_snapshot
+        load_snapshot(cpu, args.restore)
+    for address, value in args.set:
+        cpu.ram[address] = value & 0xFFFF
+    start = time.perf_counter()
+    cycles = cpu.run(args.cycles)
+    elapsed = time.perf_counter() - start
+    print("%d instructions in %.3f s (%.2f M instructions/s)%s" % (
+        cycles, elapsed, cycles / elapsed / 1e6 if elapsed else 0.0, ", halted" if cpu.halted else ""))
+    if args.save:
+        from Snapshot import save_snapshot
+        save_snapshot(cpu, args.save)
+    if args.dump:
+        for address in range(*args.dump):
+            print("RAM[%d] = %d" % (address, to_signed(cpu.ram[address])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+from CPUEmulator import CPUEmulator, SCREEN
+import argparse
+import numpy as np
+import os
+import struct
+import zlib
+
+HEIGHT = 256
+WIDTH = 512
+ROW_WORDS = WIDTH // 16
+
+
+def screen_words(ram):
+    """Returns the 8K-word screen region of ram (an array('H') or a NumPy row) as a (256, 32) uint16 view."""
+    words = np.frombuffer(ram, np.uint16, count=HEIGHT * ROW_WORDS, offset=2 * SCREEN)
+    return words.reshape(HEIGHT, ROW_WORDS)
+
+
+def unpack_rows(words):
+    """
+    Turns rows of screen words into rows of pixels, 1 for black. The least
+    significant bit of each word is its leftmost pixel, so the words are unpacked
+    as little-endian bytes with little-endian bit order.
+    """
+    return np.unpackbits(words.astype("<u2").view(np.uint8), axis=1, bitorder="little")
+
+
+def to_pbm(image):
+    """Returns a 0/1 image (1 = black) as a binary PBM (P4) file."""
+    height, width = image.shape
+    return b"P4\n%d %d\n" % (width, height) + np.packbits(image, axis=1).tobytes()
+
+
+def to_png(image):
+    """Returns a 0/1 image (1 = black) as a 1-bit grayscale PNG file."""
+    height, width = image.shape
+    # PNG gray is 0 for black; every scanline starts with filter type 0
+    rows = np.packbits(1 - image, axis=1)
+    raw = np.hstack([np.zeros((height, 1), np.uint8), rows]).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 1, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+FORMATS = {"pbm": to_pbm, "png": to_png}
+
+
+class Framebuffer:
+    """
+    Headless view of the Hack screen: RAM[16384..24575] as a 256x512 image.
+
+    The last captured screen words are kept, so each capture compares the words
+    row by row and only unpacks the rows that changed. A capture in which no
+    row changed can be skipped without writing a file.
+    """
+
+    def __init__(self):
+        """
+        @attr self.words (ndarray): the screen words at the last capture, (256, 32)
+        @attr self.image (ndarray): the pixels at the last capture, (256, 512), 1 for black
+        @attr self.frames (int): captures taken
+        @attr self.written (int): frame files written
+        """
+        self.words = np.zeros((HEIGHT, ROW_WORDS), np.uint16)
+        self.image = np.zeros((HEIGHT, WIDTH), np.uint8)
+        self.frames = 0
+        self.written = 0
+
+    def dirty_rows(self, ram):
+        """Returns the indices of the screen rows that differ from the last capture."""
+        return np.flatnonzero((screen_words(ram) != self.words).any(axis=1))
+
+    def capture(self, ram):
+        """Brings self.image up to date with the screen in ram. Returns the rows that changed."""
+        dirty = self.dirty_rows(ram)
+        if dirty.size:
+            words = screen_words(ram)[dirty]
+            self.words[dirty] = words
+            self.image[dirty] = unpack_rows(words)
+        self.frames += 1
+        return dirty
+
+    def save(self, filename, fmt=None):
+        """Writes the last captured image to filename, as PBM or PNG (by default from the file extension)."""
+        fmt = fmt or os.path.splitext(filename)[1][1:].lower()
+        with open(filename, "wb") as f:
+            f.write(FORMATS[fmt](self.image))
+        self.written += 1
+
+    def dump(self, ram, filename, only_changed=False):
+        """Captures the screen in ram and writes it to filename, unless only_changed and nothing changed. Returns True if written."""
+        dirty = self.capture(ram)
+        if only_changed and not dirty.size and self.frames > 1:
+            return False
+        self.save(filename)
+        return True
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run a Hack program headless and dump its screen as image frames.")
+    argparser.add_argument("filename", help="the Xxx.hack, Xxx.hackb or Xxx.asm program to run")
+    argparser.add_argument("--cycles", type=int, default=10 ** 7, help="stop after this many instructions")
+    argparser.add_argument("--every", type=int, default=0,
+                           help="capture a frame every EVERY instructions; by default only once at the end")
+    argparser.add_argument("--out", default="frames", help="directory for the frames")
+    argparser.add_argument("--format", choices=sorted(FORMATS), default="png", help="image format of the frames")
+    argparser.add_argument("--changed", action="store_true", help="only write frames in which the screen changed")
+    argparser.add_argument("--set", nargs=2, type=int, action="append", default=[], metavar=("ADDRESS", "VALUE"),
+                           help="store VALUE in RAM[ADDRESS] before running; may be repeated")
+    args = argparser.parse_args()
+
+    cpu = CPUEmulator()
+    cpu.load(args.filename)
+    for address, value in args.set:
+        cpu.ram[address] = value & 0xFFFF
+    os.makedirs(args.out, exist_ok=True)
+    framebuffer = Framebuffer()
+    segment = args.every or args.cycles
+    while cpu.cycles < args.cycles and not cpu.halted:
+        cpu.run(min(segment, args.cycles - cpu.cycles))
+        name = os.path.join(args.out, "frame%06d.%s" % (framebuffer.frames, args.format))
+        framebuffer.dump(cpu.ram, name, args.changed)
+    print("%d instructions, %d frames captured, %d written to %s" % (
+        cpu.cycles, framebuffer.frames, framebuffer.written, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,498 @@
+from CPUEmulator import CPUEmulator, OP_TRAP, SCREEN, to_signed
+from HackAssembler import assemble
+from SourceMap import SourceMap
+from SymbolTable import SymbolTable
+from array import array
+import argparse
+import os
+import time
+
+SP = 0
+LCL = 1
+ARG = 2
+THIS = 3
+THAT = 4
+HEAP = 2048
+
+# Give up verifying a call whose Jack code has not returned after this many instructions
+MAX_VERIFY_CYCLES = 10 ** 7
+
+# Jack function -> (HLEEmulator method, argument count, statics it needs as "Class.n")
+NATIVES = {
+    "Math.abs": ("math_abs", 1, ()),
+    "Math.min": ("math_min", 2, ()),
+    "Math.max": ("math_max", 2, ()),
+    "Math.multiply": ("math_multiply", 2, ()),
+    "Math.divide": ("math_divide", 2, ()),
+    "Math.sqrt": ("math_sqrt", 1, ()),
+    "Memory.peek": ("memory_peek", 1, ()),
+    "Memory.poke": ("memory_poke", 2, ()),
+    "Memory.alloc": ("memory_alloc", 1, ("Memory.2", "Memory.3")),
+    "Memory.deAlloc": ("memory_dealloc", 1, ("Memory.2", "Memory.3")),
+    "Screen.clearScreen": ("screen_clear", 0, ()),
+    "Screen.setColor": ("screen_set_color", 1, ("Screen.1",)),
+    "Screen.drawPixel": ("screen_draw_pixel", 2, ("Screen.1",)),
+    "Screen.drawLine": ("screen_draw_line", 4, ("Screen.1",)),
+    "Screen.drawHorizontalLine": ("screen_draw_horizontal_line", 3, ("Screen.1",)),
+    "Screen.drawVerticalLine": ("screen_draw_vertical_line", 3, ("Screen.1",)),
+    "Screen.drawRectangle": ("screen_draw_rectangle", 4, ("Screen.1",)),
+    "Screen.drawCircle": ("screen_draw_circle", 3, ("Screen.1",)),
+}
+
+
+def wrap(value):
+    """Returns value as a signed 16-bit Jack int, wrapping like the Hack ALU."""
+    return to_signed(value & 0xFFFF)
+
+
+def on_screen(*points):
+    """Returns True if every (x, y) lies on the 512x256 screen."""
+    return all(0 <= x < 512 and 0 <= y < 256 for x, y in points)
+
+
+class HLEEmulator(CPUEmulator):
+    """
+    A CPUEmulator that runs Jack OS routines natively.
+
+    The entry label of each hooked function (Math.multiply, Memory.alloc,
+    Screen.drawRectangle, ...; matched case-insensitively, so the book's
+    lower-case OS labels work too) gets an OP_TRAP. When a call reaches it, the
+    arguments are read from the stack and the routine's Python version, which
+    follows 12/submission, updates RAM the way the Jack code would. Then the VM
+    return is done natively: the result goes to RAM[ARG], SP becomes ARG + 1,
+    THAT, THIS, ARG and LCL come back from the frame and the PC goes to the
+    return address. A native routine can decline (return None), for example a
+    pixel off the screen or an exhausted heap. The Jack code then runs as usual.
+
+    With verify on, every trapped call runs both versions and compares what the
+    caller can observe: the pointers, statics, live stack, heap and screen. The
+    calls made by the Jack version run natively, so each routine is checked
+    against its own Jack body (the routines it calls are checked when the
+    program calls them directly).
+    """
+
+    def __init__(self, rom=None, verify=False):
+        """
+        @attr self.source_map (SourceMap): the labels of the loaded program
+        @attr self.symbols (dict): every label and variable of the loaded program, as its assembler resolved them
+        @attr self.hooks (dict): entry address -> (function, native method, argument count)
+        @attr self.originals (dict): entry address -> its predecoded instruction, put back when a hook is off
+        @attr self.disabled (set): functions never to hook
+        @attr self.native_calls (dict): function -> calls run natively
+        @attr self.mismatches (list of (str, tuple, int, int, int)): (function, arguments, address, native value, Jack value)
+        """
+        self.source_map = None
+        self.symbols = {}
+        self.hooks = {}
+        self.originals = {}
+        self.disabled = set()
+        self.verify = verify
+        self._checking = False
+        self.native_calls = {}
+        self.mismatches = []
+        CPUEmulator.__init__(self, rom)
+
+    def load(self, filename):
+        """
+        Loads a program like CPUEmulator.load. Hooks need the function labels, so an
+        .asm file is assembled here for its symbols. A .hack / .hackb file uses
+        the labels of its Xxx.map sidecar, and routines that need static
+        variables are not hooked.
+        """
+        if filename.endswith(".asm"):
+            with open(filename, "r") as f:
+                lines = f.readlines()
+            table = SymbolTable()
+            words = assemble(lines, table)
+            self.source_map = SourceMap.build(lines, filename)
+            self.symbols = table.table
+            self.load_rom(words)
+            return
+        name = os.path.splitext(filename)[0]
+        if os.path.exists(name + ".map"):
+            self.source_map = SourceMap.load(name + ".map")
+            self.symbols = dict(self.source_map.labels)
+        CPUEmulator.load(self, filename)
+
+    def load_rom(self, words):
+        """Loads the ROM like CPUEmulator.load_rom and installs the hooks."""
+        CPUEmulator.load_rom(self, words)
+        self.install()
+
+    def install(self):
+        """Puts an OP_TRAP on the entry of every enabled function the program defines."""
+        for address, original in self.originals.items():
+            self.program[address] = original
+        self.hooks = {}
+        self.originals = {}
+        symbols = {name.lower(): address for name, address in self.symbols.items()}
+        labels = self.source_map.labels if self.source_map is not None else {}
+        entries = {label.lower(): address for label, address in labels.items()}
+        for function, (method, count, statics) in NATIVES.items():
+            address = entries.get(function.lower())
+            if address is None or function in self.disabled:
+                continue
+            if any(static.lower() not in symbols for static in statics):
+                continue
+            self.hooks[address] = (function, getattr(self, method), count)
+            self.originals[address] = self.program[address]
+            self.program[address] = (OP_TRAP,) + self.program[address][1:]
+        self.statics = {static: symbols[static.lower()] for _, _, needed in NATIVES.values()
+                        for static in needed if static.lower() in symbols}
+
+    def enable(self, function, on=True):
+        """Turns the native version of a Jack function on or off."""
+        if on:
+            self.disabled.discard(function)
+        else:
+            self.disabled.add(function)
+        self.install()
+
+    def peek(self, address):
+        """Returns RAM[address] as a signed Jack int."""
+        return to_signed(self.ram[address & 0x7FFF])
+
+    def poke(self, address, value):
+        """Stores a Jack int in RAM[address]."""
+        self.ram[address & 0x7FFF] = value & 0xFFFF
+
+    def trap(self):
+        """Runs the hooked function at the PC natively, or its Jack code if the native version declines."""
+        address = self.pc & 0x7FFF
+        function, native, count = self.hooks[address]
+        ram = self.ram
+        arg = ram[ARG]
+        args = tuple(to_signed(ram[(arg + i) & 0x7FFF]) for i in range(count))
+        if not self.verify or self._checking:
+            result = native(*args)
+            if result is None:
+                self.run_original(address)
+            else:
+                self.vm_return(result)
+                self.native_calls[function] = self.native_calls.get(function, 0) + 1
+            return
+        before = array("H", ram)
+        registers = (self.pc, self.a, self.d)
+        result = native(*args)
+        if result is None:
+            self.run_original(address)
+            return
+        self.vm_return(result)
+        self.native_calls[function] = self.native_calls.get(function, 0) + 1
+        expected = array("H", ram)
+        expected_pc = self.pc
+        ram[:] = before
+        self.pc, self.a, self.d = registers
+        self.run_jack(address)
+        mismatch = self.compare(expected, expected_pc)
+        if mismatch is not None:
+            self.mismatches.append((function, args) + mismatch)
+
+    def vm_return(self, result):
+        """Returns from the current VM function with result, as the VM return command does."""
+        ram = self.ram
+        frame = ram[LCL]
+        arg = ram[ARG]
+        ram[arg] = result & 0xFFFF
+        ram[SP] = (arg + 1) & 0xFFFF
+        ram[THAT] = ram[(frame - 1) & 0x7FFF]
+        ram[THIS] = ram[(frame - 2) & 0x7FFF]
+        ram[ARG] = ram[(frame - 3) & 0x7FFF]
+        ram[LCL] = ram[(frame - 4) & 0x7FFF]
+        self.pc = ram[(frame - 5) & 0x7FFF] & 0x7FFF
+
+    def run_original(self, address):
+        """Executes the instruction under the trap at address, so the Jack code carries on from there."""
+        self.program[address] = self.originals[address]
+        try:
+            self.step()
+        finally:
+            self.program[address] = (OP_TRAP,) + self.originals[address][1:]
+
+    def run_jack(self, address):
+        """Runs the Jack code of the function entered at address until it returns to its caller."""
+        ram = self.ram
+        return_address = ram[(ram[LCL] - 5) & 0x7FFF] & 0x7FFF
+        sp = (ram[ARG] + 1) & 0xFFFF
+        self._checking = True
+        try:
+            self.run_original(address)
+            limit = self.cycles + MAX_VERIFY_CYCLES
+            while not (self.pc == return_address and ram[SP] == sp):
+                assert self.cycles < limit, "the Jack code at %d did not return" % address
+                self.step()
+        finally:
+            self._checking = False
+
+    def compare(self, expected, expected_pc):
+        """
+        Compares RAM and the PC after the Jack code ran with the native result.
+        Returns (address, native value, Jack value) for the first difference, with
+        address -1 for the PC, or None if the caller cannot tell them apart.
+        """
+        if self.pc != expected_pc:
+            return (-1, expected_pc, self.pc)
+        ram = self.ram
+        sp = min(ram[SP], HEAP)
+        for start, end in ((SP, THAT + 1), (16, sp), (HEAP, SCREEN + 8193)):
+            if expected[start:end] != array("H", ram[start:end]):
+                for address in range(start, end):
+                    if expected[address] != ram[address]:
+                        return (address, to_signed(expected[address]), to_signed(ram[address]))
+        return None
+
+    # Math.jack
+
+    def math_abs(self, x):
+        return wrap(-x) if x < 0 else x
+
+    def math_min(self, a, b):
+        return a if a < b else b
+
+    def math_max(self, a, b):
+        return a if a > b else b
+
+    def _multiply_help(self, x, y):
+        """Math.multiplyHelp: adds shifted copies of x for the bits of y, which it finds only for y >= 0."""
+        if y < 0:
+            return 0
+        return wrap(x * y)
+
+    def math_multiply(self, x, y):
+        if x == 0 or y == 0:
+            return 0
+        if x < 0 and y > 0:
+            return wrap(-self._multiply_help(self.math_abs(x), y))
+        if x > 0 and y < 0:
+            return wrap(-self._multiply_help(x, self.math_abs(y)))
+        if x > 0 and y > 0:
+            return self._multiply_help(x, y)
+        return self._multiply_help(self.math_abs(x), self.math_abs(y))
+
+    def _divide_help(self, numerator, divider):
+        """Math.divideHelp: long division that gives 0 once the doubled divider overflows."""
+        if divider > numerator or divider < 0:
+            return 0
+        return numerator // divider
+
+    def math_divide(self, x, y):
+        if x == 0:
+            return 0
+        if x < 0 and y > 0:
+            return wrap(-self._divide_help(self.math_abs(x), y))
+        if x > 0 and y < 0:
+            return wrap(-self._divide_help(x, self.math_abs(y)))
+        if x < 0 and y < 0:
+            return self._divide_help(self.math_abs(x), self.math_abs(y))
+        if x > 0 and y > 0:
+            return self._divide_help(x, y)
+        return 0
+
+    def math_sqrt(self, x):
+        bits = 1
+        while bits < 15 and x >= 1 << bits:
+            bits += 1
+        y = 0
+        for j in range(bits // 2, -1, -1):
+            square = self.math_multiply(y + (1 << j), y + (1 << j))
+            if 0 < square <= x:
+                y += 1 << j
+        return y
+
+    # Memory.jack
+
+    def memory_peek(self, address):
+        return self.peek(address)
+
+    def memory_poke(self, address, value):
+        self.poke(address, value)
+        return 0
+
+    def memory_alloc(self, size):
+        """Memory.alloc: first fit from the end of a free block. Declines when no block fits, where the Jack code halts."""
+        free_list = self.statics["Memory.2"]
+        block = self.peek(free_list)
+        for _ in range(self.peek(self.statics["Memory.3"])):
+            length = self.peek(block + 1)
+            if length > wrap(size + 2):
+                length = wrap(length - (size + 2))
+                self.poke(block + 1, length)
+                self.poke(block + length + 3, size)
+                return wrap(block + length + 4)
+            block = self.peek(block)
+        return None
+
+    def memory_dealloc(self, o):
+        free_list = self.statics["Memory.2"]
+        free_list_size = self.statics["Memory.3"]
+        self.poke(o - 2, self.peek(free_list))
+        self.poke(free_list, o - 2)
+        self.poke(free_list_size, self.peek(free_list_size) + 1)
+        return 0
+
+    # Screen.jack
+
+    def _pixel(self, x, y):
+        """Sets or clears one on-screen pixel in the current color."""
+        address = SCREEN + 32 * y + x // 16
+        if self.ram[self.statics["Screen.1"]]:
+            self.ram[address] |= 1 << (x % 16)
+        else:
+            self.ram[address] &= ~(1 << (x % 16)) & 0xFFFF
+
+    def screen_clear(self):
+        self.ram[SCREEN:SCREEN + 8192] = array("H", bytes(2 * 8192))
+        return 0
+
+    def screen_set_color(self, b):
+        self.poke(self.statics["Screen.1"], b)
+        return 0
+
+    def screen_draw_pixel(self, x, y):
+        if not on_screen((x, y)):
+            return None
+        self._pixel(x, y)
+        return 0
+
+    def _horizontal_line(self, x1, x2, y):
+        """Screen.drawHorizontalLine: pixels up to a word boundary, whole words, then pixels again."""
+        if x1 > x2:
+            return
+        is_start = is_middle = is_end = False
+        start1 = start2 = middle1 = middle2 = end1 = end2 = 0
+        if x1 % 16:
+            is_start = True
+            start1 = x1
+            if x2 > (x1 // 16) * 16 + 15:
+                start2 = (x1 // 16) * 16 + 15
+                is_end = True
+            else:
+                start2 = x2
+        if is_start:
+            if x2 - (x1 // 16 + 1) * 16 > 14:
+                is_middle = True
+                middle1 = start2 + 1
+                if x2 % 16 == 15:
+                    middle2 = x2
+                else:
+                    middle2 = (x2 // 16 - 1) * 16 + 15
+                    is_end = True
+        elif x2 - x1 > 14:
+            is_middle = True
+            middle1 = x1
+            middle2 = x2 if x2 % 16 == 15 else (x2 // 16) * 16 - 1
+        if x2 % 16 == 15:
+            is_end = False
+        else:
+            if x1 % 16 == 0:
+                is_end = True
+            if is_end:
+                end2 = x2
+                end1 = middle2 + 1 if is_middle else (start2 + 1 if is_start else x1)
+        if is_start:
+            for x in range(start1, start2 + 1):
+                self._pixel(x, y)
+        if is_middle:
+            start = SCREEN + 32 * y + middle1 // 16
+            end = SCREEN + 32 * y + (middle2 + 1) // 16
+            word = 0xFFFF if self.ram[self.statics["Screen.1"]] else 0
+            for address in range(start, end):
+                self.ram[address] = word
+        if is_end:
+            for x in range(end1, end2 + 1):
+                self._pixel(x, y)
+
+    def _vertical_line(self, x, y1, y2):
+        for y in range(min(y1, y2), max(y1, y2) + 1):
+            self._pixel(x, y)
+
+    def _line(self, x1, y1, x2, y2):
+        """Screen.drawLine, stepping along the line with the same diff rule."""
+        if x1 == x2 and y1 == y2:
+            self._pixel(x1, y1)
+        elif x1 > x2:
+            self._line(x2, y2, x1, y1)
+        elif y1 == y2:
+            self._horizontal_line(x1, x2, y1)
+        elif x1 == x2:
+            self._vertical_line(x1, y1, y2)
+        else:
+            dx = x2 - x1
+            dy = abs(y2 - y1)
+            sign = 1 if y2 >= y1 else -1
+            a = b = diff = 0
+            while a <= dx and b <= dy:
+                self._pixel(x1 + a, y1 + sign * b)
+                if diff < 0:
+                    a += 1
+                    diff += dy
+                else:
+                    b += 1
+                    diff -= dx
+
+    def screen_draw_line(self, x1, y1, x2, y2):
+        if not on_screen((x1, y1), (x2, y2)):
+            return None
+        self._line(x1, y1, x2, y2)
+        return 0
+
+    def screen_draw_horizontal_line(self, x1, x2, y):
+        if not on_screen((x1, y), (x2, y)):
+            return None
+        self._horizontal_line(x1, x2, y)
+        return 0
+
+    def screen_draw_vertical_line(self, x, y1, y2):
+        if not on_screen((x, y1), (x, y2)):
+            return None
+        self._vertical_line(x, y1, y2)
+        return 0
+
+    def screen_draw_rectangle(self, x1, y1, x2, y2):
+        if not on_screen((x1, y1), (x2, y2)):
+            return None
+        for y in range(y1, y2 + 1):
+            self._horizontal_line(x1, x2, y)
+        return 0
+
+    def screen_draw_circle(self, x, y, r):
+        if r < 0 or not on_screen((x - r, y - r), (x + r, y + r)):
+            return None
+        for dy in range(-r, r + 1):
+            half = self.math_sqrt(wrap(r * r - dy * dy))
+            self._line(x - half, y + dy, x + half, y + dy)
+        return 0
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run a Jack program with native versions of OS routines.")
+    argparser.add_argument("filename", help="the Xxx.asm program, or Xxx.hack / Xxx.hackb next to its Xxx.map")
+    argparser.add_argument("--cycles", type=int, default=10 ** 7, help="stop after this many instructions")
+    argparser.add_argument("--off", action="append", default=[], metavar="FUNCTION",
+                           help="keep the Jack code of FUNCTION, e.g. Memory.alloc; may be repeated")
+    argparser.add_argument("--verify", action="store_true", help="run both versions of every call and compare them")
+    argparser.add_argument("--dump", nargs=2, type=int, metavar=("START", "END"), help="print RAM[START..END) afterwards")
+    args = argparser.parse_args()
+
+    cpu = HLEEmulator(verify=args.verify)
+    cpu.disabled.update(args.off)
+    cpu.load(args.filename)
+    start = time.perf_counter()
+    cycles = cpu.run(args.cycles)
+    elapsed = time.perf_counter() - start
+    print("%d instructions in %.3f s, %d native calls, hooked: %s" % (
+        cycles, elapsed, sum(cpu.native_calls.values()), ", ".join(sorted(h[0] for h in cpu.hooks.values()))))
+    for function, calls in sorted(cpu.native_calls.items(), key=lambda item: -item[1]):
+        print("%-32s %8d" % (function, calls))
+    if args.verify:
+        for function, arguments, address, native, jack in cpu.mismatches[:20]:
+            where = "PC" if address < 0 else "RAM[%d]" % address
+            print("mismatch: %s%s: %s native %d, Jack %d" % (function, arguments, where, native, jack))
+        print("%d mismatches" % len(cpu.mismatches))
+    if args.dump:
+        for address in range(*args.dump):
+            print("RAM[%d] = %d" % (address, to_signed(cpu.ram[address])))
+
+
+if __name__ == "__main__":
+    main()
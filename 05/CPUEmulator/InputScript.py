@@ -0,0 +1,132 @@
+from CPUEmulator import CPUEmulator, KBD
+from BlockTranslator import BlockTranslator
+from Framebuffer import Framebuffer, screen_words
+import argparse
+import hashlib
+import os
+import time
+
+# Key names from the Hack character set (12/Keyboard.jack)
+KEYS = {"none": 0, "release": 0, "space": 32, "newline": 128, "enter": 128, "backspace": 129,
+        "left": 130, "up": 131, "right": 132, "down": 133, "home": 134, "end": 135,
+        "pageup": 136, "pagedown": 137, "insert": 138, "delete": 139, "esc": 140}
+KEYS.update(("f%d" % n, 140 + n) for n in range(1, 13))
+
+# Instructions per frame when event times are given as f<frame>
+FRAME_CYCLES = 100000
+
+
+class InputScript:
+    """
+    A deterministic keyboard script: (cycle, key code) events, in cycle order.
+
+    Each non-blank line of a script file reads "<when> <key>", with "//"
+    comments as in the assembly and VM sources. <when> is an instruction count,
+    or "f<n>" for frame n of frame_cycles instructions. <key> is a single
+    printable character (so "5" is the digit key, code 53), a key name such as
+    left, esc or none, or a raw key code written "#n", such as #130. A key
+    stays pressed (RAM[24576] holds its code) until the next event.
+    """
+
+    def __init__(self, events=(), frame_cycles=FRAME_CYCLES):
+        """
+        @attr self.events (list of (int, int)): (cycle, key code) pairs, sorted by cycle
+        @attr self.frame_cycles (int): instructions per frame
+        """
+        self.events = sorted(events)
+        self.frame_cycles = frame_cycles
+
+    @classmethod
+    def from_file(cls, filename, frame_cycles=FRAME_CYCLES):
+        """Reads a script file."""
+        script = cls(frame_cycles=frame_cycles)
+        with open(filename, "r") as f:
+            for number, line in enumerate(f, 1):
+                line = line.split("//")[0].strip()
+                if not line:
+                    continue
+                parts = line.split()
+                assert len(parts) == 2, "%s:%d: expected '<cycle or f<frame>> <key>'" % (filename, number)
+                script.events.append((script.parse_time(parts[0]), script.parse_key(parts[1])))
+        script.events.sort()
+        return script
+
+    def parse_time(self, when):
+        """Returns the instruction count of "<cycle>" or "f<frame>"."""
+        if when[0] in "fF":
+            return int(when[1:]) * self.frame_cycles
+        return int(when)
+
+    @staticmethod
+    def parse_key(key):
+        """Returns the key code of a single character, a key name or a "#n" raw code."""
+        if len(key) > 1 and key[0] == "#":
+            assert key[1:].isdigit(), "bad key code %r" % key
+            return int(key[1:])
+        if key.lower() in KEYS:
+            return KEYS[key.lower()]
+        assert len(key) == 1, "unknown key %r" % key
+        return ord(key.upper()) if key.isalpha() else ord(key)
+
+    def replay(self, cpu, max_cycles, on_frame=None):
+        """
+        Runs cpu for max_cycles instructions, storing each event's key in KBD when
+        its cycle comes. Between events the emulator runs flat out. Only when
+        on_frame is given is the run also cut at every frame boundary and
+        on_frame(cpu, frame) called there. Returns the number of instructions run.
+        """
+        events = iter(self.events)
+        pending = next(events, None)
+        start = cpu.cycles
+        while cpu.cycles - start < max_cycles and not cpu.halted:
+            now = cpu.cycles - start
+            while pending is not None and pending[0] <= now:
+                cpu.ram[KBD] = pending[1]
+                pending = next(events, None)
+            stop = max_cycles if pending is None else min(pending[0], max_cycles)
+            if on_frame is not None:
+                stop = min(stop, (now // self.frame_cycles + 1) * self.frame_cycles)
+            cpu.run(stop - now)
+            if on_frame is not None and (cpu.cycles - start) % self.frame_cycles == 0:
+                on_frame(cpu, (cpu.cycles - start) // self.frame_cycles)
+        return cpu.cycles - start
+
+
+def screen_digest(ram):
+    """Returns the SHA-1 of the screen memory, for checking a replay's final picture."""
+    return hashlib.sha1(screen_words(ram).tobytes()).hexdigest()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Replay a keyboard input script on a Hack program.")
+    argparser.add_argument("filename", help="the Xxx.hack, Xxx.hackb or Xxx.asm program to run")
+    argparser.add_argument("script", help="the input script")
+    argparser.add_argument("--cycles", type=int, default=10 ** 7, help="stop after this many instructions")
+    argparser.add_argument("--frame-cycles", type=int, default=FRAME_CYCLES, help="instructions per frame")
+    argparser.add_argument("--frames", metavar="DIR",
+                           help="write a PNG to DIR at every frame whose screen changed; "
+                                "without it the replay fast-forwards between events")
+    argparser.add_argument("--translate", action="store_true", help="run on the block translator")
+    args = argparser.parse_args()
+
+    script = InputScript.from_file(args.script, args.frame_cycles)
+    cpu = BlockTranslator() if args.translate else CPUEmulator()
+    cpu.load(args.filename)
+    on_frame = None
+    if args.frames:
+        os.makedirs(args.frames, exist_ok=True)
+        framebuffer = Framebuffer()
+
+        def on_frame(cpu, frame):
+            framebuffer.dump(cpu.ram, os.path.join(args.frames, "frame%06d.png" % frame), only_changed=True)
+
+    start = time.perf_counter()
+    cycles = script.replay(cpu, args.cycles, on_frame)
+    elapsed = time.perf_counter() - start
+    print("%d instructions, %d events in %.3f s (%.2f M instructions/s)%s" % (
+        cycles, len(script.events), elapsed, cycles / elapsed / 1e6, ", halted" if cpu.halted else ""))
+    print("screen %s" % screen_digest(cpu.ram))
+
+
+if __name__ == "__main__":
+    main()
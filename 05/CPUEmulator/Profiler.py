@@ -0,0 +1,208 @@
+from CPUEmulator import CPUEmulator, MEMORY_SIZE, OP_A
+from SourceMap import SourceMap
+from array import array
+import argparse
+import os
+
+LCL = 1
+# Name of the bottom stack frame, for the code run before the first call (the bootstrap)
+ROOT = "[start]"
+
+
+class Profiler(CPUEmulator):
+    """
+    A CPUEmulator that counts where the cycles go.
+
+    Every executed instruction bumps a hit counter for its ROM address. Taken
+    jumps to the same or an earlier address are back-edges, and they are counted
+    to find hot loops. A call stack is rebuilt from control transfers. Landing on
+    a function label (Xxx.yyy, from the program's SourceMap) is a call; the VM
+    calling convention leaves the return address at RAM[LCL - 5] on entry. Later,
+    landing on a return address that is on the stack is a return. Cycles are
+    charged to the stack that was current when they ran, which gives
+    flamegraph-style collapsed stacks.
+    """
+
+    def __init__(self, rom=None, source_map=None):
+        """
+        @attr self.source_map (SourceMap): where addresses came from, or None
+        @attr self.hits (array): ROM address -> times executed
+        @attr self.back_edges (dict): (jump address, target address) -> times taken
+        @attr self.calls (dict): function -> times called
+        @attr self.stacks (dict): "f;g;h" call stack -> cycles run in it
+        @attr self.stack (list of (str, int)): the current (function, return address) frames
+        """
+        self.source_map = source_map
+        CPUEmulator.__init__(self, rom)
+
+    def load(self, filename):
+        """Loads a program like CPUEmulator.load, with its SourceMap: built from a .asm file, or read from the Xxx.map sidecar."""
+        name = os.path.splitext(filename)[0]
+        if filename.endswith(".asm"):
+            self.source_map = SourceMap.from_file(filename)
+        elif os.path.exists(name + ".map"):
+            self.source_map = SourceMap.load(name + ".map")
+        CPUEmulator.load(self, filename)
+
+    def reset(self):
+        """Restarts the program like CPUEmulator.reset and clears the profile."""
+        CPUEmulator.reset(self)
+        self.hits = array("Q", bytes(8 * MEMORY_SIZE))
+        self.back_edges = {}
+        self.calls = {}
+        self.stacks = {}
+        self.stack = [(ROOT, -1)]
+        self._key = ROOT
+        self._mark = 0
+        self._returns = {}
+        self.entries = {}
+        if self.source_map is not None:
+            for label, address in self.source_map.labels.items():
+                if SourceMap.is_function(label):
+                    self.entries[address] = label
+
+    def _charge(self):
+        """Charges the cycles run since the last stack change to the current stack."""
+        self.stacks[self._key] = self.stacks.get(self._key, 0) + self.cycles - self._mark
+        self._mark = self.cycles
+
+    def _call(self, function):
+        """Pushes a frame for function, entered just now."""
+        self._charge()
+        return_address = self.ram[(self.ram[LCL] - 5) & 0x7FFF]
+        self.stack.append((function, return_address))
+        self._returns[return_address] = self._returns.get(return_address, 0) + 1
+        self.calls[function] = self.calls.get(function, 0) + 1
+        self._key += ";" + function
+
+    def _return(self, address):
+        """Pops frames down to and including the innermost one returning to address."""
+        self._charge()
+        while True:
+            _, return_address = self.stack.pop()
+            self._returns[return_address] -= 1
+            if not self._returns[return_address]:
+                del self._returns[return_address]
+            if return_address == address:
+                break
+        self._key = ";".join(function for function, _ in self.stack)
+
+    def run(self, max_cycles=None):
+        """Runs like CPUEmulator.run, one profiled instruction at a time."""
+        hits = self.hits
+        back_edges = self.back_edges
+        entries = self.entries
+        returns = self._returns
+        limit = max_cycles if max_cycles is not None else float("inf")
+        n = 0
+        while n < limit and not self.halted:
+            pc = self.pc & 0x7FFF
+            self.step()
+            n += 1
+            hits[pc] += 1
+            target = self.pc
+            if target != pc + 1 and not self.halted:
+                if target <= pc:
+                    edge = (pc, target)
+                    back_edges[edge] = back_edges.get(edge, 0) + 1
+                function = entries.get(target)
+                if function is not None:
+                    self._call(function)
+                elif target in returns:
+                    self._return(target)
+        self._charge()
+        return n
+
+    def describe(self, address):
+        """Returns "address (asm line, VM command)" for a ROM address, as far as the SourceMap knows."""
+        if self.source_map is None or address >= len(self.source_map):
+            return "%5d" % address
+        line, vm, _ = self.source_map.lookup(address)
+        return "%5d (line %d%s)" % (address, line, ", " + vm if vm else "")
+
+    def function_of(self, address):
+        """Returns the function the instruction at address belongs to, by its label."""
+        function = self.source_map.function_at(address) if self.source_map is not None else None
+        return function or "[no function]"
+
+    def function_profile(self):
+        """Returns {function: (self cycles, inclusive cycles, calls)}."""
+        own = {}
+        for address, count in enumerate(self.hits):
+            if count:
+                function = self.function_of(address)
+                own[function] = own.get(function, 0) + count
+        inclusive = {}
+        for key, cycles in self.stacks.items():
+            for function in set(key.split(";")):
+                inclusive[function] = inclusive.get(function, 0) + cycles
+        return {function: (own.get(function, 0), inclusive.get(function, 0), self.calls.get(function, 0))
+                for function in set(own) | set(self.calls)}
+
+    def hot_loops(self):
+        """
+        Returns [(cycles in body, iterations, start, end)] for each loop, hottest first.
+        A loop is a back-edge to a literal "@target" address in the same function.
+        Computed jumps back, such as returns, and jumps to call helpers or function
+        entries are not loops.
+        """
+        loops = [(sum(self.hits[target:source + 1]), count, target, source)
+                 for (source, target), count in self.back_edges.items()
+                 if self.program[source - 1] == (OP_A, target, 0, 0) and target not in self.entries
+                 and self.function_of(source) == self.function_of(target)]
+        return sorted(loops, reverse=True)
+
+    def report(self, top=20):
+        """Returns the text report: the most expensive functions, loops and instructions."""
+        total = self.cycles or 1
+        lines = ["%d instructions" % self.cycles, "",
+                 "%-40s %12s %7s %12s %7s %8s" % ("function", "self", "%", "inclusive", "%", "calls")]
+        profile = sorted(self.function_profile().items(), key=lambda item: item[1][0], reverse=True)
+        for function, (own, inclusive, calls) in profile[:top]:
+            lines.append("%-40s %12d %6.2f%% %12d %6.2f%% %8d" % (
+                function, own, 100.0 * own / total, inclusive, 100.0 * inclusive / total, calls))
+
+        lines += ["", "%-40s %12s %7s %10s  %s" % ("loop", "cycles", "%", "iterations", "body")]
+        for cycles, iterations, start, end in self.hot_loops()[:top]:
+            lines.append("%-40s %12d %6.2f%% %10d  %d-%d" % (
+                self.function_of(start), cycles, 100.0 * cycles / total, iterations, start, end))
+
+        lines += ["", "%-40s %12s %7s  %s" % ("function", "hits", "%", "instruction")]
+        hottest = sorted(range(MEMORY_SIZE), key=self.hits.__getitem__, reverse=True)[:top]
+        for address in hottest:
+            if self.hits[address]:
+                lines.append("%-40s %12d %6.2f%%  %s" % (
+                    self.function_of(address), self.hits[address], 100.0 * self.hits[address] / total,
+                    self.describe(address)))
+        return "\n".join(lines)
+
+    def save_collapsed(self, filename):
+        """Writes the collapsed stacks, one "f;g;h cycles" line per stack, as flamegraph.pl reads them."""
+        with open(filename, "w") as f:
+            for key, cycles in sorted(self.stacks.items()):
+                if cycles:
+                    f.write("%s %d\n" % (key, cycles))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Profile a Hack program by ROM address, loop and function.")
+    argparser.add_argument("filename", help="the Xxx.asm program, or Xxx.hack / Xxx.hackb next to its Xxx.map")
+    argparser.add_argument("--cycles", type=int, default=10 ** 6, help="stop after this many instructions")
+    argparser.add_argument("--top", type=int, default=20, help="rows in each table of the report")
+    argparser.add_argument("--collapsed", metavar="FILE", help="write collapsed stacks for flamegraph.pl to FILE")
+    argparser.add_argument("--set", nargs=2, type=int, action="append", default=[], metavar=("ADDRESS", "VALUE"),
+                           help="store VALUE in RAM[ADDRESS] before running; may be repeated")
+    args = argparser.parse_args()
+
+    profiler = Profiler()
+    profiler.load(args.filename)
+    for address, value in args.set:
+        profiler.ram[address] = value & 0xFFFF
+    profiler.run(args.cycles)
+    print(profiler.report(args.top))
+    if args.collapsed:
+        profiler.save_collapsed(args.collapsed)
+
+
+if __name__ == "__main__":
+    main()
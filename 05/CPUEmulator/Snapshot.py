@@ -0,0 +1,58 @@
+from CPUEmulator import MEMORY_SIZE
+from array import array
+import hashlib
+import mmap
+import struct
+import sys
+
+# Snapshot file layout, all little-endian:
+#   0  magic "HKSN", u16 version, u16 PC, u16 A, u16 D, u16 halted, 2 pad bytes,
+#      u64 cycles, 20-byte SHA-1 of the 32K ROM, zero padding up to RAM_OFFSET
+#   64 the 32K RAM words
+MAGIC = b"HKSN"
+VERSION = 1
+HEADER = struct.Struct("<4sHHHHH2xQ20s")
+RAM_OFFSET = 64
+SNAPSHOT_SIZE = RAM_OFFSET + 2 * MEMORY_SIZE
+
+
+def rom_digest(cpu):
+    """
+    Returns the SHA-1 digest of the emulator's whole 32K ROM. It is remembered
+    until load_rom() replaces cpu.program, so restoring checkpoints of one program
+    over and over hashes its ROM once.
+    """
+    program, digest = getattr(cpu, "_rom_digest", (None, None))
+    if program is not cpu.program:
+        digest = hashlib.sha1(cpu.rom.tobytes()).digest()
+        cpu._rom_digest = (cpu.program, digest)
+    return digest
+
+
+def save_snapshot(cpu, filename):
+    """Writes the emulator's PC, A, D, cycle count, ROM digest and RAM to filename."""
+    header = HEADER.pack(MAGIC, VERSION, cpu.pc, cpu.a, cpu.d, cpu.halted, cpu.cycles, rom_digest(cpu))
+    words = array("H", cpu.ram)
+    if sys.byteorder != "little":
+        words.byteswap()
+    with open(filename, "wb") as f:
+        f.write(header.ljust(RAM_OFFSET, b"\0"))
+        f.write(words.tobytes())
+
+
+def load_snapshot(cpu, filename):
+    """
+    Restores a snapshot written by save_snapshot into an emulator that holds the
+    same ROM. The file is mapped copy-on-write and cpu.ram becomes a memoryview
+    over it, so nothing is copied up front; the program's writes go to private
+    pages and never reach the file.
+    """
+    assert sys.byteorder == "little", "snapshots can only be mapped on little-endian machines"
+    with open(filename, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    assert len(mapped) == SNAPSHOT_SIZE, "%s is not a snapshot" % filename
+    magic, version, pc, a, d, halted, cycles, digest = HEADER.unpack_from(mapped)
+    assert magic == MAGIC and version == VERSION, "%s is not a version %d snapshot" % (filename, VERSION)
+    assert digest == rom_digest(cpu), "%s was taken with a different program in ROM" % filename
+    cpu.ram = memoryview(mapped)[RAM_OFFSET:].cast("H")
+    cpu.pc, cpu.a, cpu.d, cpu.cycles, cpu.halted = pc, a, d, cycles, bool(halted)
@@ -0,0 +1,341 @@
+from CPUEmulator import CPUEmulator, to_signed
+from BlockTranslator import BlockTranslator
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import re
+import time
+
+# The Computer chip's RAM16K and the CPU emulator's RAM are the same memory
+MEMORY_NAME = re.compile(r"(RAM|RAM16K)\[(\d+)\]$")
+# Registers by their CPU emulator and Computer chip names; the chip's take any subscript
+REGISTER_NAME = re.compile(r"(PC|A|D)$|(PC|ARegister|DRegister)\[\d*\]$")
+FORMAT = re.compile(r"(.+)%([BDSX])(\d+)\.(\d+)\.(\d+)$")
+TOKEN = re.compile(r'"[^"]*"|[,;{}]|[^\s,;{}]+')
+
+# Chips that the emulator stands in for: a script that loads one runs on the emulator
+EMULATED_CHIPS = ("Computer.hdl",)
+
+
+class ScriptError(Exception):
+    """A test script uses something this runner does not support."""
+
+
+def tokenize(text):
+    """Splits a test script into words, strings and the , ; { } separators, dropping comments."""
+    text = re.sub(r"/\*.*?\*/", " ", text, flags=re.S)
+    text = re.sub(r"//[^\n]*", " ", text)
+    return TOKEN.findall(text)
+
+
+def parse(tokens, position=0, nested=False):
+    """
+    Parses tokens into a list of commands, each a list of words, with
+    ["repeat", count, body] for repeat blocks and the words followed by the body
+    for other blocks (while). Returns (commands, position).
+    """
+    commands = []
+    command = []
+    while position < len(tokens):
+        token = tokens[position]
+        position += 1
+        if token in ",;":
+            if command:
+                commands.append(command)
+            command = []
+        elif token == "{":
+            if not command:
+                raise ScriptError("'{' without a repeat or while")
+            body, position = parse(tokens, position, True)
+            if command[0] == "repeat":
+                commands.append(["repeat", int(command[1]) if len(command) > 1 else -1, body])
+            else:
+                commands.append(command + [body])
+            command = []
+        elif token == "}":
+            if not nested:
+                raise ScriptError("unbalanced '}'")
+            if command:
+                commands.append(command)
+            return commands, position
+        else:
+            command.append(token)
+    if nested:
+        raise ScriptError("missing '}'")
+    if command:
+        commands.append(command)
+    return commands, position
+
+
+def parse_number(word):
+    """Reads a script value: decimal, or %B binary, %X hex, %D decimal."""
+    if word.startswith("%"):
+        return int(word[2:], {"B": 2, "X": 16, "D": 10}[word[1].upper()])
+    return int(word)
+
+
+def format_value(value, kind, width):
+    """Formats one output value like the nand2tetris tools: %D signed, %B and %X zero-padded, %S as is."""
+    if kind == "S":
+        return str(value).ljust(width)[:width]
+    if kind == "D":
+        return str(to_signed(value)).rjust(width)
+    if kind == "B":
+        return format(value & ((1 << width) - 1), "0%db" % width)
+    return format(value, "0%dX" % width)[-width:]
+
+
+def lines_match(line, expected):
+    """Compares an output line with a .cmp line, where "*" in the .cmp matches any character."""
+    line, expected = line.rstrip(), expected.rstrip()
+    return len(line) == len(expected) and all(e == "*" or l == e for l, e in zip(line, expected))
+
+
+class TestRunner:
+    """
+    Runs a CPU-level test script (the ROM32K / load, set, repeat, tick / tock,
+    output-list subset of the nand2tetris test language) on the emulator. The
+    output is written to the script's output file and compared line by line
+    with its .cmp file.
+
+    Scripts written for the CPU emulator (load Xxx.asm or Xxx.hack) and for the
+    Computer chip (load Computer.hdl, ROM32K load Xxx.hack) both run, since the
+    emulator behaves as the Computer chip: each tock executes one instruction,
+    RAM16K[n] is RAM[n], ARegister[], DRegister[] and PC[] are the registers and
+    "set reset 1" sends the PC to 0 on the next tock.
+    """
+
+    def __init__(self, filename, translate=False):
+        """
+        @attr self.directory (str): where the script's files are looked up
+        @attr self.cpu (CPUEmulator): the machine under test
+        @attr self.outputs (list of (str, str, int, int, int)): the output-list columns, (name, kind, left, width, right)
+        @attr self.lines (list of str): output lines so far, the header first
+        @attr self.compare (list of str): the lines of the compare-to file, or None
+        @attr self.mismatch (int): the first output line that differs from self.compare, or None
+        """
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.cpu = BlockTranslator() if translate else CPUEmulator()
+        self.reset = 0
+        self.time = 0
+        self.half = False
+        self.output_file = None
+        self.outputs = []
+        self.lines = []
+        self.compare = None
+        self.mismatch = None
+
+    def run(self):
+        """Runs the whole script. Returns True if the output matched the compare-to file."""
+        with open(self.filename, "r") as f:
+            commands, _ = parse(tokenize(f.read()))
+        self.execute(commands)
+        if self.output_file:
+            with open(self.output_file, "w") as f:
+                f.writelines(line + "\n" for line in self.lines)
+        return self.mismatch is None
+
+    def execute(self, commands):
+        """Executes a list of parsed commands."""
+        for command in commands:
+            name = command[0]
+            if name == "repeat":
+                count, body = command[1], command[2]
+                if count < 0:
+                    raise ScriptError("repeat without a count")
+                if all(c in (["ticktock"], ["tick"], ["tock"]) for c in body) and body.count(["tick"]) == body.count(["tock"]):
+                    # a pure run of clock cycles: let the emulator run them in one go
+                    self.cycle(count * (body.count(["ticktock"]) + body.count(["tock"])))
+                else:
+                    for _ in range(count):
+                        self.execute(body)
+            elif name == "load":
+                self.load(command[1])
+            elif name == "ROM32K" and command[1:2] == ["load"]:
+                self.cpu.load(os.path.join(self.directory, command[2]))
+            elif name == "output-file":
+                self.output_file = os.path.join(self.directory, command[1])
+            elif name == "compare-to":
+                with open(os.path.join(self.directory, command[1]), "r") as f:
+                    self.compare = f.read().splitlines()
+            elif name == "output-list":
+                self.output_list(command[1:])
+            elif name == "set":
+                self.set(command[1], parse_number(command[2]))
+            elif name == "tick":
+                self.half = True
+            elif name == "tock":
+                self.cycle(1)
+            elif name == "ticktock":
+                self.cycle(1)
+            elif name == "output":
+                self.output()
+            elif name in ("echo", "clear-echo", "breakpoint", "clear-breakpoints"):
+                pass
+            else:
+                raise ScriptError("unsupported command %r" % name)
+
+    def load(self, program):
+        """Handles "load": a program for the CPU emulator, or the Computer chip."""
+        if program in EMULATED_CHIPS:
+            return
+        if program.endswith(".hdl"):
+            raise ScriptError("%s is a chip test, not a CPU test" % program)
+        self.cpu.load(os.path.join(self.directory, program))
+
+    def cycle(self, count):
+        """
+        Runs count clock cycles. The emulator stops at the end-of-program loop
+        ("@n 0;JMP" back onto itself), which on the hardware keeps alternating
+        between its two instructions, so the remaining cycles only decide which of
+        the two the PC is left on.
+        """
+        if count <= 0:
+            return
+        cpu = self.cpu
+        if self.reset:
+            # the instruction still executes, but the PC is loaded with 0
+            for _ in range(count):
+                cpu.step()
+                cpu.pc = 0
+            cpu.halted = False
+        else:
+            done = cpu.run(count)
+            if done < count and (count - done) % 2:
+                cpu.step()
+        self.time += count
+        self.half = False
+
+    def set(self, name, value):
+        """Handles "set name value"."""
+        cpu = self.cpu
+        memory = MEMORY_NAME.match(name)
+        register = self.register(name)
+        if memory:
+            cpu.ram[int(memory.group(2))] = value & 0xFFFF
+        elif register == "PC":
+            cpu.pc = value & 0x7FFF
+            cpu.halted = False
+        elif register == "A":
+            cpu.a = value & 0xFFFF
+        elif register == "D":
+            cpu.d = value & 0xFFFF
+        elif name == "reset":
+            self.reset = value
+        else:
+            raise ScriptError("cannot set %s" % name)
+
+    @staticmethod
+    def register(name):
+        """Returns "PC", "A" or "D" for a register name such as ARegister[] or PC, else None."""
+        match = REGISTER_NAME.match(name)
+        if not match:
+            return None
+        register = match.group(1) or match.group(2)
+        return register if register == "PC" else register[0]
+
+    def get(self, name):
+        """Returns the value of an output-list variable."""
+        cpu = self.cpu
+        memory = MEMORY_NAME.match(name)
+        register = self.register(name)
+        if memory:
+            return cpu.ram[int(memory.group(2))]
+        if register == "PC":
+            return cpu.pc
+        if register == "A":
+            return cpu.a
+        if register == "D":
+            return cpu.d
+        if name == "reset":
+            return self.reset
+        if name == "time":
+            return "%d%s" % (self.time, "+" if self.half else "")
+        raise ScriptError("cannot output %s" % name)
+
+    def output_list(self, columns):
+        """Handles "output-list": sets the columns and writes the header line."""
+        self.outputs = []
+        for column in columns:
+            match = FORMAT.match(column)
+            if not match:
+                raise ScriptError("bad output-list entry %r" % column)
+            name, kind, left, width, right = match.groups()
+            self.outputs.append((name, kind, int(left), int(width), int(right)))
+        header = []
+        for name, kind, left, width, right in self.outputs:
+            total = left + width + right
+            name = name[:total]
+            pad = total - len(name)
+            header.append(" " * (pad // 2) + name + " " * (pad - pad // 2))
+        self.emit("|" + "|".join(header) + "|")
+
+    def output(self):
+        """Handles "output": writes one line of the output-list values."""
+        cells = [" " * left + format_value(self.get(name), kind, width) + " " * right
+                 for name, kind, left, width, right in self.outputs]
+        self.emit("|" + "|".join(cells) + "|")
+
+    def emit(self, line):
+        """Appends an output line and checks it against the compare-to file."""
+        if self.compare is not None and self.mismatch is None:
+            index = len(self.lines)
+            if index >= len(self.compare) or not lines_match(line, self.compare[index]):
+                self.mismatch = index
+        self.lines.append(line)
+
+    def describe(self):
+        """Returns a one-line verdict, with the first differing line on failure."""
+        if self.compare is None:
+            return "%s: done, nothing to compare" % self.filename
+        if self.mismatch is None:
+            return "%s: passed" % self.filename
+        index = self.mismatch
+        expected = self.compare[index] if index < len(self.compare) else "(end of file)"
+        return "%s: comparison failure at line %d\n  expected %s\n  got      %s" % (
+            self.filename, index + 1, expected, self.lines[index])
+
+
+def run_script(filename, translate=False):
+    """Runs one script, returning (passed or None if not a CPU test, verdict, seconds)."""
+    start = time.perf_counter()
+    runner = TestRunner(filename, translate)
+    try:
+        passed = runner.run()
+    except ScriptError as error:
+        return None, "%s: skipped, %s" % (filename, error), time.perf_counter() - start
+    return passed, runner.describe(), time.perf_counter() - start
+
+
+def find_scripts(paths):
+    """Expands directories into the .tst files in them."""
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".tst"))
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run CPU-level .tst scripts on the emulator and compare to their .cmp files.")
+    argparser.add_argument("paths", nargs="+", help="Xxx.tst scripts, or directories of them")
+    argparser.add_argument("--workers", type=int, default=os.cpu_count(), help="scripts to run at once")
+    argparser.add_argument("--translate", action="store_true", help="run on the block translator")
+    args = argparser.parse_args()
+
+    scripts = find_scripts(args.paths)
+    with ProcessPoolExecutor(args.workers) as pool:
+        results = list(pool.map(run_script, scripts, [args.translate] * len(scripts)))
+    for passed, verdict, seconds in results:
+        print("%s (%.3f s)" % (verdict, seconds))
+    failed = sum(passed is False for passed, _, _ in results)
+    skipped = sum(passed is None for passed, _, _ in results)
+    print("%d passed, %d failed, %d skipped" % (len(results) - failed - skipped, failed, skipped))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,72 @@
+from CPUEmulator import to_signed
+from TraceRecorder import NO_WRITE, read_trace
+from SourceMap import SourceMap
+import argparse
+import os
+
+
+class TraceDecoder:
+    """
+    Prints a trace file written by TraceRecorder, one instruction per line:
+    its cycle and ROM address, A and D after it, the RAM word it wrote, and,
+    with the program's SourceMap, the function, .asm line and VM command it
+    came from. With the .asm file itself the source text is shown too.
+    """
+
+    def __init__(self, filename, source_map=None, asm_lines=None):
+        """
+        @attr self.first_cycle (int): the cycle of the first record
+        @attr self.records (ndarray): the (n, 5) records, oldest first
+        @attr self.source_map (SourceMap): where the addresses came from, or None
+        @attr self.asm_lines (list of str): the lines of the .asm source, or None
+        """
+        self.first_cycle, self.records = read_trace(filename)
+        self.source_map = source_map
+        self.asm_lines = asm_lines
+
+    @classmethod
+    def open(cls, filename, program=None):
+        """Opens a trace with the SourceMap of program: an Xxx.asm file, or the Xxx.map sidecar of Xxx.hack."""
+        if program is None:
+            return cls(filename)
+        if program.endswith(".asm"):
+            with open(program, "r") as f:
+                lines = f.readlines()
+            return cls(filename, SourceMap.build(lines, program), lines)
+        return cls(filename, SourceMap.load(os.path.splitext(program)[0] + ".map"))
+
+    def describe(self, address):
+        """Returns "function  line n  VM command  | source" for a ROM address, as far as the SourceMap knows."""
+        if self.source_map is None or address >= len(self.source_map):
+            return ""
+        line, vm, function = self.source_map.lookup(address)
+        text = "%-30s line %-6d %-24s" % (function or "", line, vm or "")
+        if self.asm_lines is not None:
+            text += " | " + self.asm_lines[line - 1].strip()
+        return text
+
+    def lines(self, last=None):
+        """Yields one formatted line per record, for the last records only if last is given."""
+        start = 0 if last is None else max(0, len(self.records) - last)
+        for index in range(start, len(self.records)):
+            pc, a, d, address, value = (int(field) for field in self.records[index])
+            write = "RAM[%5d]=%6d" % (address, to_signed(value)) if address != NO_WRITE else " " * 18
+            yield "%10d %5d  A=%6d D=%6d  %s  %s" % (
+                self.first_cycle + index, pc, to_signed(a), to_signed(d), write, self.describe(pc))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Print a trace written by TraceRecorder.")
+    argparser.add_argument("trace", help="the Xxx.trace file")
+    argparser.add_argument("--program", metavar="FILE",
+                           help="the traced Xxx.asm, or Xxx.hack / Xxx.hackb next to its Xxx.map, to annotate addresses")
+    argparser.add_argument("--last", type=int, help="print only the last LAST instructions")
+    args = argparser.parse_args()
+
+    decoder = TraceDecoder.open(args.trace, args.program)
+    for line in decoder.lines(args.last):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
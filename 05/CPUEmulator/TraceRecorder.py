@@ -0,0 +1,209 @@
+from CPUEmulator import CPUEmulator, OP_A, OP_HALT, OP_TRAP, OP_WRAP, compute, jump_taken
+from SourceMap import SourceMap
+import argparse
+import numpy as np
+import os
+import struct
+
+# One trace record is FIELDS words: PC, A and D after the instruction, the RAM
+# address it wrote (NO_WRITE if none) and the value written there
+FIELDS = 5
+NO_WRITE = 0xFFFF
+
+# Trace file layout, all little-endian:
+#   0  magic "HKTR", u16 version, u16 fields per record, u64 cycle of the first
+#      record, u64 number of records
+#   24 the records, oldest first, as u16 words
+MAGIC = b"HKTR"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQQ")
+
+
+def write_trace(filename, records, first_cycle):
+    """Writes an (n, FIELDS) array of trace records, oldest first, to filename."""
+    with open(filename, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, FIELDS, first_cycle, len(records)))
+        f.write(np.ascontiguousarray(records, dtype="<u2").tobytes())
+
+
+def read_trace(filename):
+    """Reads a trace file. Returns (cycle of the first record, (n, FIELDS) uint16 array of records)."""
+    with open(filename, "rb") as f:
+        data = f.read()
+    magic, version, fields, first_cycle, count = HEADER.unpack_from(data)
+    assert magic == MAGIC and version == VERSION, "%s is not a version %d trace" % (filename, VERSION)
+    assert len(data) == HEADER.size + 2 * fields * count, "%s is truncated" % filename
+    records = np.frombuffer(data, dtype="<u2", offset=HEADER.size).reshape(count, fields)
+    return first_cycle, records.astype(np.uint16)
+
+
+class TraceRecorder(CPUEmulator):
+    """
+    A CPUEmulator that keeps the last capacity instructions it ran.
+
+    Every instruction leaves one record of its PC, the A and D registers after
+    it, and the RAM address and value it wrote. The records go into a NumPy ring
+    buffer allocated up front. They are written as plain words through a
+    memoryview, so recording makes no tuple or list per step. When the program
+    halts or reaches a breakpoint, the buffer is written to trace_file, oldest
+    record first, for TraceDecoder.py to print.
+    """
+
+    def __init__(self, rom=None, capacity=1 << 16, source_map=None, trace_file=None):
+        """
+        @attr self.buffer (ndarray): capacity * FIELDS uint16 words, the ring of records
+        @attr self.source_map (SourceMap): the labels of the loaded program, for breakpoints by name
+        @attr self.breakpoints (set): ROM addresses to stop at, before running the instruction there
+        @attr self.trace_file (str): where the trace is written on a halt or breakpoint, or None
+        @attr self.recorded (int): records written since the last reset, including overwritten ones
+        @attr self.stopped_at (int): the breakpoint the last run stopped at, or None
+        """
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity * FIELDS, dtype=np.uint16)
+        self._slots = memoryview(self.buffer)
+        self.source_map = source_map
+        self.breakpoints = set()
+        self.trace_file = trace_file
+        CPUEmulator.__init__(self, rom)
+
+    def load(self, filename):
+        """Loads a program like CPUEmulator.load, with its SourceMap: built from a .asm file, or read from the Xxx.map sidecar."""
+        name = os.path.splitext(filename)[0]
+        if filename.endswith(".asm"):
+            self.source_map = SourceMap.from_file(filename)
+        elif os.path.exists(name + ".map"):
+            self.source_map = SourceMap.load(name + ".map")
+        CPUEmulator.load(self, filename)
+
+    def reset(self):
+        """Restarts the program like CPUEmulator.reset and empties the trace."""
+        CPUEmulator.reset(self)
+        self.recorded = 0
+        self.stopped_at = None
+
+    def add_breakpoint(self, where):
+        """Stops runs before the instruction at where: a ROM address, or a label such as Sys.halt."""
+        if isinstance(where, str) and not where.isdigit():
+            assert self.source_map is not None and where in self.source_map.labels, "unknown label %s" % where
+            self.breakpoints.add(self.source_map.labels[where])
+        else:
+            self.breakpoints.add(int(where))
+
+    def records(self):
+        """Returns the kept records, oldest first, as an (n, FIELDS) array."""
+        kept = min(self.recorded, self.capacity)
+        ring = self.buffer.reshape(self.capacity, FIELDS)
+        if self.recorded <= self.capacity:
+            return ring[:kept].copy()
+        position = self.recorded % self.capacity
+        return np.concatenate((ring[position:], ring[:position]))
+
+    def save_trace(self, filename):
+        """Writes the kept records to filename."""
+        write_trace(filename, self.records(), self.cycles - min(self.recorded, self.capacity))
+
+    def run(self, max_cycles=None):
+        """
+        Runs like CPUEmulator.run, recording every instruction, and also stops
+        before a breakpoint (though not at the one it starts on). On a halt or
+        breakpoint the trace is saved to trace_file.
+        """
+        program = self.program
+        ram = self.ram
+        slots = self._slots
+        breakpoints = self.breakpoints
+        end = self.capacity * FIELDS
+        position = self.recorded % self.capacity * FIELDS
+        pc = self.pc
+        a = self.a
+        d = self.d
+        limit = max_cycles if max_cycles is not None else float("inf")
+        self.stopped_at = None
+        halted = False
+        n = 0
+        while n < limit:
+            if pc in breakpoints and n:
+                self.stopped_at = pc
+                break
+            op, arg, dest, jump = program[pc]
+            if op == OP_WRAP:
+                pc = 0
+                continue
+            assert op != OP_TRAP, "traps are not traced"
+            n += 1
+            address = pc
+            written = NO_WRITE
+            out = 0
+            if op == OP_A:
+                a = arg
+                pc += 1
+            else:
+                y = ram[a & 0x7FFF] if arg & 0b1000000 else a
+                out = compute(op, arg, d, y)
+                target = a
+                if dest & 1:
+                    written = a & 0x7FFF
+                    ram[written] = out
+                if dest & 2:
+                    d = out
+                if dest & 4:
+                    a = out
+                if op == OP_HALT:
+                    pc -= 1
+                    halted = True
+                elif jump and jump_taken(jump, out):
+                    pc = target & 0x7FFF
+                else:
+                    pc += 1
+            slots[position] = address
+            slots[position + 1] = a
+            slots[position + 2] = d
+            slots[position + 3] = written
+            slots[position + 4] = out if written != NO_WRITE else 0
+            position += FIELDS
+            if position == end:
+                position = 0
+            if halted:
+                self.halted = True
+                break
+        self.pc = pc & 0x7FFF
+        self.a = a
+        self.d = d
+        self.cycles += n
+        self.recorded += n
+        if self.trace_file and (self.halted or self.stopped_at is not None):
+            self.save_trace(self.trace_file)
+        return n
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run a Hack program, keeping a trace of its last instructions.")
+    argparser.add_argument("filename", help="the Xxx.asm program, or Xxx.hack / Xxx.hackb (next to its Xxx.map for labels)")
+    argparser.add_argument("--cycles", type=int, default=10 ** 7, help="stop after this many instructions")
+    argparser.add_argument("--capacity", type=int, default=1 << 16, help="instructions kept in the trace")
+    argparser.add_argument("--break", dest="breakpoints", action="append", default=[], metavar="WHERE",
+                           help="stop at a ROM address or label such as Sys.halt; may be repeated")
+    argparser.add_argument("--out", metavar="FILE", help="the trace file (default Xxx.trace)")
+    argparser.add_argument("--set", nargs=2, type=int, action="append", default=[], metavar=("ADDRESS", "VALUE"),
+                           help="store VALUE in RAM[ADDRESS] before running; may be repeated")
+    args = argparser.parse_args()
+
+    out = args.out or os.path.splitext(args.filename)[0] + ".trace"
+    cpu = TraceRecorder(capacity=args.capacity, trace_file=out)
+    cpu.load(args.filename)
+    for where in args.breakpoints:
+        cpu.add_breakpoint(where)
+    for address, value in args.set:
+        cpu.ram[address] = value & 0xFFFF
+    cycles = cpu.run(args.cycles)
+    if cpu.stopped_at is not None:
+        print("%d instructions, stopped at breakpoint %d" % (cycles, cpu.stopped_at))
+    else:
+        print("%d instructions%s" % (cycles, ", halted" if cpu.halted else ""))
+        if not cpu.halted:
+            cpu.save_trace(out)
+    print("last %d instructions written to %s" % (min(cpu.recorded, cpu.capacity), out))
+
+
+if __name__ == "__main__":
+    main()
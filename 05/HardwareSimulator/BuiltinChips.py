@@ -0,0 +1,237 @@
+from array import array
+import os
+import sys
+
+# The assembler's modules (RomImage) live in 06/assembler
+ASSEMBLER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "06", "assembler")
+if ASSEMBLER_DIR not in sys.path:
+    sys.path.append(ASSEMBLER_DIR)
+
+from RomImage import load_rom
+
+
+class BuiltinChip:
+    """
+    A chip modelled in Python instead of gates. The netlist feeds it whole pin
+    values and takes whole pin values back.
+
+    evaluate() returns the outputs for the current inputs. The outputs may only
+    follow the COMBINATIONAL inputs at once; the others (in, load) are read by
+    tick() and take effect at tock(), like the DFFs of a flattened chip. That
+    keeps loops such as CPU.outM -> Memory.in -> Memory.out -> CPU.inM free of
+    combinational cycles. Chips with addressable state keep it in self.memory,
+    which the test scripts read and write as Chip[n].
+    """
+
+    # (pin, width) of each IN and OUT pin, in the order evaluate() takes and returns them
+    INPUTS = ()
+    OUTPUTS = ()
+    # The IN pins the outputs follow without waiting for a clock edge
+    COMBINATIONAL = ()
+    # Words of memory, if any
+    SIZE = 0
+
+    def __init__(self):
+        """@attr self.memory (array): the chip's words, or None"""
+        self.memory = array("H", bytes(2 * self.SIZE)) if self.SIZE else None
+
+    def evaluate(self, inputs):
+        """Returns the tuple of output values for the tuple of input values."""
+        raise NotImplementedError
+
+    def tick(self, inputs):
+        """Samples the inputs at the rising clock edge."""
+
+    def tock(self):
+        """Commits what tick() sampled at the falling clock edge."""
+
+
+class Add16(BuiltinChip):
+    """The 16-bit adder, overflow ignored."""
+
+    INPUTS = (("a", 16), ("b", 16))
+    OUTPUTS = (("out", 16),)
+    COMBINATIONAL = ("a", "b")
+
+    def evaluate(self, inputs):
+        return ((inputs[0] + inputs[1]) & 0xFFFF,)
+
+
+class ALU(BuiltinChip):
+    """The Hack ALU: f(x, y) chosen by zx, nx, zy, ny, f and no, with the zr and ng flags of the result."""
+
+    INPUTS = (("x", 16), ("y", 16), ("zx", 1), ("nx", 1), ("zy", 1), ("ny", 1), ("f", 1), ("no", 1))
+    OUTPUTS = (("out", 16), ("zr", 1), ("ng", 1))
+    COMBINATIONAL = ("x", "y", "zx", "nx", "zy", "ny", "f", "no")
+
+    def evaluate(self, inputs):
+        x, y, zx, nx, zy, ny, f, no = inputs
+        if zx:
+            x = 0
+        if nx:
+            x ^= 0xFFFF
+        if zy:
+            y = 0
+        if ny:
+            y ^= 0xFFFF
+        out = (x + y) & 0xFFFF if f else x & y
+        if no:
+            out ^= 0xFFFF
+        return out, int(out == 0), out >> 15
+
+
+class Register(BuiltinChip):
+    """
+    A 16-bit register. memory[0] is its value as the nand2tetris tools show
+    it, which changes at tick; out follows it at tock.
+    """
+
+    INPUTS = (("in", 16), ("load", 1))
+    OUTPUTS = (("out", 16),)
+    SIZE = 1
+
+    def __init__(self):
+        BuiltinChip.__init__(self)
+        self.out = 0
+
+    def evaluate(self, inputs):
+        return (self.out,)
+
+    def tick(self, inputs):
+        if inputs[1]:
+            self.memory[0] = inputs[0]
+
+    def tock(self):
+        self.out = self.memory[0]
+
+
+class PC(Register):
+    """The program counter: reset, else load, else inc, at the clock edge."""
+
+    INPUTS = (("in", 16), ("load", 1), ("inc", 1), ("reset", 1))
+
+    def tick(self, inputs):
+        value, load, inc, reset = inputs
+        if reset:
+            self.memory[0] = 0
+        elif load:
+            self.memory[0] = value
+        elif inc:
+            self.memory[0] = (self.out + 1) & 0xFFFF
+
+
+class RAM(BuiltinChip):
+    """A RAM of SIZE 16-bit words: out is the word at address, written at the clock edge when load is set."""
+
+    COMBINATIONAL = ("address",)
+    OUTPUTS = (("out", 16),)
+
+    def __init__(self):
+        BuiltinChip.__init__(self)
+        self.pending = None
+
+    def evaluate(self, inputs):
+        return (self.memory[inputs[2]],)
+
+    def tick(self, inputs):
+        self.pending = (inputs[2], inputs[0]) if inputs[1] else None
+
+    def tock(self):
+        if self.pending is not None:
+            address, value = self.pending
+            self.memory[address] = value
+            self.pending = None
+
+
+class RAM8(RAM):
+    """8 words."""
+
+    INPUTS = (("in", 16), ("load", 1), ("address", 3))
+    SIZE = 8
+
+
+class RAM64(RAM):
+    """64 words."""
+
+    INPUTS = (("in", 16), ("load", 1), ("address", 6))
+    SIZE = 64
+
+
+class RAM512(RAM):
+    """512 words."""
+
+    INPUTS = (("in", 16), ("load", 1), ("address", 9))
+    SIZE = 512
+
+
+class RAM4K(RAM):
+    """4K words."""
+
+    INPUTS = (("in", 16), ("load", 1), ("address", 12))
+    SIZE = 4096
+
+
+class RAM16K(RAM):
+    """16K words."""
+
+    INPUTS = (("in", 16), ("load", 1), ("address", 14))
+    SIZE = 16384
+
+
+class Screen(RAM):
+    """The 8K-word screen memory map."""
+
+    INPUTS = (("in", 16), ("load", 1), ("address", 13))
+    SIZE = 8192
+
+
+class ROM32K(BuiltinChip):
+    """The instruction memory: out is the word at address. Programs are put in with load()."""
+
+    INPUTS = (("address", 15),)
+    OUTPUTS = (("out", 16),)
+    COMBINATIONAL = ("address",)
+    SIZE = 32768
+
+    def evaluate(self, inputs):
+        return (self.memory[inputs[0]],)
+
+    def load(self, filename):
+        """Loads a .hack or .hackb program, clearing the rest of the ROM."""
+        words = load_rom(filename)
+        assert len(words) <= self.SIZE, "%s does not fit in the 32K ROM" % filename
+        self.memory[:] = array("H", bytes(2 * self.SIZE))
+        self.memory[:len(words)] = array("H", words)
+
+
+class Keyboard(BuiltinChip):
+    """The keyboard register: out is the code of the key held down, set through memory[0]."""
+
+    OUTPUTS = (("out", 16),)
+    SIZE = 1
+
+    def evaluate(self, inputs):
+        return (self.memory[0],)
+
+
+# Chip name -> BuiltinChip class that can stand in for it
+NATIVE_CHIPS = {
+    "Add16": Add16,
+    "ALU": ALU,
+    "Register": Register,
+    "PC": PC,
+    "RAM8": RAM8,
+    "RAM64": RAM64,
+    "RAM512": RAM512,
+    "RAM4K": RAM4K,
+    "RAM16K": RAM16K,
+    "ROM32K": ROM32K,
+    "Screen": Screen,
+    "Keyboard": Keyboard,
+}
+
+# Loaded chip -> the parts simulated with their built-in models unless turned off,
+# as the nand2tetris tools do for a whole computer
+DEFAULT_NATIVES = {
+    "Computer": tuple(NATIVE_CHIPS),
+}
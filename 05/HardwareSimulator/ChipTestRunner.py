@@ -0,0 +1,364 @@
+from EventSimulator import EventSimulator
+from HardwareSimulator import HardwareSimulator, compile_chip
+from HDLParser import HDLError
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import re
+import sys
+import time
+
+# The script language is shared with the CPU emulator's test runner
+CPU_EMULATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CPUEmulator")
+if CPU_EMULATOR_DIR not in sys.path:
+    sys.path.append(CPU_EMULATOR_DIR)
+
+from TestRunner import FORMAT, ScriptError, format_value, lines_match, parse, parse_number, tokenize
+
+# A part's state by name: Chip[n] for a word of a built-in memory, Chip[] for a register
+PART_NAME = re.compile(r"(\w+)\[(\d*)\]$")
+# Commands that need the vectors run one after another
+CLOCK_COMMANDS = ("tick", "tock", "ROM32K")
+# Commands execute() runs; besides these only "ROM32K load" is supported
+COMMANDS = ("repeat", "load", "output-file", "compare-to", "output-list", "set", "eval", "tick", "tock", "output",
+            "echo", "clear-echo", "breakpoint", "clear-breakpoints")
+# Sequential chips with more Nands than this run event-driven; below it a full pass is cheaper
+EVENT_DRIVEN_GATES = 10000
+
+
+class StateError(Exception):
+    """
+    A script sets or outputs state the loaded chip does not expose, such as
+    RAM16K[0] when RAM16K is compiled from .hdl. The script cannot check what
+    it means to here, so it counts as failed rather than skipped.
+    """
+
+
+class ChipTestRunner:
+    """
+    Runs a chip test script (load Xxx.hdl, set, eval, tick / tock, output,
+    repeat) on the HardwareSimulator. The output is written to the script's
+    output file and compared line by line with its .cmp file, like TestRunner
+    does for CPU tests.
+
+    Besides the chip's pins, the output list can show the out pin of a part,
+    such as DRegister[] or PC[], and a word of a built-in memory, such as
+    RAM16K[2], which "set" can write too.
+
+    A script for a combinational chip with no clock commands is run in
+    batch: each eval only records the input vector, each output the vector it
+    shows, and at the end all the vectors are evaluated together in the lanes
+    of one wide simulator pass. Big sequential chips, such as the 03 RAMs,
+    run on the EventSimulator instead.
+    """
+
+    def __init__(self, filename, natives=(), batch=True, event_driven=True, hdl=()):
+        """
+        @attr self.directory (str): where the script's files are looked up
+        @attr self.natives (list of str): chips to simulate with their built-in Python models
+        @attr self.hdl (list of str): chips to compile from .hdl even where a built-in model is the default
+        @attr self.simulator (HardwareSimulator): the chip under test
+        @attr self.outputs (list of (str, str, int, int, int)): the output-list columns, (name, kind, left, width, right)
+        @attr self.lines (list of str): output lines so far, the header first
+        @attr self.compare (list of str): the lines of the compare-to file, or None
+        @attr self.mismatch (int): the first output line that differs from self.compare, or None
+        @attr self.batch (bool): whether the script's vectors are deferred to one wide evaluation
+        @attr self.event_driven (bool): whether big sequential chips may use the EventSimulator
+        @attr self.pins (dict): in batch, the IN pin values set so far
+        @attr self.vectors (list of dict): in batch, the IN pin values at each eval, lane 0 for the power-on state
+        @attr self.rows (list): in batch, the output lines to come, a header str or (lane, pins) for an output
+        """
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.natives = list(natives)
+        self.hdl = list(hdl)
+        self.simulator = None
+        self.time = 0
+        self.half = False
+        self.output_file = None
+        self.outputs = []
+        self.lines = []
+        self.compare = None
+        self.mismatch = None
+        self.batch = batch
+        self.event_driven = event_driven
+        self.pins = {}
+        self.vectors = [{}]
+        self.rows = []
+
+    def run(self):
+        """Runs the whole script. Returns True if the output matched the compare-to file."""
+        with open(self.filename, "r") as f:
+            commands, _ = parse(tokenize(f.read()))
+        # a script this runner cannot finish is skipped before its chip is compiled, which can take seconds
+        name = unsupported(commands)
+        if name is not None:
+            raise ScriptError("unsupported command %r" % name)
+        if uses_clock(commands):
+            self.batch = False
+        self.execute(commands)
+        if self.batch:
+            self.flush()
+        if self.output_file:
+            with open(self.output_file, "w") as f:
+                f.writelines(line + "\n" for line in self.lines)
+        return self.mismatch is None
+
+    def execute(self, commands):
+        """Executes a list of parsed commands."""
+        for command in commands:
+            name = command[0]
+            if name == "repeat":
+                count, body = command[1], command[2]
+                if count < 0:
+                    raise ScriptError("repeat without a count")
+                for _ in range(count):
+                    self.execute(body)
+            elif name == "load":
+                self.load(command[1])
+            elif name == "ROM32K" and command[1:2] == ["load"]:
+                self.part("ROM32K").load(os.path.join(self.directory, command[2]))
+            elif name == "output-file":
+                self.output_file = os.path.join(self.directory, command[1])
+            elif name == "compare-to":
+                with open(os.path.join(self.directory, command[1]), "r") as f:
+                    self.compare = f.read().splitlines()
+            elif name == "output-list":
+                self.output_list(command[1:])
+            elif name == "set":
+                self.set(command[1], parse_number(command[2]))
+            elif name == "eval":
+                if self.batch:
+                    self.vectors.append(dict(self.pins))
+                else:
+                    self.simulator.eval()
+            elif name == "tick":
+                self.simulator.tick()
+                self.half = True
+            elif name == "tock":
+                self.simulator.tock()
+                self.time += 1
+                self.half = False
+            elif name == "output":
+                self.output()
+            elif name in ("echo", "clear-echo", "breakpoint", "clear-breakpoints"):
+                pass
+            else:
+                raise ScriptError("unsupported command %r" % name)
+
+    def load(self, chip):
+        """Handles "load": compiles the chip."""
+        if not chip.endswith(".hdl"):
+            raise ScriptError("%s is a CPU test, not a chip test" % chip)
+        netlist = compile_chip(os.path.join(self.directory, chip), self.natives, self.hdl)
+        if netlist.dffs or netlist.natives:
+            self.batch = False
+        if self.event_driven and netlist.dffs and len(netlist.nands) // 3 > EVENT_DRIVEN_GATES:
+            self.simulator = EventSimulator(netlist)
+        else:
+            self.simulator = HardwareSimulator(netlist)
+
+    def part(self, name):
+        """Returns the built-in chip of part name, which a command needs."""
+        chip = self.simulator.chip(name)
+        if chip is None:
+            raise StateError("%s is compiled from .hdl here, not a built-in chip; run it with its built-in model"
+                             % name)
+        return chip
+
+    def state_error(self, action, name):
+        """Returns the StateError for a set or output of name, saying why the chip does not expose it."""
+        match = PART_NAME.match(name)
+        if match and match.group(1) in self.simulator.netlist.probes:
+            return StateError("cannot %s %s: the %s part is compiled from .hdl, whose memory cannot be addressed "
+                              "by word; run it with its built-in model (drop --hdl %s)"
+                              % (action, name, match.group(1), match.group(1)))
+        return StateError("cannot %s %s: the chip has no such pin or built-in part" % (action, name))
+
+    def set(self, name, value):
+        """Handles "set name value"."""
+        netlist = self.simulator.netlist
+        match = PART_NAME.match(name)
+        if name in netlist.inputs:
+            value &= (1 << len(netlist.inputs[name])) - 1
+            if self.batch:
+                self.pins[name] = value
+            else:
+                self.simulator.set(name, value)
+        elif match and self.simulator.chip(match.group(1)) is not None:
+            self.part(match.group(1)).memory[int(match.group(2) or 0)] = value & 0xFFFF
+        else:
+            raise self.state_error("set", name)
+
+    def get(self, name, simulator=None, lane=0, pins=None):
+        """
+        Returns the value of an output-list variable, by default from
+        self.simulator. In batch the IN pins come from pins, what was set when
+        the line was output, and the rest from lane of the wide simulator.
+        """
+        simulator = simulator or self.simulator
+        if name == "time":
+            return "%d%s" % (self.time, "+" if self.half else "")
+        if pins is not None and name in simulator.netlist.inputs:
+            return pins.get(name, 0)
+        if name in simulator.netlist.inputs or name in simulator.netlist.outputs:
+            return simulator.get(name, lane)
+        match = PART_NAME.match(name)
+        if match:
+            part, index = match.groups()
+            chip = simulator.chip(part)
+            if chip is not None and chip.memory is not None:
+                return chip.memory[int(index or 0)]
+            # a compiled part only shows its out pin, as Chip[]; Chip[n] would need its words
+            value = simulator.probe(part, lane) if not index else None
+            if value is not None:
+                return value
+        raise self.state_error("output", name)
+
+    def output_list(self, columns):
+        """Handles "output-list": sets the columns and writes the header line."""
+        self.outputs = []
+        for column in columns:
+            match = FORMAT.match(column)
+            if not match:
+                raise ScriptError("bad output-list entry %r" % column)
+            name, kind, left, width, right = match.groups()
+            self.outputs.append((name, kind, int(left), int(width), int(right)))
+        header = []
+        for name, kind, left, width, right in self.outputs:
+            total = left + width + right
+            name = name[:total]
+            pad = total - len(name)
+            header.append(" " * (pad // 2) + name + " " * (pad - pad // 2))
+        line = "|" + "|".join(header) + "|"
+        if self.batch:
+            self.rows.append(line)
+        else:
+            self.emit(line)
+
+    def output(self):
+        """Handles "output": writes one line of the output-list values, or in batch, records it."""
+        if self.batch:
+            self.rows.append((len(self.vectors) - 1, dict(self.pins), self.outputs))
+        else:
+            self.emit(self.format_line(self.outputs))
+
+    def format_line(self, outputs, simulator=None, lane=0, pins=None):
+        """Formats one line of the values of outputs, the output-list columns."""
+        cells = [" " * left + format_value(self.get(name, simulator, lane, pins), kind, width) + " " * right
+                 for name, kind, left, width, right in outputs]
+        return "|" + "|".join(cells) + "|"
+
+    def flush(self):
+        """Evaluates all the batched vectors in one wide pass and writes out their lines."""
+        wide = HardwareSimulator(self.simulator.netlist, len(self.vectors))
+        for pin in wide.netlist.inputs:
+            wide.set_lanes(pin, [vector.get(pin, 0) for vector in self.vectors])
+        wide.eval()
+        for row in self.rows:
+            if isinstance(row, str):
+                self.emit(row)
+            else:
+                lane, pins, outputs = row
+                self.emit(self.format_line(outputs, wide, lane, pins))
+        self.rows = []
+
+    def emit(self, line):
+        """Appends an output line and checks it against the compare-to file."""
+        if self.compare is not None and self.mismatch is None:
+            index = len(self.lines)
+            if index >= len(self.compare) or not lines_match(line, self.compare[index]):
+                self.mismatch = index
+        self.lines.append(line)
+
+    def describe(self):
+        """Returns a one-line verdict, with the first differing line on failure."""
+        if self.compare is None:
+            return "%s: done, nothing to compare" % self.filename
+        if self.mismatch is None:
+            return "%s: passed" % self.filename
+        index = self.mismatch
+        expected = self.compare[index] if index < len(self.compare) else "(end of file)"
+        return "%s: comparison failure at line %d\n  expected %s\n  got      %s" % (
+            self.filename, index + 1, expected, self.lines[index])
+
+
+def uses_clock(commands):
+    """Returns True if any of the parsed commands, or of the blocks in them, is a clock command."""
+    for command in commands:
+        if command[0] in CLOCK_COMMANDS or any(isinstance(word, list) and uses_clock(word) for word in command):
+            return True
+    return False
+
+
+def unsupported(commands):
+    """
+    Returns the name of the first of the parsed commands, or of the repeat
+    blocks in them, that execute() does not run, or None.
+    """
+    for command in commands:
+        if command[0] == "repeat":
+            name = unsupported(command[2])
+            if name is not None:
+                return name
+        elif command[0] not in COMMANDS and command[:2] != ["ROM32K", "load"]:
+            return command[0]
+    return None
+
+
+def run_script(filename, natives=(), batch=True, event_driven=True, hdl=()):
+    """
+    Runs one script, returning (passed, verdict, seconds). passed is None when
+    the script uses commands this runner does not support, and False when it
+    fails, including when it needs state the chip does not expose.
+    """
+    start = time.perf_counter()
+    runner = ChipTestRunner(filename, natives, batch, event_driven, hdl)
+    try:
+        passed = runner.run()
+    except ScriptError as error:
+        return None, "%s: skipped, %s" % (filename, error), time.perf_counter() - start
+    except (HDLError, StateError) as error:
+        return False, "%s: %s" % (filename, error), time.perf_counter() - start
+    return passed, runner.describe(), time.perf_counter() - start
+
+
+def find_scripts(paths):
+    """Expands directories into the .tst files in them."""
+    scripts = []
+    for path in paths:
+        if os.path.isdir(path):
+            scripts += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".tst"))
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run chip .tst scripts on the HDL simulator and compare to their .cmp files.")
+    argparser.add_argument("paths", nargs="+", help="Xxx.tst scripts, or directories of them")
+    argparser.add_argument("--workers", type=int, default=os.cpu_count(), help="scripts to run at once")
+    argparser.add_argument("--native", action="append", default=[], metavar="CHIP",
+                           help="use the built-in Python model of CHIP instead of its .hdl; may be repeated")
+    argparser.add_argument("--hdl", action="append", default=[], metavar="CHIP",
+                           help="compile CHIP from its .hdl even where it has a built-in model by default; may be repeated")
+    argparser.add_argument("--serial", action="store_true",
+                           help="evaluate combinational scripts one vector at a time instead of in one wide pass")
+    argparser.add_argument("--full-eval", action="store_true",
+                           help="evaluate every gate on every clock edge, even for big sequential chips")
+    args = argparser.parse_args()
+
+    scripts = find_scripts(args.paths)
+    with ProcessPoolExecutor(args.workers) as pool:
+        results = list(pool.map(run_script, scripts, [args.native] * len(scripts), [not args.serial] * len(scripts),
+                                [not args.full_eval] * len(scripts), [args.hdl] * len(scripts)))
+    for passed, verdict, seconds in results:
+        print("%s (%.3f s)" % (verdict, seconds))
+    failed = sum(passed is False for passed, _, _ in results)
+    skipped = sum(passed is None for passed, _, _ in results)
+    print("%d passed, %d failed, %d skipped" % (len(results) - failed - skipped, failed, skipped))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,159 @@
+from HardwareSimulator import HardwareSimulator, compile_chip, read_bus
+import argparse
+import numpy as np
+import time
+
+
+class EventSimulator(HardwareSimulator):
+    """
+    A HardwareSimulator that only re-evaluates the gates downstream of wires
+    that changed, for sequential chips where a clock cycle touches a small
+    part of a big netlist (one register of a RAM16K).
+
+    The Nands are stored level by level, so a level is a contiguous slice of
+    the gate arrays. A change marks its fan-out gates dirty, and eval() goes
+    up the levels, evaluating only the dirty gates of each level as one NumPy
+    operation. Gates whose output changes mark their own fan-out, always on
+    a higher level. The wire values live in a bytearray shared with a NumPy
+    view, and the DFF state in a NumPy array, so tick() and tock() move all
+    the DFFs with one operation each.
+    """
+
+    array = None
+
+    def __init__(self, netlist, lanes=1):
+        """
+        @attr self.a, self.b, self.out (ndarray): the Nand input and output wires, in level order
+        @attr self.levels (ndarray): the level of each Nand
+        @attr self.starts (list of int): the first Nand of each level, and the Nand count last
+        @attr self.offsets, self.nodes (ndarray): the wire fan-out, from Netlist.fanout()
+        @attr self.dirty (ndarray of bool): the Nands whose inputs changed since they were evaluated
+        @attr self.dirty_levels (ndarray of bool): the levels with dirty Nands
+        @attr self.natives_at (dict): level -> built-in chips on that level
+        @attr self.array (ndarray): a uint8 view of self.values
+        @attr self.dff_inputs, self.dff_outputs_array (ndarray): the DFF wires
+        """
+        assert lanes == 1, "the event-driven simulator runs one vector at a time"
+        nands = np.frombuffer(netlist.nands, dtype=np.intc).reshape(-1, 3)
+        self.gates = len(nands)
+        self.a, self.b, self.out = (np.ascontiguousarray(nands[:, column]) for column in range(3))
+        self.levels = np.frombuffer(netlist.levels, dtype=np.intc)
+        depth = max([int(self.levels[-1]) + 1 if self.gates else 0] + [level + 1 for level in netlist.native_levels])
+        self.starts = np.searchsorted(self.levels, np.arange(depth + 1)).tolist()
+        self.offsets, self.nodes = netlist.fanout()
+        self.dirty = np.zeros(self.gates, dtype=bool)
+        self.dirty_levels = np.zeros(depth, dtype=bool)
+        self.natives_at = {}
+        for index, level in enumerate(netlist.native_levels):
+            self.natives_at.setdefault(level, []).append(index)
+        dffs = np.frombuffer(netlist.dffs, dtype=np.intc)
+        self.dff_inputs = dffs[0::2].astype(np.int64)
+        self.dff_outputs_array = dffs[1::2].astype(np.int64)
+        HardwareSimulator.__init__(self, netlist)
+        self.state = self.array[self.dff_outputs_array].copy()
+
+    def touch(self, wires):
+        """Marks the gates that read any of wires (a NumPy array) dirty."""
+        offsets = self.offsets
+        counts = offsets[wires + 1] - offsets[wires]
+        total = int(counts.sum())
+        if not total:
+            return
+        starts = np.repeat(offsets[wires] - np.cumsum(counts) + counts, counts)
+        nodes = self.nodes[starts + np.arange(total)]
+        gates = nodes[nodes < self.gates]
+        self.dirty[gates] = True
+        self.dirty_levels[self.levels[gates]] = True
+
+    def set(self, pin, value):
+        """Sets an IN pin and marks the gates reading its changed bits."""
+        wires = np.array(self.netlist.inputs[pin], dtype=np.int64)
+        bits = (value >> np.arange(len(wires))) & 1
+        changed = self.array[wires] != bits
+        self.array[wires[changed]] = bits[changed]
+        self.touch(wires[changed])
+
+    def eval_chip(self, index):
+        """Evaluates built-in chip index and marks the gates reading the outputs it changed."""
+        _, _, _, outputs = self.netlist.natives[index]
+        wires = np.array([wire for pin in outputs for wire in pin], dtype=np.int64)
+        before = self.array[wires].copy()
+        HardwareSimulator.eval_chip(self, index)
+        self.touch(wires[self.array[wires] != before])
+
+    def settle(self):
+        """The first evaluation, from HardwareSimulator.__init__: every gate, a whole level at a time."""
+        self.values = bytearray(self.values)
+        self.array = values = np.frombuffer(self.values, dtype=np.uint8)
+        a, b, out, starts = self.a, self.b, self.out, self.starts
+        for level in range(len(self.dirty_levels)):
+            for index in self.natives_at.get(level, ()):
+                HardwareSimulator.eval_chip(self, index)
+            start, end = starts[level], starts[level + 1]
+            values[out[start:end]] = 1 ^ (values[a[start:end]] & values[b[start:end]])
+
+    def eval(self):
+        """Settles the gates downstream of the changes since the last eval()."""
+        if self.array is None:
+            return self.settle()
+        values, dirty, dirty_levels, starts = self.array, self.dirty, self.dirty_levels, self.starts
+        a, b, out = self.a, self.b, self.out
+        for level in range(len(dirty_levels)):
+            # built-in chips may hold memory the script has written, so they are always evaluated
+            for index in self.natives_at.get(level, ()):
+                self.eval_chip(index)
+            if not dirty_levels[level]:
+                continue
+            dirty_levels[level] = False
+            start = starts[level]
+            gates = np.flatnonzero(dirty[start:starts[level + 1]]) + start
+            dirty[gates] = False
+            results = 1 ^ (values[a[gates]] & values[b[gates]])
+            wires = out[gates]
+            changed = results != values[wires]
+            if changed.any():
+                wires = wires[changed]
+                values[wires] = results[changed]
+                self.touch(wires)
+
+    def tick(self):
+        """The rising clock edge: settles the gates and samples the DFF and built-in chip inputs."""
+        self.eval()
+        self.state = self.array[self.dff_inputs]
+        for (_, _, inputs, _), chip in zip(self.netlist.natives, self.chips):
+            chip.tick(tuple(read_bus(self.values, wires) for wires in inputs))
+
+    def tock(self):
+        """The falling clock edge: the DFFs that sampled a new value change, and the gates downstream settle."""
+        outputs = self.dff_outputs_array
+        changed = self.array[outputs] != self.state
+        self.array[outputs[changed]] = self.state[changed]
+        self.touch(outputs[changed])
+        for chip in self.chips:
+            chip.tock()
+        self.eval()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Time clock cycles of a sequential chip, event-driven against full passes.")
+    argparser.add_argument("filename", help="the Xxx.hdl chip")
+    argparser.add_argument("--cycles", type=int, default=100, help="clock cycles to time")
+    argparser.add_argument("--native", action="append", default=[], metavar="CHIP",
+                           help="use the built-in Python model of CHIP instead of its .hdl; may be repeated")
+    args = argparser.parse_args()
+
+    netlist = compile_chip(args.filename, args.native)
+    for cls in (EventSimulator, HardwareSimulator):
+        simulator = cls(netlist)
+        start = time.perf_counter()
+        for cycle in range(args.cycles):
+            for pin, wires in netlist.inputs.items():
+                simulator.set(pin, (cycle * 0x9E3779B1 >> len(wires)) & ((1 << len(wires)) - 1))
+            simulator.tick()
+            simulator.tock()
+        elapsed = time.perf_counter() - start
+        print("%s: %.3f ms per clock cycle" % (cls.__name__, 1000 * elapsed / args.cycles))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import re
+
+TOKEN = re.compile(r"\w+|\.\.|\S")
+# Signal names that stand for a constant 0 or 1 on every bit
+CONSTANTS = {"false": 0, "true": 1}
+
+
+class HDLError(Exception):
+    """An .hdl file is malformed, or refers to chips or pins that do not exist."""
+
+
+class Connection:
+    """
+    One "pin[lo..hi]=signal[lo..hi]" of a part. An unsubscripted side has lo and
+    hi set to None, meaning the whole pin or signal.
+    """
+
+    def __init__(self, pin, pin_lo, pin_hi, signal, signal_lo, signal_hi):
+        self.pin = pin
+        self.pin_lo = pin_lo
+        self.pin_hi = pin_hi
+        self.signal = signal
+        self.signal_lo = signal_lo
+        self.signal_hi = signal_hi
+
+
+class Part:
+    """One part of a chip: the chip it is made of, and its connections."""
+
+    def __init__(self, chip, connections, line):
+        """
+        @attr self.chip (str): the name of the part's chip, such as Mux16
+        @attr self.connections (list of Connection): its pin assignments, in source order
+        @attr self.line (int): where the part is in the .hdl file, for error messages
+        """
+        self.chip = chip
+        self.connections = connections
+        self.line = line
+
+
+class ChipDefinition:
+    """A parsed CHIP: its interface and parts, or the BUILTIN it stands for."""
+
+    def __init__(self, name, filename=""):
+        """
+        @attr self.inputs (list of (str, int)): the IN pins with their widths
+        @attr self.outputs (list of (str, int)): the OUT pins with their widths
+        @attr self.parts (list of Part): the PARTS section
+        @attr self.builtin (str): the name after BUILTIN, or None
+        @attr self.clocked (list of str): the pins named after CLOCKED
+        """
+        self.name = name
+        self.filename = filename
+        self.inputs = []
+        self.outputs = []
+        self.parts = []
+        self.builtin = None
+        self.clocked = []
+
+    def pin_width(self, pin):
+        """Returns the width of an IN or OUT pin, or None if the chip has no such pin."""
+        for name, width in self.inputs + self.outputs:
+            if name == pin:
+                return width
+        return None
+
+
+def tokenize(text):
+    """Splits HDL source into (token, line) pairs, dropping // and /* */ comments."""
+    tokens = []
+    position = 0
+    line = 1
+    length = len(text)
+    while position < length:
+        if text.startswith("//", position):
+            position = text.find("\n", position)
+            if position < 0:
+                break
+        elif text.startswith("/*", position):
+            end = text.find("*/", position + 2)
+            end = length if end < 0 else end + 2
+            line += text.count("\n", position, end)
+            position = end
+        elif text[position] == "\n":
+            line += 1
+            position += 1
+        elif text[position].isspace():
+            position += 1
+        else:
+            match = TOKEN.match(text, position)
+            tokens.append((match.group(), line))
+            position = match.end()
+    return tokens
+
+
+class HDLParser:
+    """A recursive-descent parser for one .hdl file."""
+
+    def __init__(self, text, filename=""):
+        self.filename = filename
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    @classmethod
+    def parse_file(cls, filename):
+        """Parses the .hdl file filename and returns its ChipDefinition."""
+        with open(filename, "r") as f:
+            return cls(f.read(), filename).parse()
+
+    def error(self, message):
+        """Returns an HDLError pointing at the current token."""
+        line = self.tokens[min(self.position, len(self.tokens) - 1)][1] if self.tokens else 0
+        return HDLError("%s:%d: %s" % (self.filename, line, message))
+
+    def peek(self):
+        """Returns the current token without consuming it, or None at the end."""
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def next(self):
+        """Consumes and returns the current token."""
+        token = self.peek()
+        if token is None:
+            raise self.error("unexpected end of file")
+        self.position += 1
+        return token
+
+    def expect(self, expected):
+        """Consumes the current token, which must be expected."""
+        token = self.next()
+        if token != expected:
+            self.position -= 1
+            raise self.error("expected %r, found %r" % (expected, token))
+
+    def name(self):
+        """Consumes an identifier."""
+        token = self.next()
+        if not re.match(r"[A-Za-z_]\w*$", token):
+            self.position -= 1
+            raise self.error("expected a name, found %r" % token)
+        return token
+
+    def number(self):
+        """Consumes a decimal number."""
+        token = self.next()
+        if not token.isdigit():
+            self.position -= 1
+            raise self.error("expected a number, found %r" % token)
+        return int(token)
+
+    def parse(self):
+        """Parses "CHIP Name { IN ...; OUT ...; PARTS: ... }" (or a BUILTIN body)."""
+        self.expect("CHIP")
+        chip = ChipDefinition(self.name(), self.filename)
+        self.expect("{")
+        while self.peek() in ("IN", "OUT"):
+            pins = chip.inputs if self.next() == "IN" else chip.outputs
+            pins += self.pin_list()
+        if self.peek() == "BUILTIN":
+            self.next()
+            chip.builtin = self.name()
+            self.expect(";")
+            if self.peek() == "CLOCKED":
+                self.next()
+                chip.clocked = [name for name, _ in self.pin_list()]
+        else:
+            self.expect("PARTS")
+            self.expect(":")
+            while self.peek() not in ("}", None):
+                chip.parts.append(self.part())
+        self.expect("}")
+        return chip
+
+    def pin_list(self):
+        """Parses "a, b[16], c;" into [(name, width)]. An empty list is allowed."""
+        pins = []
+        while self.peek() != ";":
+            name = self.name()
+            width = 1
+            if self.peek() == "[":
+                self.next()
+                width = self.number()
+                self.expect("]")
+            pins.append((name, width))
+            if self.peek() == ",":
+                self.next()
+        self.expect(";")
+        return pins
+
+    def part(self):
+        """Parses "Chip(pin=signal, ...);"."""
+        line = self.tokens[self.position][1]
+        chip = self.name()
+        self.expect("(")
+        connections = []
+        while True:
+            pin = self.name()
+            pin_lo, pin_hi = self.subscript()
+            self.expect("=")
+            signal = self.name()
+            signal_lo, signal_hi = self.subscript()
+            if signal in CONSTANTS and signal_lo is not None:
+                raise self.error("%s cannot be subscripted" % signal)
+            connections.append(Connection(pin, pin_lo, pin_hi, signal, signal_lo, signal_hi))
+            if self.next() == ")":
+                break
+            self.position -= 1
+            self.expect(",")
+        self.expect(";")
+        return Part(chip, connections, line)
+
+    def subscript(self):
+        """Parses an optional "[i]" or "[i..j]", returning (lo, hi), or (None, None) if absent."""
+        if self.peek() != "[":
+            return None, None
+        self.next()
+        lo = hi = self.number()
+        if self.peek() == "..":
+            self.next()
+            hi = self.number()
+        self.expect("]")
+        if hi < lo:
+            raise self.error("bad subscript [%d..%d]" % (lo, hi))
+        return lo, hi
@@ -0,0 +1,188 @@
+from BuiltinChips import DEFAULT_NATIVES
+from Netlist import ChipLibrary
+from HDLParser import HDLError
+import argparse
+import os
+import time
+
+
+def read_bus(values, wires, lane=0):
+    """Returns the value of a bus in one lane: bit lane of each wire value, bit 0 first."""
+    value = 0
+    for bit, wire in enumerate(wires):
+        value |= ((values[wire] >> lane) & 1) << bit
+    return value
+
+
+def write_bus(values, wires, value, mask=1):
+    """Sets the wires of a bus to the bits of value, bit 0 first, in every lane of mask."""
+    for bit, wire in enumerate(wires):
+        values[wire] = mask if (value >> bit) & 1 else 0
+
+
+def compile_chip(filename, natives=(), hdl=()):
+    """
+    Compiles the chip in the .hdl file filename into a Netlist. The parts in
+    natives, and those in DEFAULT_NATIVES for this chip except the ones in
+    hdl, are simulated with their built-in Python models.
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    natives = (set(natives) | set(DEFAULT_NATIVES.get(name, ()))) - set(hdl)
+    return ChipLibrary(os.path.dirname(os.path.abspath(filename)), natives).netlist(name)
+
+
+class HardwareSimulator:
+    """
+    Simulates a Netlist: one value per wire, evaluated gate by gate in the
+    netlist's levelized order, with no chip objects or recursion involved.
+
+    With lanes > 1 each wire holds a Python int whose bit k is the wire's value
+    for test vector k, so one pass evaluates every vector at once: a Nand is
+    mask ^ (a & b) on all the lanes. set_lanes() and get_lanes() move whole
+    columns of vectors in and out. Built-in chips work in one lane only.
+
+    The clock follows the nand2tetris tools. tick() settles the gates and has
+    every DFF and built-in chip sample its inputs; tock() makes the sampled
+    values their outputs and settles the gates again. Between the two the DFF
+    outputs keep their old values.
+    """
+
+    def __init__(self, netlist, lanes=1):
+        """
+        @attr self.lanes (int): the number of vectors simulated at once
+        @attr self.mask (int): the value of a wire that is 1 in every lane
+        @attr self.values (list of int): the value of every wire, one bit per lane
+        @attr self.state (list of int): what each DFF sampled at the last tick
+        @attr self.chips (list of BuiltinChip): an instance of each built-in chip of the netlist
+        @attr self.dff_outputs (dict): DFF output wire -> index of the DFF in self.state
+        """
+        assert lanes == 1 or not netlist.natives, "built-in chips are simulated in one lane only"
+        self.netlist = netlist
+        self.lanes = lanes
+        self.mask = (1 << lanes) - 1
+        self.values = [0] * netlist.wires
+        self.values[1] = self.mask
+        self.state = [0] * (len(netlist.dffs) // 2)
+        self.chips = [chip() for _, chip, _, _ in netlist.natives]
+        self.dff_outputs = {wire: index for index, wire in enumerate(netlist.dffs[1::2])}
+        self.eval()
+
+    @classmethod
+    def load(cls, filename, natives=(), lanes=1, hdl=()):
+        """Compiles the chip in filename and returns a simulator for it."""
+        return cls(compile_chip(filename, natives, hdl), lanes)
+
+    def set(self, pin, value):
+        """Sets an IN pin in every lane. The outputs follow at the next eval(), tick() or tock()."""
+        write_bus(self.values, self.netlist.inputs[pin], value, self.mask)
+
+    def get(self, pin, lane=0):
+        """Returns the value of an IN or OUT pin in one lane."""
+        wires = self.netlist.inputs.get(pin) or self.netlist.outputs[pin]
+        return read_bus(self.values, wires, lane)
+
+    def set_lanes(self, pin, vectors):
+        """Sets an IN pin to vectors[k] in lane k, for all the lanes."""
+        assert len(vectors) == self.lanes, "%d vectors for %d lanes" % (len(vectors), self.lanes)
+        values = self.values
+        for bit, wire in enumerate(self.netlist.inputs[pin]):
+            values[wire] = int("".join("1" if (vector >> bit) & 1 else "0" for vector in reversed(vectors)), 2)
+
+    def get_lanes(self, pin):
+        """Returns the values of an IN or OUT pin in all the lanes, lane 0 first."""
+        wires = self.netlist.inputs.get(pin) or self.netlist.outputs[pin]
+        results = [0] * self.lanes
+        for bit, wire in enumerate(wires):
+            lanes = format(self.values[wire], "0%db" % self.lanes)[::-1]
+            for lane in range(self.lanes):
+                if lanes[lane] == "1":
+                    results[lane] |= 1 << bit
+        return results
+
+    def chip(self, name):
+        """Returns the built-in chip used for the part name, or None."""
+        for (part, _, _, _), chip in zip(self.netlist.natives, self.chips):
+            if part == name:
+                return chip
+        return None
+
+    def probe(self, name, lane=0):
+        """
+        Returns the value on the out pin of the first part called name, such as
+        DRegister, or None. Like the nand2tetris tools, a register shows the
+        value it sampled at tick before tock makes it its output.
+        """
+        wires = self.netlist.probes.get(name)
+        if wires is None:
+            return None
+        values, state, dff_outputs = self.values, self.state, self.dff_outputs
+        return read_bus([int(state[dff_outputs[wire]]) if wire in dff_outputs else values[wire] for wire in wires],
+                        range(len(wires)), lane)
+
+    def eval_chip(self, index):
+        """Evaluates built-in chip index and drives its outputs."""
+        values = self.values
+        _, _, inputs, outputs = self.netlist.natives[index]
+        results = self.chips[index].evaluate(tuple(read_bus(values, wires) for wires in inputs))
+        for wires, value in zip(outputs, results):
+            write_bus(values, wires, value)
+
+    def eval(self):
+        """Settles every gate, in one pass over the schedule."""
+        values = self.values
+        mask = self.mask
+        for step in self.netlist.schedule():
+            if step.__class__ is int:
+                self.eval_chip(step)
+                continue
+            for a, b, out in zip(*step):
+                values[out] = mask ^ (values[a] & values[b])
+
+    def tick(self):
+        """The rising clock edge: settles the gates and samples the DFF and built-in chip inputs."""
+        self.eval()
+        values = self.values
+        dffs = self.netlist.dffs
+        self.state = [values[wire] for wire in dffs[0::2]]
+        for (_, _, inputs, _), chip in zip(self.netlist.natives, self.chips):
+            chip.tick(tuple(read_bus(values, wires) for wires in inputs))
+
+    def tock(self):
+        """The falling clock edge: the sampled values appear at the outputs, and the gates settle."""
+        values = self.values
+        for wire, value in zip(self.netlist.dffs[1::2], self.state):
+            values[wire] = value
+        for chip in self.chips:
+            chip.tock()
+        self.eval()
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Compile an .hdl chip to Nand gates and DFFs and report its size.")
+    argparser.add_argument("filename", help="the Xxx.hdl chip")
+    argparser.add_argument("--native", action="append", default=[], metavar="CHIP",
+                           help="use the built-in Python model of CHIP instead of its .hdl; may be repeated")
+    argparser.add_argument("--hdl", action="append", default=[], metavar="CHIP",
+                           help="compile CHIP from its .hdl even where it has a built-in model by default; may be repeated")
+    argparser.add_argument("--lanes", type=int, default=1, help="vectors to evaluate at once in the timed pass")
+    args = argparser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        simulator = HardwareSimulator.load(args.filename, args.native, args.lanes, args.hdl)
+    except HDLError as error:
+        raise SystemExit(str(error))
+    elapsed = time.perf_counter() - start
+    netlist = simulator.netlist
+    print("%s: %d Nand gates, %d DFFs, %d built-in chips, %d wires, %d levels (compiled in %.3f s)" % (
+        netlist.name, len(netlist.nands) // 3, len(netlist.dffs) // 2, len(netlist.natives), netlist.wires,
+        max(netlist.levels) + 1 if netlist.levels else 0, elapsed))
+    start = time.perf_counter()
+    simulator.eval()
+    elapsed = time.perf_counter() - start
+    print("one evaluation pass over %d lanes: %.3f ms (%.0f vectors/s)" % (
+        args.lanes, 1000 * elapsed, args.lanes / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+from HDLParser import HDLParser, HDLError, CONSTANTS
+from BuiltinChips import NATIVE_CHIPS
+from array import array
+import numpy as np
+import os
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+# Where parts are looked up after the directory of the chip being loaded, in order
+HDL_PATH = [os.path.join(REPO_DIR, *project) for project in (("01",), ("02",), ("03", "a"), ("03", "b"), ("05",))]
+# Built-in chips of the nand2tetris tools that behave exactly like another chip
+ALIASES = {"ARegister": "Register", "DRegister": "Register"}
+
+FALSE = 0
+TRUE = 1
+
+
+def int_array(values):
+    """Returns the NumPy array values as an array("i"), copying the data once."""
+    result = array("i")
+    result.frombytes(memoryview(np.ascontiguousarray(values, dtype=np.intc)).cast("B"))
+    return result
+
+
+class Template:
+    """
+    A chip flattened to Nand gates, DFFs and built-in chips over local wire
+    numbers. Wires 0 and 1 are the constants false and true, the IN pin bits
+    come next (bit 0 of each pin first), then every other wire of the chip.
+    Each chip type is compiled once; using it as a part copies its gates with
+    the wires renumbered.
+    """
+
+    def __init__(self, name):
+        """
+        @attr self.wires (int): the number of local wires
+        @attr self.inputs (dict): IN pin -> its wires, bit 0 first
+        @attr self.outputs (dict): OUT pin -> its wires, bit 0 first
+        @attr self.nands (array): flat (a, b, out) wire triples, one per Nand gate
+        @attr self.dffs (array): flat (in, out) wire pairs, one per DFF
+        @attr self.natives (list of (str, class, list, list)): built-in chips as
+            (part name, BuiltinChip class, wires of each IN pin, wires of each OUT pin)
+        @attr self.probes (dict): part name -> wires of its out pin, for reading
+            registers such as DRegister[] from test scripts; the first part of a name wins
+        """
+        self.name = name
+        self.wires = 2
+        self.inputs = {}
+        self.outputs = {}
+        self.nands = array("i")
+        self.dffs = array("i")
+        self.natives = []
+        self.probes = {}
+
+    def add_wires(self, count):
+        """Allocates count new local wires and returns them."""
+        first = self.wires
+        self.wires += count
+        return list(range(first, self.wires))
+
+    def input_width(self):
+        """Returns the total number of IN pin bits."""
+        return sum(len(wires) for wires in self.inputs.values())
+
+
+def primitive(name):
+    """Returns the template of Nand or DFF."""
+    template = Template(name)
+    if name == "Nand":
+        template.inputs = {"a": template.add_wires(1), "b": template.add_wires(1)}
+        template.outputs = {"out": template.add_wires(1)}
+        template.nands.extend((2, 3, 4))
+    else:
+        template.inputs = {"in": template.add_wires(1)}
+        template.outputs = {"out": template.add_wires(1)}
+        template.dffs.extend((2, 3))
+    return template
+
+
+def native(name, chip):
+    """Returns the template of a chip modelled by the BuiltinChip class chip."""
+    template = Template(name)
+    for pin, width in chip.INPUTS:
+        template.inputs[pin] = template.add_wires(width)
+    for pin, width in chip.OUTPUTS:
+        template.outputs[pin] = template.add_wires(width)
+    template.natives.append((name, chip, [template.inputs[pin] for pin, _ in chip.INPUTS],
+                             [template.outputs[pin] for pin, _ in chip.OUTPUTS]))
+    return template
+
+
+class ChipLibrary:
+    """
+    Finds and compiles chips. A part is looked up as Name.hdl in the directory
+    of the chip being loaded, then along HDL_PATH. Nand and DFF are the
+    primitives, ARegister and DRegister are Registers, and chips without an .hdl
+    file (ROM32K, Screen, Keyboard) come from BuiltinChips, as do the chips
+    listed in natives, in place of their .hdl. Templates are memoized, so a
+    chip used many times, like the Registers of a RAM, is compiled once.
+    """
+
+    def __init__(self, directory=None, natives=()):
+        """
+        @attr self.path (list of str): the directories searched, in order
+        @attr self.natives (set): chips to take from BuiltinChips even if they have an .hdl file
+        @attr self.templates (dict): chip name -> its compiled Template
+        """
+        self.path = ([directory] if directory else []) + HDL_PATH
+        self.natives = set(natives)
+        self.templates = {}
+        self._compiling = []
+
+    def find(self, name):
+        """Returns the path of Name.hdl, or None."""
+        for directory in self.path:
+            filename = os.path.join(directory, name + ".hdl")
+            if os.path.exists(filename):
+                return filename
+        return None
+
+    def template(self, name):
+        """Returns the compiled Template of chip name."""
+        if name in self.templates:
+            return self.templates[name]
+        if name in self._compiling:
+            raise HDLError("%s is made of itself (%s)" % (name, " -> ".join(self._compiling + [name])))
+        self._compiling.append(name)
+        try:
+            filename = None if name in self.natives else self.find(name)
+            if name in ("Nand", "DFF"):
+                template = primitive(name)
+            elif filename is not None:
+                definition = HDLParser.parse_file(filename)
+                if definition.name != name:
+                    raise HDLError("%s defines chip %s, not %s" % (filename, definition.name, name))
+                if definition.builtin is not None:
+                    if definition.builtin not in NATIVE_CHIPS:
+                        raise HDLError("%s: no built-in %s" % (filename, definition.builtin))
+                    template = native(name, NATIVE_CHIPS[definition.builtin])
+                else:
+                    template = self.compile(definition)
+            elif name in ALIASES:
+                template = self.template(ALIASES[name])
+            elif name in NATIVE_CHIPS:
+                template = native(name, NATIVE_CHIPS[name])
+            else:
+                raise HDLError("chip %s not found in %s" % (name, os.pathsep.join(self.path)))
+        finally:
+            self._compiling.pop()
+        self.templates[name] = template
+        return template
+
+    def compile(self, definition):
+        """Flattens a parsed chip into a Template."""
+        template = Template(definition.name)
+        for pin, width in definition.inputs:
+            template.inputs[pin] = template.add_wires(width)
+        declared = dict(definition.inputs + definition.outputs)
+        # signal -> {bit: wire}; the IN pins are driven from the start
+        signals = {pin: dict(enumerate(wires)) for pin, wires in template.inputs.items()}
+
+        def error(part, message):
+            return HDLError("%s:%d: %s" % (definition.filename, part.line, message))
+
+        def pin_bits(part, sub, connection):
+            wires = sub.inputs.get(connection.pin, sub.outputs.get(connection.pin))
+            if wires is None:
+                raise error(part, "%s has no pin %s" % (part.chip, connection.pin))
+            if connection.pin_lo is None:
+                return wires
+            if connection.pin_hi >= len(wires):
+                raise error(part, "%s[%d..%d] is out of range" % (connection.pin, connection.pin_lo, connection.pin_hi))
+            return wires[connection.pin_lo:connection.pin_hi + 1]
+
+        def signal_bits(part, connection, count):
+            if connection.signal_lo is None:
+                return range(count)
+            if connection.signal_hi - connection.signal_lo + 1 != count:
+                raise error(part, "%s and %s have different widths" % (connection.pin, connection.signal))
+            if connection.signal in declared and connection.signal_hi >= declared[connection.signal]:
+                raise error(part, "%s[%d] is out of range" % (connection.signal, connection.signal_hi))
+            return range(connection.signal_lo, connection.signal_hi + 1)
+
+        # First the wires every part drives, since a part may read a signal driven by a later one
+        parts = []
+        for part in definition.parts:
+            sub = self.template(part.chip)
+            own = 2 + sub.input_width()
+            mapping = np.zeros(sub.wires, dtype=np.intc)
+            mapping[TRUE] = TRUE
+            mapping[own:] = template.add_wires(sub.wires - own)
+            for connection in part.connections:
+                if connection.pin not in sub.outputs:
+                    continue
+                if connection.signal in CONSTANTS or connection.signal in template.inputs:
+                    raise error(part, "%s cannot be driven" % connection.signal)
+                wires = pin_bits(part, sub, connection)
+                if connection.signal in declared and connection.signal_lo is None and len(wires) != declared[connection.signal]:
+                    raise error(part, "%s and %s have different widths" % (connection.pin, connection.signal))
+                driven = signals.setdefault(connection.signal, {})
+                for wire, bit in zip(wires, signal_bits(part, connection, len(wires))):
+                    if bit in driven:
+                        raise error(part, "%s[%d] is driven twice" % (connection.signal, bit))
+                    driven[bit] = int(mapping[wire])
+            parts.append((part, sub, mapping))
+
+        # Then the inputs of every part, and the copying of its gates
+        for part, sub, mapping in parts:
+            for connection in part.connections:
+                if connection.pin in sub.outputs:
+                    continue
+                wires = pin_bits(part, sub, connection)
+                if connection.signal in CONSTANTS:
+                    mapping[wires] = CONSTANTS[connection.signal]
+                    continue
+                driven = signals.get(connection.signal)
+                if driven is None:
+                    raise error(part, "%s is not an IN pin or the output of any part" % connection.signal)
+                if connection.signal_lo is None and len(driven) != len(wires):
+                    raise error(part, "%s and %s have different widths" % (connection.pin, connection.signal))
+                for wire, bit in zip(wires, signal_bits(part, connection, len(wires))):
+                    if bit not in driven:
+                        raise error(part, "%s[%d] is not driven by any part" % (connection.signal, bit))
+                    mapping[wire] = driven[bit]
+            self.instantiate(template, part, sub, mapping)
+
+        for pin, width in definition.outputs:
+            driven = signals.get(pin, {})
+            template.outputs[pin] = [driven.get(bit, FALSE) for bit in range(width)]
+        return template
+
+    @staticmethod
+    def instantiate(template, part, sub, mapping):
+        """Copies the gates of the part's Template sub into template, renumbering wires through mapping."""
+        template.nands.extend(int_array(mapping[np.frombuffer(sub.nands, dtype=np.intc)]))
+        template.dffs.extend(int_array(mapping[np.frombuffer(sub.dffs, dtype=np.intc)]))
+        leaf = len(sub.natives) == 1 and not sub.nands and not sub.dffs
+        for name, chip, inputs, outputs in sub.natives:
+            template.natives.append((part.chip if leaf else name, chip,
+                                     [mapping[wires].tolist() for wires in inputs],
+                                     [mapping[wires].tolist() for wires in outputs]))
+        if "out" in sub.outputs and part.chip not in template.probes:
+            template.probes[part.chip] = mapping[sub.outputs["out"]].tolist()
+        for name, wires in sub.probes.items():
+            if name not in template.probes:
+                template.probes[name] = mapping[wires].tolist()
+
+    def netlist(self, name):
+        """Compiles chip name and returns its levelized Netlist."""
+        return Netlist(self.template(name))
+
+
+class Netlist:
+    """
+    A top-level chip, flattened and levelized. The Nand gates are sorted by
+    level, the length of the longest gate path from a source (a constant, an
+    IN pin, a DFF or a clocked built-in chip). One pass over them in that order,
+    with each built-in chip evaluated as soon as its combinational inputs are
+    ready, settles every wire.
+    """
+
+    def __init__(self, template):
+        """
+        @attr self.nands (array): flat (a, b, out) triples in evaluation order
+        @attr self.levels (array): the level of each Nand, in the same order
+        @attr self.native_levels (list of int): the level of each built-in chip
+        @attr self.dffs (array): flat (in, out) pairs
+        @attr self.natives (list of (str, class, list, list)): as in Template
+        @attr self.steps (list): the evaluation steps of schedule(), or None until it is first called
+        """
+        self.name = template.name
+        self.wires = template.wires
+        self.inputs = template.inputs
+        self.outputs = template.outputs
+        self.probes = template.probes
+        self.dffs = template.dffs
+        self.natives = template.natives
+        self.steps = None
+        self.levelize(np.frombuffer(template.nands, dtype=np.intc).reshape(-1, 3))
+
+    def combinational_inputs(self, index):
+        """Returns the input wires of built-in chip index that its outputs follow at once."""
+        _, chip, inputs, _ = self.natives[index]
+        return [wire for (pin, _), wires in zip(chip.INPUTS, inputs) if pin in chip.COMBINATIONAL for wire in wires]
+
+    def levelize(self, nands):
+        """
+        Sorts the gates topologically, a level at a time. Raises HDLError on a
+        combinational loop.
+        """
+        gates = len(nands)
+        nodes = gates + len(self.natives)
+        driver = np.full(self.wires, -1, dtype=np.intc)
+        driver[nands[:, 2]] = np.arange(gates, dtype=np.intc)
+        sources = [nands[:, 0], nands[:, 1]]
+        targets = [np.arange(gates, dtype=np.intc)] * 2
+        for index, (_, _, _, outputs) in enumerate(self.natives):
+            driver[[wire for wires in outputs for wire in wires]] = gates + index
+            inputs = self.combinational_inputs(index)
+            sources.append(np.array(inputs, dtype=np.intc))
+            targets.append(np.full(len(inputs), gates + index, dtype=np.intc))
+        source = driver[np.concatenate(sources)]
+        target = np.concatenate(targets)
+        keep = source >= 0
+        source, target = source[keep], target[keep]
+        del driver, sources, targets, keep
+
+        # fan-out of every node, as consecutive runs of target, with 32-bit offsets: the
+        # temporaries here are as long as the netlist, and fresh pages cost more than the arithmetic
+        fanout = target[np.argsort(source, kind="stable")]
+        offsets = np.zeros(nodes + 1, dtype=np.intc)
+        np.cumsum(np.bincount(source, minlength=nodes), out=offsets[1:])
+        pending = np.bincount(target, minlength=nodes)
+        del source, target
+        level = np.zeros(nodes, dtype=np.intc)
+        # scratch for dropping repeated nodes without sorting: the last writer of a slot keeps it
+        slot = np.zeros(nodes, dtype=np.intc)
+        frontier = np.flatnonzero(pending == 0).astype(np.intc)
+        depth = done = 0
+        while frontier.size:
+            level[frontier] = depth
+            done += frontier.size
+            firsts = offsets[frontier]
+            counts = offsets[frontier + 1] - firsts
+            total = int(counts.sum())
+            if not total:
+                break
+            starts = np.repeat(firsts - np.cumsum(counts, dtype=np.intc) + counts, counts)
+            starts += np.arange(total, dtype=np.intc)
+            reached = fanout[starts]
+            np.subtract.at(pending, reached, 1)
+            reached = reached[pending[reached] == 0]
+            positions = np.arange(reached.size, dtype=np.intc)
+            slot[reached] = positions
+            frontier = reached[slot[reached] == positions]
+            depth += 1
+        if done < nodes:
+            raise HDLError("%s has a combinational loop through %d gates" % (self.name, nodes - done))
+
+        order = np.argsort(level, kind="stable")
+        gate_order = order[order < gates]
+        ordered = nands[gate_order]
+        self.nands = int_array(ordered)
+        self.levels = int_array(level[gate_order])
+        self.native_levels = level[gates:].tolist()
+
+    def schedule(self):
+        """
+        Returns the evaluation steps, each either an (a, b, out) triple of wire
+        arrays for a run of Nands, or the index of a built-in chip, which comes
+        after the Nands of its level. They copy every gate, so they are only
+        built when first asked for; the EventSimulator never needs them.
+        """
+        if self.steps is None:
+            nands = np.frombuffer(self.nands, dtype=np.intc).reshape(-1, 3)
+            levels = np.frombuffer(self.levels, dtype=np.intc)
+            self.steps = []
+            start = 0
+            for index in sorted(range(len(self.natives)), key=lambda index: self.native_levels[index]):
+                # the Nands up to this built-in chip, then the chip itself
+                end = int(np.searchsorted(levels, self.native_levels[index], side="right"))
+                self.add_nands(nands, start, end)
+                self.steps.append(index)
+                start = end
+            self.add_nands(nands, start, len(nands))
+        return self.steps
+
+    def add_nands(self, nands, start, end):
+        """Adds the Nands nands[start:end] to the steps as one run."""
+        if end > start:
+            run = nands[start:end]
+            self.steps.append(tuple(int_array(run[:, column]) for column in range(3)))
+
+    def fanout(self):
+        """
+        Returns (offsets, nodes), the fan-out of every wire in CSR form: the
+        nodes that read wire w are nodes[offsets[w]:offsets[w + 1]]. A node
+        below len(self.nands) // 3 is a Nand, in self.nands order; node
+        len(self.nands) // 3 + i is built-in chip i, listed for its
+        combinational inputs only.
+        """
+        nands = np.frombuffer(self.nands, dtype=np.intc).reshape(-1, 3)
+        gates = len(nands)
+        wires = [nands[:, 0], nands[:, 1]]
+        nodes = [np.arange(gates, dtype=np.intc)] * 2
+        for index in range(len(self.natives)):
+            inputs = self.combinational_inputs(index)
+            wires.append(np.array(inputs, dtype=np.intc))
+            nodes.append(np.full(len(inputs), gates + index, dtype=np.intc))
+        wire = np.concatenate(wires)
+        offsets = np.zeros(self.wires + 1, dtype=np.intc)
+        np.cumsum(np.bincount(wire, minlength=self.wires), out=offsets[1:])
+        return offsets, np.concatenate(nodes)[np.argsort(wire, kind="stable")]
+
+    def level_runs(self):
+        """
+        Returns the Nands grouped by level, one (a, b, out) triple of NumPy
+        wire arrays per level. The gates of a level only read wires settled by
+        earlier levels, so each group can be evaluated as one vector operation.
+        """
+        nands = np.frombuffer(self.nands, dtype=np.intc).reshape(-1, 3)
+        levels = np.frombuffer(self.levels, dtype=np.intc)
+        bounds = np.flatnonzero(np.diff(levels)) + 1
+        return [(group[:, 0], group[:, 1], group[:, 2]) for group in np.split(nands, bounds) if len(group)]
@@ -0,0 +1,268 @@
+from HardwareSimulator import HardwareSimulator
+from HDLParser import HDLError
+import argparse
+import numpy as np
+import os
+import sys
+import time
+
+# The test script parser is shared with the CPU emulator's test runner
+CPU_EMULATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CPUEmulator")
+if CPU_EMULATOR_DIR not in sys.path:
+    sys.path.append(CPU_EMULATOR_DIR)
+
+from TestRunner import FORMAT, parse, tokenize
+
+ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+ZERO = np.uint64(0)
+WORD = 0xFFFF
+
+
+def select(sel, pins, names):
+    """Returns the pin of names picked by sel, vector by vector."""
+    return np.choose(sel.astype(np.intp), [pins[name] for name in names])
+
+
+def route(sel, value, names):
+    """Returns value on the output of names picked by sel and 0 on the others."""
+    return {name: np.where(sel == index, value, ZERO) for index, name in enumerate(names)}
+
+
+def alu(pins):
+    """The Hack ALU on vectors of x, y and its six control bits."""
+    x = np.where(pins["zx"] == 1, ZERO, pins["x"])
+    x = np.where(pins["nx"] == 1, x ^ WORD, x)
+    y = np.where(pins["zy"] == 1, ZERO, pins["y"])
+    y = np.where(pins["ny"] == 1, y ^ WORD, y)
+    out = np.where(pins["f"] == 1, (x + y) & WORD, x & y)
+    out = np.where(pins["no"] == 1, out ^ WORD, out)
+    return {"out": out, "zr": (out == 0).astype(np.uint64), "ng": out >> 15}
+
+
+# Chip name -> reference model, a function from {IN pin: uint64 array of values} to {OUT pin: array}
+MODELS = {
+    "Not": lambda pins: {"out": pins["in"] ^ 1},
+    "And": lambda pins: {"out": pins["a"] & pins["b"]},
+    "Or": lambda pins: {"out": pins["a"] | pins["b"]},
+    "Xor": lambda pins: {"out": pins["a"] ^ pins["b"]},
+    "Mux": lambda pins: {"out": np.where(pins["sel"] == 1, pins["b"], pins["a"])},
+    "DMux": lambda pins: route(pins["sel"], pins["in"], "ab"),
+    "Not16": lambda pins: {"out": pins["in"] ^ WORD},
+    "And16": lambda pins: {"out": pins["a"] & pins["b"]},
+    "Or16": lambda pins: {"out": pins["a"] | pins["b"]},
+    "Mux16": lambda pins: {"out": np.where(pins["sel"] == 1, pins["b"], pins["a"])},
+    "Or8Way": lambda pins: {"out": (pins["in"] != 0).astype(np.uint64)},
+    "Mux4Way16": lambda pins: {"out": select(pins["sel"], pins, "abcd")},
+    "Mux8Way16": lambda pins: {"out": select(pins["sel"], pins, "abcdefgh")},
+    "DMux4Way": lambda pins: route(pins["sel"], pins["in"], "abcd"),
+    "DMux8Way": lambda pins: route(pins["sel"], pins["in"], "abcdefgh"),
+    "HalfAdder": lambda pins: {"sum": pins["a"] ^ pins["b"], "carry": pins["a"] & pins["b"]},
+    "FullAdder": lambda pins: {"sum": (pins["a"] + pins["b"] + pins["c"]) & 1,
+                               "carry": (pins["a"] + pins["b"] + pins["c"]) >> 1},
+    "Add16": lambda pins: {"out": (pins["a"] + pins["b"]) & WORD},
+    "Inc16": lambda pins: {"out": (pins["in"] + 1) & WORD},
+    "ALU": alu,
+}
+
+
+def to_planes(values):
+    """Packs a uint64 array of values, a multiple of 64 long, into bit-planes: bit k of word j is vector 64j + k."""
+    return np.packbits(values.astype(np.uint8), bitorder="little").view(np.uint64)
+
+
+def from_planes(planes):
+    """Unpacks bit-planes into one 0 or 1 per vector."""
+    return np.unpackbits(planes.view(np.uint8), bitorder="little").astype(np.uint64)
+
+
+class TruthTableVerifier:
+    """
+    Checks a combinational chip against its reference model on every input
+    pattern, or on a random sample of them when there are too many.
+
+    The netlist is evaluated on bit-planes. Each wire holds a uint64 array in
+    which bit k of word j is the wire's value for vector 64j + k, and each
+    level of Nands is one NumPy operation over all its gates and vectors. The
+    vectors are run in chunks, so the planes stay small whatever the sample
+    size.
+    """
+
+    def __init__(self, filename, chunk=1 << 16):
+        """
+        @attr self.netlist (Netlist): the chip's compiled netlist
+        @attr self.model (function): the chip's reference model from MODELS
+        @attr self.runs (list of (array, array, array)): the netlist's Nands, one group per level
+        @attr self.chunk (int): vectors evaluated at once, a multiple of 64
+        @attr self.elapsed (float): seconds spent evaluating the netlist so far
+        """
+        self.filename = filename
+        self.netlist = HardwareSimulator.load(filename).netlist
+        self.name = self.netlist.name
+        if self.name not in MODELS:
+            raise HDLError("%s: no reference model for %s" % (filename, self.name))
+        if self.netlist.dffs or self.netlist.natives:
+            raise HDLError("%s: %s is not combinational" % (filename, self.name))
+        self.model = MODELS[self.name]
+        self.runs = self.netlist.level_runs()
+        self.chunk = max(64, chunk - chunk % 64)
+        self.elapsed = 0.0
+
+    def input_bits(self):
+        """Returns the number of IN pin bits, log2 of the size of the input space."""
+        return sum(len(wires) for wires in self.netlist.inputs.values())
+
+    def simulate(self, pins):
+        """Evaluates the netlist on {IN pin: uint64 array of values} and returns {OUT pin: array of values}."""
+        start = time.perf_counter()
+        count = len(next(iter(pins.values())))
+        values = np.zeros((self.netlist.wires, count // 64), dtype=np.uint64)
+        values[1] = ONES
+        for pin, wires in self.netlist.inputs.items():
+            for bit, wire in enumerate(wires):
+                values[wire] = to_planes((pins[pin] >> np.uint64(bit)) & 1)
+        for a, b, out in self.runs:
+            values[out] = ~(values[a] & values[b])
+        outputs = {}
+        for pin, wires in self.netlist.outputs.items():
+            result = np.zeros(count, dtype=np.uint64)
+            for bit, wire in enumerate(wires):
+                result |= from_planes(values[wire]) << np.uint64(bit)
+            outputs[pin] = result
+        self.elapsed += time.perf_counter() - start
+        return outputs
+
+    def vectors(self, samples, max_bits, seed):
+        """
+        Yields {IN pin: uint64 array} chunks: every input pattern if there are
+        at most 2 ** max_bits of them, else samples random ones.
+        """
+        bits = self.input_bits()
+        exhaustive = bits <= max_bits
+        total = 1 << bits if exhaustive else samples
+        rng = np.random.default_rng(seed)
+        for start in range(0, total, self.chunk):
+            count = min(self.chunk, total - start)
+            padded = count + -count % 64
+            pins = {}
+            if exhaustive:
+                index = np.arange(start, start + padded, dtype=np.uint64)
+                offset = 0
+                for pin, wires in self.netlist.inputs.items():
+                    pins[pin] = (index >> np.uint64(offset)) & np.uint64((1 << len(wires)) - 1)
+                    offset += len(wires)
+            else:
+                for pin, wires in self.netlist.inputs.items():
+                    pins[pin] = rng.integers(0, (1 << len(wires)) - 1, padded, dtype=np.uint64, endpoint=True)
+            yield count, pins
+
+    def verify(self, samples=1 << 20, max_bits=24, seed=0):
+        """
+        Runs the vectors through the netlist and the model. Returns (vectors
+        checked, None) if they all agree, or (vectors checked, message) at the
+        first mismatch.
+        """
+        checked = 0
+        for count, pins in self.vectors(samples, max_bits, seed):
+            message = self.compare(pins, self.simulate(pins), count)
+            if message:
+                return checked, message
+            checked += count
+        return checked, None
+
+    def compare(self, pins, outputs, count):
+        """Returns a description of the first of count vectors where outputs differ from the model, or None."""
+        expected = self.model(pins)
+        first = count
+        for pin in self.netlist.outputs:
+            differ = np.flatnonzero(outputs[pin][:count] != expected[pin][:count])
+            if differ.size:
+                first = min(first, int(differ[0]))
+        if first == count:
+            return None
+        inputs = " ".join("%s=%d" % (pin, pins[pin][first]) for pin in self.netlist.inputs)
+        results = ", ".join("%s is %d, expected %d" % (pin, outputs[pin][first], expected[pin][first])
+                            for pin in self.netlist.outputs if outputs[pin][first] != expected[pin][first])
+        return "mismatch at %s: %s" % (inputs, results)
+
+    def check_model(self):
+        """
+        Checks the reference model itself on the rows of the chip's .cmp file,
+        read with the columns of its .tst output-list. Returns (rows checked,
+        None or a message for the first disagreeing row), or None if there is
+        no .tst / .cmp pair.
+        """
+        base = os.path.splitext(self.filename)[0]
+        if not (os.path.exists(base + ".tst") and os.path.exists(base + ".cmp")):
+            return None
+        with open(base + ".tst", "r") as f:
+            commands, _ = parse(tokenize(f.read()))
+        columns = next(command[1:] for command in commands if command[0] == "output-list")
+        columns = [FORMAT.match(column).groups()[:2] for column in columns]
+        with open(base + ".cmp", "r") as f:
+            rows = [line.strip().strip("|").split("|") for line in f.read().splitlines()[1:] if line.strip()]
+        pins = {**self.netlist.inputs, **self.netlist.outputs}
+        table = {name: [] for name, _ in columns if name in pins}
+        for row in rows:
+            for (name, kind), cell in zip(columns, row):
+                if name in table:
+                    base = {"B": 2, "X": 16}.get(kind, 10)
+                    table[name].append(int(cell.strip(), base) & ((1 << len(pins[name])) - 1))
+        table = {name: np.array(values, dtype=np.uint64) for name, values in table.items()}
+        if any(pin not in table for pin in self.netlist.inputs):
+            return None
+        expected = self.model(table)
+        for index in range(len(rows)):
+            for pin in self.netlist.outputs:
+                if pin in table and table[pin][index] != expected[pin][index]:
+                    return len(rows), "row %d: model gives %s=%d, .cmp has %d" % (
+                        index + 1, pin, expected[pin][index], table[pin][index])
+        return len(rows), None
+
+
+def find_chips(paths):
+    """Expands directories into the .hdl files in them that have a reference model."""
+    chips = []
+    for path in paths:
+        if os.path.isdir(path):
+            chips += sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.endswith(".hdl") and name[:-4] in MODELS)
+        else:
+            chips.append(path)
+    return chips
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Check combinational chips against reference models on every input, or a random sample.")
+    argparser.add_argument("paths", nargs="+", help="Xxx.hdl chips, or directories of them")
+    argparser.add_argument("--max-bits", type=int, default=24, help="test every input if the chip has at most this many input bits")
+    argparser.add_argument("--samples", type=int, default=1 << 20, help="random vectors for chips with more input bits")
+    argparser.add_argument("--seed", type=int, default=0, help="seed of the random vectors")
+    argparser.add_argument("--chunk", type=int, default=1 << 16, help="vectors evaluated at once")
+    args = argparser.parse_args()
+
+    failed = 0
+    for filename in find_chips(args.paths):
+        try:
+            verifier = TruthTableVerifier(filename, args.chunk)
+        except HDLError as error:
+            print(error)
+            failed += 1
+            continue
+        checked = verifier.check_model()
+        if checked and checked[1]:
+            print("%s: the reference model disagrees with the .cmp file, %s" % (verifier.name, checked[1]))
+            failed += 1
+            continue
+        kind = "exhaustive" if verifier.input_bits() <= args.max_bits else "random"
+        count, message = verifier.verify(args.samples, args.max_bits, args.seed)
+        rate = count / verifier.elapsed if verifier.elapsed else 0
+        if message:
+            print("%s: %s (after %d vectors)" % (verifier.name, message, count))
+            failed += 1
+        else:
+            print("%s: %d %s vectors passed, %.0f vectors/s" % (verifier.name, count, kind, rate))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
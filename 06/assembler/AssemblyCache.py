@@ -0,0 +1,143 @@
+from Parser import Parser
+from HackAssembler import label_pass, encode_pass
+from array import array
+import hashlib
+import os
+import struct
+import sys
+
+# Cache file layout: a header, then per entry its 20-byte key, its word count and
+# the words, little-endian as in .hackb files. Plain data only, so a cache file
+# written by someone else can be read safely.
+MAGIC = b"HKAC"
+VERSION = 1
+HEADER = struct.Struct("<4sHI")
+ENTRY = struct.Struct("<20sI")
+
+
+class AssemblyCache:
+    """
+    An on-disk cache of encoded program chunks for incremental reassembly.
+
+    The cleaned source is split into chunks at label boundaries. A chunk's words
+    depend only on its own text and on the addresses of the symbols it refers to,
+    so both go into its key; when neither changed since the last run, the words
+    stored for that key are reused instead of being encoded again.
+    """
+
+    def __init__(self, path):
+        """
+        Opens the cache stored at path, starting empty if it does not exist yet.
+        @attr self.entries (dict): chunk key -> packed words from earlier runs
+        @attr self.used (dict): the entries this run produced or reused; only these are saved
+        @attr self.hits, self.misses (int): chunks reused / encoded by this run
+        """
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.entries = self._read(f.read())
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+        self.hit_words = 0
+        self.miss_words = 0
+
+    def assemble(self, parser, code, symboltable):
+        """Assembles the parsed file like two_pass, reusing cached chunks, and returns an array('H')."""
+        label_pass(parser, symboltable)
+        chunks = self._split(parser.text)
+
+        # Variables are allocated over the whole program first, in order of first
+        # use, so every chunk sees the same addresses the two-pass path would give.
+        Res = array("H")
+        for chunk, symbols in chunks:
+            for sym in symbols:
+                if not symboltable.contains(sym):
+                    symboltable.addEntry(sym, parser.current_address)
+                    parser.current_address += 1
+
+        for chunk, symbols in chunks:
+            key = self._key(chunk, symbols, symboltable)
+            packed = self.entries.get(key)
+            if packed is None:
+                words = array("H", encode_pass(Parser(lines=chunk), code, symboltable))
+                packed = words.tobytes()
+                self.misses += 1
+                self.miss_words += len(words)
+            else:
+                self.hits += 1
+                self.hit_words += len(packed) // 2
+            self.used[key] = packed
+            Res.frombytes(packed)
+        return Res
+
+    def _split(self, text):
+        """Splits cleaned lines into (chunk, referenced symbols) pairs, starting a chunk at each label."""
+        chunks = []
+        chunk = []
+        for command in text:
+            if command[0] == "(" and chunk and chunk[-1][0] != "(":
+                chunks.append(chunk)
+                chunk = []
+            chunk.append(command)
+        if chunk:
+            chunks.append(chunk)
+        return [(chunk, self._symbols(chunk)) for chunk in chunks]
+
+    def _symbols(self, chunk):
+        """Returns the symbols the A commands of chunk refer to, in order of first use."""
+        symbols = {}
+        for command in chunk:
+            if command[0] == "@" and not command[1:].isdigit():
+                symbols[command[1:]] = None
+        return list(symbols)
+
+    def _key(self, chunk, symbols, symboltable):
+        """Returns the cache key of a chunk: a digest of its text and its symbols' addresses."""
+        digest = hashlib.sha1("\n".join(chunk).encode())
+        for sym in symbols:
+            digest.update(("\0%s=%d" % (sym, symboltable.getAddress(sym))).encode())
+        return digest.digest()
+
+    def _read(self, data):
+        """Returns the entries stored in the cache file contents data, or none if it is not a valid cache."""
+        if len(data) < HEADER.size:
+            return {}
+        magic, version, count = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            return {}
+        entries = {}
+        offset = HEADER.size
+        for _ in range(count):
+            if offset + ENTRY.size > len(data):
+                return {}
+            key, length = ENTRY.unpack_from(data, offset)
+            offset += ENTRY.size
+            if offset + 2 * length > len(data):
+                return {}
+            words = array("H", data[offset:offset + 2 * length])
+            if sys.byteorder == "big":
+                words.byteswap()
+            entries[key] = words.tobytes()
+            offset += 2 * length
+        return entries
+
+    def save(self):
+        """Writes the entries used by this run back to disk, dropping stale ones."""
+        with open(self.path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.used)))
+            for key, packed in self.used.items():
+                words = array("H", packed)
+                if sys.byteorder == "big":
+                    words.byteswap()
+                f.write(ENTRY.pack(key, len(words)))
+                words.tofile(f)
+
+    def report(self):
+        """Returns a one-line summary of cache hits and misses."""
+        chunks = self.hits + self.misses
+        words = self.hit_words + self.miss_words
+        return "cache: %d/%d chunks reused (%d hits, %d misses), %d/%d words reused (%.1f%%)" % (
+            self.hits, chunks, self.hits, self.misses, self.hit_words, words,
+            100.0 * self.hit_words / words if words else 0.0)
@@ -0,0 +1,230 @@
+from Code import Code
+from SymbolTable import SymbolTable
+from Parser import Parser
+from RomImage import write_hack, write_hackb, read_hack, read_hackb
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import HackAssembler
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROGRAMS = ["add/Add.asm", "max/Max.asm", "rect/Rect.asm", "pong/Pong.asm", "pong/PongL.asm"]
+SYNTHETIC_SIZES = [10 ** 5, 10 ** 6]
+PHASES = ["read/clean", "label pass", "encode", "write"]
+MODES = {
+    "two-pass": HackAssembler.two_pass,
+    "single-pass": HackAssembler.single_pass,
+}
+
+
+def time_mode(assemble, parser, repeat):
+    """Returns the best wall time of repeat runs of assemble over an already parsed file, and its output."""
+    best = None
+    for _ in range(repeat):
+        parser.current_index = 0
+        parser.current_line = 0
+        parser.current_address = 16
+        start = time.perf_counter()
+        Res = assemble(parser, Code(), SymbolTable())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, Res
+
+
+def time_rom_load(Res, repeat):
+    """Returns the best times for loading Res back from a text .hack and a packed .hackb file."""
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for suffix, write, read in ((".hack", write_hack, read_hack), (".hackb", write_hackb, read_hackb)):
+            filename = os.path.join(tmp, "rom" + suffix)
+            write(Res, filename)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rom = read(filename)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            assert rom == Res, suffix + ": ROM image does not round-trip"
+            timings[suffix] = best
+    return timings
+
+
+def run_phases(filename, repeat):
+    """
+    Assembles filename with the two-pass pipeline repeat times in this process,
+    timing each phase separately. Returns the best time of every phase together
+    with the sizes, throughput and the peak RSS of the process in KB.
+    """
+    best = dict.fromkeys(PHASES)
+    with tempfile.TemporaryDirectory() as tmp:
+        outfile = os.path.join(tmp, "out.hack")
+        for _ in range(repeat):
+            times = {}
+            start = time.perf_counter()
+            parser = Parser(filename)
+            times["read/clean"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            symboltable = SymbolTable()
+            HackAssembler.label_pass(parser, symboltable)
+            times["label pass"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            words = array("H", HackAssembler.encode_pass(parser, Code(), symboltable))
+            times["encode"] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            write_hack(words, outfile)
+            times["write"] = time.perf_counter() - start
+
+            for phase, elapsed in times.items():
+                best[phase] = elapsed if best[phase] is None else min(best[phase], elapsed)
+    total = sum(best.values())
+    return {
+        "lines": parser.total_lines,
+        "words": len(words),
+        "phases": best,
+        "total": total,
+        "lines_per_second": parser.total_lines / total if total else 0.0,
+        # kilobytes on Linux
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def measure(filename, repeat):
+    """Runs run_phases in a fresh interpreter, so the peak RSS belongs to this input alone."""
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_phases, filename, repeat).result()
+
+
+def suite(sizes, repeat):
+    """Measures every program of the course plus a synthetic program of each size; returns {case: result}."""
+    results = {}
+    for program in PROGRAMS:
+        results[program] = measure(os.path.join(PROJECT_DIR, program), repeat)
+        print_result(program, results[program])
+    with tempfile.TemporaryDirectory() as tmp:
+        for lines in sizes:
+            case = "synthetic-%d" % lines
+            filename = os.path.join(tmp, "Synthetic.asm")
+            synthesize(filename, lines)
+            results[case] = measure(filename, repeat)
+            print_result(case, results[case])
+    return results
+
+
+def print_result(case, result):
+    """Prints one row of the suite table."""
+    phases = "  ".join("%10.2f" % (result["phases"][phase] * 1000) for phase in PHASES)
+    print("%-18s %9d %12.0f %8.1f  %s" % (case, result["lines"], result["lines_per_second"],
+                                          result["peak_rss_kb"] / 1024.0, phases))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares throughput against a saved baseline and prints every case that got
+    slower by more than tolerance. Returns True if there was any regression.
+    """
+    regressed = False
+    for case, result in results.items():
+        old = baseline["cases"].get(case)
+        if old is None or not old["lines_per_second"]:
+            continue
+        ratio = result["lines_per_second"] / old["lines_per_second"]
+        if ratio < 1 - tolerance:
+            regressed = True
+            print("REGRESSION %-18s %12.0f -> %12.0f lines/s (%.1f%%)" % (
+                case, old["lines_per_second"], result["lines_per_second"], (ratio - 1) * 100))
+    return regressed
+
+
+def synthesize(filename, lines):
+    """
+    Writes a synthetic program of about the given number of lines to filename: VM-style
+    stack code with variables, comments and jumps back to a bounded set of labels, so
+    every address still fits in a 16-bit word however long the program gets.
+    """
+    block = ["@x%d", "D=M", "@SP", "AM=M-1", "M=D+M", "// comment", "@L%d", "D;JGT"]
+    with open(filename, "w") as f:
+        for i in range(lines // len(block) + 1):
+            if i < 1000 and i % 10 == 0:
+                f.write("(L%d)\n" % i)
+            f.write("\n".join(block) % (i % 97, i % 1000 // 10 * 10) + "\n")
+
+
+def scaling(lines, max_workers, repeat):
+    """Times parallel encoding of a synthetic program with 1 to max_workers workers against the serial path."""
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "Synthetic.asm")
+        synthesize(filename, lines)
+        parser = Parser(filename)
+    serial, expected = time_mode(HackAssembler.two_pass, parser, repeat)
+    print("%d lines  serial %8.2f ms" % (parser.total_lines, serial * 1000))
+    for workers in range(1, max_workers + 1):
+        def assemble(parser, code, symboltable):
+            return HackAssembler.parallel(parser, code, symboltable, workers)
+        elapsed, Res = time_mode(assemble, parser, repeat)
+        assert Res == expected, "%d workers: output differs from serial mode" % workers
+        print("%d lines  %2d workers %8.2f ms  speedup %.2fx" % (parser.total_lines, workers, elapsed * 1000, serial / elapsed))
+
+
+def modes(repeat):
+    """Times the two-pass and single-pass modes and ROM loading on the programs of the course."""
+    for program in PROGRAMS:
+        parser = Parser(os.path.join(PROJECT_DIR, program))
+        results = {name: time_mode(assemble, parser, repeat) for name, assemble in MODES.items()}
+        outputs = [Res for _, Res in results.values()]
+        assert all(Res == outputs[0] for Res in outputs), program + ": outputs differ"
+        timings = "  ".join("%s %8.2f ms" % (name, t * 1000) for name, (t, _) in results.items())
+        print("%-16s %6d lines  %s" % (program, parser.total_lines, timings))
+        loads = time_rom_load(outputs[0], repeat)
+        print("%-16s %6s load   %s" % ("", "", "  ".join("%s %8.2f ms" % (s, t * 1000) for s, t in loads.items())))
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the Hack assembler.")
+    argparser.add_argument("--repeat", type=int, default=3, help="runs per measurement; the best is kept")
+    argparser.add_argument("--sizes", type=int, nargs="*", default=SYNTHETIC_SIZES, metavar="LINES",
+                           help="sizes of the synthetic programs in the suite (e.g. 100000 1000000 10000000)")
+    argparser.add_argument("--json", metavar="FILE", help="save the suite results to FILE")
+    argparser.add_argument("--baseline", metavar="FILE", help="compare the suite against results saved by --json")
+    argparser.add_argument("--tolerance", type=float, default=0.10,
+                           help="slowdown against the baseline reported as a regression (default 0.10)")
+    argparser.add_argument("--modes", action="store_true",
+                           help="instead, compare the two-pass and single-pass modes and ROM loading")
+    argparser.add_argument("--scaling", type=int, metavar="N",
+                           help="instead, time parallel encoding with 1..N workers on a synthetic program")
+    argparser.add_argument("--lines", type=int, default=10 ** 6, help="size of the synthetic program for --scaling")
+    args = argparser.parse_args()
+    if args.scaling:
+        scaling(args.lines, args.scaling, args.repeat)
+        return
+    if args.modes:
+        modes(args.repeat)
+        return
+
+    print("%-18s %9s %12s %8s  %s" % ("case", "lines", "lines/s", "RSS MB",
+                                      "  ".join("%10s" % phase for phase in PHASES)))
+    print("%-18s %9s %12s %8s  %s" % ("", "", "", "", "  ".join("%10s" % "(ms)" for phase in PHASES)))
+    results = suite(args.sizes, args.repeat)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(),
+                       "cases": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
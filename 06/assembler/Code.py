@@ -40,6 +40,13 @@ class Code:
             "D&M": ("1", "000000"),
             "D|A": ("0", "010101"),
             "D|M": ("1", "010101"),
+            # commutative spellings, as emitted by 08/VMTranslator (e.g. "A=M+D")
+            "A+D": ("0", "000010"),
+            "M+D": ("1", "000010"),
+            "A&D": ("0", "000000"),
+            "M&D": ("1", "000000"),
+            "A|D": ("0", "010101"),
+            "M|D": ("1", "010101"),
             None: ("0", "000000")
         }
 
@@ -54,6 +61,11 @@ class Code:
             None: "000"
         }
 
+        # The same tables as ints, already shifted into their place in a C command
+        self.dest_bits = {k: int(v, 2) << 3 for k, v in self.dest_dict.items()}
+        self.comp_bits = {k: int(a + c, 2) << 6 for k, (a, c) in self.comp_dict.items()}
+        self.jump_bits = {k: int(v, 2) for k, v in self.jump_dict.items()}
+
     def dest(self, mnemonic):
         return self.dest_dict.get(mnemonic, "000")
 
@@ -62,4 +74,8 @@ class Code:
         return a + c
 
     def jump(self, mnemonic):
-        return self.jump_dict.get(mnemonic, "000")
\ No newline at end of file
+        return self.jump_dict.get(mnemonic, "000")
+
+    def encode(self, dest, comp, jump):
+        """Returns the C command built from the given mnemonics as a 16-bit int."""
+        return 0xE000 | self.comp_bits.get(comp, 0) | self.dest_bits.get(dest, 0) | self.jump_bits.get(jump, 0)
\ No newline at end of file
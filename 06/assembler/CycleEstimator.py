@@ -0,0 +1,330 @@
+from Parser import Parser
+from SourceMap import SourceMap
+import argparse
+
+# Name of the code at address 0 when it is not a function (the bootstrap, or a whole non-VM program)
+ROOT = "[start]"
+
+
+class CycleEstimator:
+    """
+    Estimates, without running it, how many instructions a Hack program spends
+    in each of its VM functions.
+
+    The cleaned instruction stream is cut into basic blocks, and the control-flow
+    graph comes from "@target" / jump pairs. A jump whose A register is not a
+    literal address or label (the "@R14 A=M 0;JMP" of a return) leaves the
+    graph. So does the "@n 0;JMP" end-of-program loop onto itself. An
+    unconditional jump is a call when its block loads the address right after
+    it as data ("@Xxx$ret0 D=A" pushes the return address). Control comes back after it,
+    and the call costs what the callee costs. When the jump goes to a shared
+    call helper, as in the book's Pong.asm, the helper's instructions are added
+    too, and the callee is the function label loaded earlier in the block.
+
+    Every instruction takes one cycle. Each function is costed as its acyclic
+    body: the cheapest and the dearest path from its entry to a return, with the
+    back-edges of loops removed, so every loop runs zero times (or once, for
+    loops that test at the bottom). The cost of one pass around each loop body
+    is given next to it. The costs of callees are included, except for
+    recursive calls, which are counted as free.
+    """
+
+    def __init__(self, lines, source=""):
+        """
+        @attr self.source_map (SourceMap): asm lines and labels of the program
+        @attr self.commands (list of str): the cleaned instructions, by ROM address
+        @attr self.entries (dict): function entry address -> function label
+        @attr self.starts (list of int): first address of each basic block
+        @attr self.block_of (list of int): ROM address -> its block
+        @attr self.successors (list of list of int): block -> the blocks control can go to next
+        @attr self.exits (set): blocks that end in a return, computed jump or halt
+        @attr self.calls (dict): call-site block -> (helper address or None, callee function or None)
+        @attr self.recursive (set): functions whose costs leave out a recursive call
+        """
+        lines = list(lines)
+        self.source_map = SourceMap.build(lines, source)
+        self.commands = [command for command in Parser(lines=lines).text if command[0] != "("]
+        labels = self.source_map.labels
+        self.entries = {}
+        for label, address in sorted(labels.items(), key=lambda item: item[1]):
+            if SourceMap.is_function(label) and address not in self.entries:
+                self.entries[address] = label
+        self.functions = {label: address for address, label in self.entries.items()}
+        self.recursive = set()
+        self._function_costs = {}
+        self._helper_costs = {}
+        self._active = []
+        self._build_graph()
+
+    @classmethod
+    def from_file(cls, filename):
+        """Reads the .asm file filename."""
+        with open(filename, "r") as f:
+            return cls(f.readlines(), filename)
+
+    def jump_target(self, address):
+        """Returns the literal address the jump at address goes to, or None if it is computed."""
+        if address == 0 or address in self._leaders_from_labels:
+            # reachable from elsewhere, with some other value in A
+            return None
+        previous = self.commands[address - 1]
+        if previous[0] != "@":
+            return None
+        symbol = previous[1:]
+        if symbol.isdigit():
+            return int(symbol)
+        return self.source_map.labels.get(symbol)
+
+    def loaded_labels(self, start, end):
+        """Returns the labels the block [start, end) loads as data ("@L" then "D=A"), in order."""
+        labels = self.source_map.labels
+        return [self.commands[address][1:] for address in range(start, end - 1)
+                if self.commands[address][0] == "@" and self.commands[address][1:] in labels
+                and self.commands[address + 1] == "D=A"]
+
+    def _build_graph(self):
+        """Cuts the program into basic blocks and links them."""
+        size = len(self.commands)
+        self._leaders_from_labels = set(self.source_map.labels.values())
+        jumps = {}
+        leaders = {0} | {address for address in self._leaders_from_labels if address < size}
+        for address, command in enumerate(self.commands):
+            if ";" in command:
+                target = self.jump_target(address)
+                jumps[address] = target
+                leaders.add(address + 1)
+                if target is not None and target < size:
+                    leaders.add(target)
+        self.starts = sorted(address for address in leaders if address < size)
+        self.block_of = [0] * size
+        for block, start in enumerate(self.starts):
+            end = self.starts[block + 1] if block + 1 < len(self.starts) else size
+            for address in range(start, end):
+                self.block_of[address] = block
+
+        self.successors = []
+        self.exits = set()
+        self.calls = {}
+        labels = self.source_map.labels
+        for block, start in enumerate(self.starts):
+            end = self.end(block)
+            last = end - 1
+            loaded = self.loaded_labels(start, end)
+            successors = []
+            if last not in jumps:
+                if end < size:
+                    successors.append(self.block_of[end])
+                else:
+                    self.exits.add(block)
+            else:
+                target = jumps[last]
+                unconditional = self.commands[last].split(";", 1)[1] == "JMP"
+                if target is None or target == last - 1:
+                    # a return, a computed jump or the end-of-program loop
+                    self.exits.add(block)
+                elif unconditional and any(labels[label] == end for label in loaded):
+                    callee = self.entries.get(target)
+                    helper = None if callee is not None else target
+                    if callee is None:
+                        callee = next((label for label in reversed(loaded) if label in self.functions), None)
+                    self.calls[block] = (helper, callee)
+                elif target < size:
+                    successors.append(self.block_of[target])
+                if not unconditional or block in self.calls:
+                    if end < size:
+                        successors.append(self.block_of[end])
+            self.successors.append(successors)
+
+    def end(self, block):
+        """Returns the address after the last instruction of block."""
+        return self.starts[block + 1] if block + 1 < len(self.starts) else len(self.commands)
+
+    def walk(self, root):
+        """
+        Depth-first search over the blocks reachable from block root. Returns
+        (order, back_edges): the blocks in reverse postorder, and the (source,
+        header) edges that close a loop.
+        """
+        order = []
+        back_edges = []
+        state = {root: 1}
+        stack = [(root, iter(self.successors[root]))]
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                seen = state.get(successor)
+                if seen is None:
+                    state[successor] = 1
+                    stack.append((successor, iter(self.successors[successor])))
+                    break
+                if seen == 1:
+                    back_edges.append((block, successor))
+            else:
+                stack.pop()
+                state[block] = 2
+                order.append(block)
+        order.reverse()
+        return order, back_edges
+
+    def weight(self, block, inclusive):
+        """
+        Returns the (best, worst) cycles of running block, with the shared helper
+        it calls and, if inclusive, the function it calls. Returns None if the
+        call never returns.
+        """
+        cycles = self.end(block) - self.starts[block]
+        best = worst = cycles
+        helper, callee = self.calls.get(block, (None, None))
+        parts = []
+        if helper is not None:
+            parts.append(self.helper_cost(helper))
+        if inclusive and callee is not None:
+            if callee in self._active:
+                self.recursive.add(self._active[-1])
+            else:
+                parts.append(self.function_cost(callee)[0])
+        for part in parts:
+            if part is None:
+                return None
+            best += part[0]
+            worst += part[1]
+        return best, worst
+
+    def path_costs(self, order, back_edges, inclusive, allowed=None, goal=None):
+        """
+        Returns {block: (best, worst)}, the cheapest and dearest acyclic paths
+        from each block of order to an exit (or, with goal, to the end of block
+        goal, through blocks in allowed only). Blocks that cannot get there map
+        to None.
+        """
+        back_edges = set(back_edges)
+        costs = {}
+        for block in reversed(order):
+            if allowed is not None and block not in allowed:
+                continue
+            weight = self.weight(block, inclusive)
+            if weight is None:
+                costs[block] = None
+                continue
+            if goal is not None:
+                ends = [(0, 0)] if block == goal else []
+            else:
+                ends = [(0, 0)] if block in self.exits else []
+            if block != goal:
+                for successor in self.successors[block]:
+                    if (block, successor) not in back_edges and costs.get(successor) is not None:
+                        ends.append(costs[successor])
+            if ends:
+                costs[block] = (weight[0] + min(end[0] for end in ends), weight[1] + max(end[1] for end in ends))
+            else:
+                costs[block] = None
+        return costs
+
+    def helper_cost(self, address):
+        """Returns the (best, worst) cycles of a shared helper entered at address, up to where it leaves."""
+        if address not in self._helper_costs:
+            root = self.block_of[address]
+            order, back_edges = self.walk(root)
+            self._helper_costs[address] = self.path_costs(order, back_edges, False)[root]
+        return self._helper_costs[address]
+
+    def function_cost(self, function):
+        """
+        Returns ((best, worst), (best, worst) without callees, loops) for one
+        call of function, where loops is [(header address, best, worst)] for one
+        pass around each loop body. The costs are None if the function never
+        returns.
+        """
+        if function not in self._function_costs:
+            address = self.functions.get(function, 0)
+            root = self.block_of[address]
+            self._active.append(function)
+            order, back_edges = self.walk(root)
+            inclusive = self.path_costs(order, back_edges, True)[root]
+            own = self.path_costs(order, back_edges, False)[root]
+            loops = []
+            for source, header in back_edges:
+                if self.owner(self.starts[header]) != function:
+                    continue
+                body = self.loop_body(source, header, back_edges)
+                iteration = self.path_costs(order, back_edges, True, body, source)[header]
+                if iteration is not None:
+                    loops.append((self.starts[header],) + iteration)
+            self._active.pop()
+            self._function_costs[function] = (inclusive, own, sorted(loops))
+        return self._function_costs[function]
+
+    def loop_body(self, source, header, back_edges):
+        """Returns the blocks of the natural loop closed by the back-edge source -> header."""
+        predecessors = {}
+        for block, successors in enumerate(self.successors):
+            for successor in successors:
+                predecessors.setdefault(successor, []).append(block)
+        body = {header, source}
+        pending = [source]
+        while pending:
+            block = pending.pop()
+            if block == header:
+                continue
+            for predecessor in predecessors.get(block, ()):
+                if predecessor not in body:
+                    body.add(predecessor)
+                    pending.append(predecessor)
+        return body
+
+    def owner(self, address):
+        """Returns the function the instruction at address belongs to."""
+        return self.source_map.function_at(address) or ROOT
+
+    def estimate(self):
+        """Returns {function: function_cost(function)} for every function, with ROOT for code at address 0 outside one."""
+        functions = list(self.functions)
+        if 0 not in self.entries and self.commands:
+            functions.insert(0, ROOT)
+        return {function: self.function_cost(function) for function in functions}
+
+    def describe(self, address):
+        """Returns "address (line n)" for a ROM address."""
+        return "%5d (line %d)" % (address, self.source_map.asm_lines[address])
+
+    def report(self, top=20):
+        """Returns the text report: the most expensive functions per call, and their loops."""
+        estimates = self.estimate()
+
+        def cell(value):
+            return "%10s" % ("-" if value is None else value)
+
+        def dearest(item):
+            inclusive = item[1][0]
+            return -1 if inclusive is None else inclusive[1]
+
+        lines = ["%d instructions, %d blocks, %d functions" % (len(self.commands), len(self.starts), len(self.functions)),
+                 "", "%-40s %10s %10s %10s %10s %6s" % ("function", "best", "worst", "own best", "own worst", "loops")]
+        ranked = sorted(estimates.items(), key=dearest, reverse=True)
+        for function, (inclusive, own, loops) in ranked[:top]:
+            inclusive = inclusive or (None, None)
+            own = own or (None, None)
+            name = function + (" (recursive)" if function in self.recursive else "")
+            lines.append("%-40s %s %s %s %s %6d" % (name, cell(inclusive[0]), cell(inclusive[1]),
+                                                    cell(own[0]), cell(own[1]), len(loops)))
+
+        lines += ["", "%-40s %10s %10s  %s" % ("loop", "best", "worst", "header")]
+        loops = [(worst, best, header, function) for function, (_, _, function_loops) in estimates.items()
+                 for header, best, worst in function_loops]
+        for worst, best, header, function in sorted(loops, reverse=True)[:top]:
+            lines.append("%-40s %10d %10d  %s" % (function, best, worst, self.describe(header)))
+        lines += ["", "best / worst: cycles per call, from entry to return, with every loop taken zero times",
+                  "own: without the cycles of the functions called; loops: cycles per pass around the body"]
+        return "\n".join(lines)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Estimate the cycles each function of a Hack program takes, without running it.")
+    argparser.add_argument("filename", help="the Xxx.asm file to analyze")
+    argparser.add_argument("--top", type=int, default=20, help="rows in each table of the report")
+    args = argparser.parse_args()
+    print(CycleEstimator.from_file(args.filename).report(args.top))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,239 @@
 from Code import Code
 from SymbolTable import SymbolTable
 from Parser import Parser
-import sys
+from RomImage import write_hack, write_hackb
+from Optimizer import Optimizer
+from SourceMap import SourceMap
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+
+# Symbol table shared by the commands a pool worker encodes, set once per worker
+_shard_symboltable = None
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Error")
-        sys.exit(1)
-    filename = sys.argv[-1]
-    
-    #初始化
-    code = Code()
-    symboltable = SymbolTable()
-    parser = Parser(filename)
 
+def c_instruction(parser, code):
+    """Returns the current C command as a 16-bit int."""
+    return code.encode(parser.current_dest, parser.current_comp, parser.current_jump)
+
+
+def label_pass(parser, symboltable):
+    """Walks the commands once, recording the ROM address of every label."""
     #第一轮循环
-    while parser.has_more_commands():
-        parser.advance_to_next_command()
-        if parser.get_command_type() == "L":
+    for command_type in parser.commands():
+        if command_type == "L":
             sym = parser.current_command[1:-1]
             addr = parser.current_line
             symboltable.addEntry(sym, addr)
 
-    #重置
-    parser.current_index = 0
-    parser.current_line = 0
-
-    Res = []            
 
+def encode_pass(parser, code, symboltable):
+    """Walks the commands again, yielding each instruction as a 16-bit int as soon as it is encoded."""
     #第二轮循环
+    for command_type in parser.commands():
+        if command_type == "A":
+            #数字地址
+            yield parser.symbol(symboltable)
+        elif command_type == "C":
+            yield c_instruction(parser, code)
+
+
+def two_pass(parser, code, symboltable):
+    """Assembles the parsed file with a label pass followed by an encode pass."""
+    label_pass(parser, symboltable)
+    return array("H", encode_pass(parser, code, symboltable))
+
+
+def assemble(source, symboltable=None, single=False):
+    """
+    Assembles Hack assembly held in memory and returns the machine code as an array('H').
+    @para source (str or iterable of str): the whole program as one string, or its lines
+    @para symboltable (SymbolTable): filled with every label and variable the program
+        defines, so callers can read the symbols back; a fresh table is used if omitted
+    @para single (bool): use the single-pass assembler instead of the two-pass one
+
+    For example, VM translation can feed the assembler without touching the disk:
+        translator = VMTranslator("Pong"); translator.parse()
+        rom = assemble(translator.asm_codes)
+    """
+    if isinstance(source, str):
+        source = source.splitlines()
+    if symboltable is None:
+        symboltable = SymbolTable()
+    parser = Parser(lines=source)
+    if single:
+        return single_pass(parser, Code(), symboltable)
+    return two_pass(parser, Code(), symboltable)
+
+
+def resolve_symbols(parser, symboltable):
+    """
+    Runs the label pass, then allocates every variable in order of first use, so
+    the symbol table is complete before any instruction is encoded.
+    """
+    label_pass(parser, symboltable)
+    for command in parser.text:
+        if command[0] == "@":
+            sym = command[1:]
+            if not sym.isdigit() and not symboltable.contains(sym):
+                symboltable.addEntry(sym, parser.current_address)
+                parser.current_address += 1
+
+
+def _init_shard_worker(table):
+    """Installs the resolved symbol table in a pool worker."""
+    global _shard_symboltable
+    _shard_symboltable = SymbolTable()
+    _shard_symboltable.table = table
+
+
+def _encode_shard(commands):
+    """Encodes a slice of the program in a pool worker and returns its packed words."""
+    return array("H", encode_pass(Parser(lines=commands), Code(), _shard_symboltable)).tobytes()
+
+
+def parallel(parser, code, symboltable, workers):
+    """
+    Assembles the parsed file by resolving all symbols serially, then encoding
+    contiguous shards of the program on a pool of worker processes. Since nothing
+    is allocated while encoding, the output is the same as two_pass.
+    """
+    resolve_symbols(parser, symboltable)
+    size = max(1, -(-parser.total_lines // workers))
+    shards = [parser.text[i:i + size] for i in range(0, parser.total_lines, size)]
+    Res = array("H")
+    with ProcessPoolExecutor(workers, initializer=_init_shard_worker, initargs=(symboltable.table,)) as pool:
+        for packed in pool.map(_encode_shard, shards):
+            Res.frombytes(packed)
+    return Res
+
+
+def stream(filename, outfile, code, symboltable, binary=False):
+    """
+    Assembles filename into outfile without holding the program in memory: the
+    source is read twice, once for labels and once for encoding, and words are
+    written out as they are produced. Only the symbol table grows with the input.
+    """
+    parser = Parser(filename, stream=True)
+    label_pass(parser, symboltable)
+    words = encode_pass(parser, code, symboltable)
+    if binary:
+        write_hackb(words, outfile)
+    else:
+        write_hack(words, outfile)
+
+
+def single_pass(parser, code, symboltable):
+    """
+    Assembles the parsed file in one walk, emitting each instruction as soon as it
+    is decoded. A commands referring to symbols that are not known yet leave a hole
+    which is patched when the label shows up; symbols that never turn out to be
+    labels are allocated as variables at the end, in order of first use, exactly
+    like the two-pass path does.
+    """
+    Res = array("H")
+    # symbol -> indexes in Res still waiting for its address
+    pending = {}
+
     while parser.has_more_commands():
         parser.advance_to_next_command()
-        res = ""
-        if parser.get_command_type() == "A":
-            #数字地址
-            num = parser.symbol(symboltable)
-            #二进制，前缀为0b
-            b = bin(num)[2:]
-            #补0
-            res = (16 - len(b)) * "0" + b
-            Res.append(res)
-        elif parser.get_command_type() == "C":
-            dest = parser.dest(code)
-            comp = parser.comp(code)
-            jump = parser.jump(code)
-            
-            res = "111" + comp + dest + jump
-            Res.append(res)
-    
-    name = filename.split(".")[0]
+        command_type = parser.get_command_type()
+        if command_type == "A":
+            sym = parser.current_command[1:]
+            if sym.isdigit():
+                Res.append(int(sym))
+            elif symboltable.contains(sym):
+                Res.append(symboltable.getAddress(sym))
+            else:
+                pending.setdefault(sym, []).append(len(Res))
+                Res.append(0)
+        elif command_type == "C":
+            Res.append(c_instruction(parser, code))
+        else:
+            sym = parser.current_command[1:-1]
+            symboltable.addEntry(sym, parser.current_line)
+            for index in pending.pop(sym, ()):
+                Res[index] = parser.current_line
+
+    #剩下的都是变量
+    for sym, indexes in pending.items():
+        symboltable.addEntry(sym, parser.current_address)
+        parser.current_address += 1
+        res = symboltable.getAddress(sym)
+        for index in indexes:
+            Res[index] = res
+    return Res
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Translate Hack assembly into Hack machine code.")
+    argparser.add_argument("filename", help="the Xxx.asm file to assemble")
+    argparser.add_argument("--single-pass", action="store_true",
+                           help="assemble in one pass, backpatching forward label references")
+    argparser.add_argument("--stream", action="store_true",
+                           help="stream lines in and words out, keeping only the symbol table in memory")
+    argparser.add_argument("--workers", type=int, metavar="N",
+                           help="encode on a pool of N worker processes after resolving symbols")
+    argparser.add_argument("--optimize", action="store_true",
+                           help="run the peephole optimizer before assembling and report what it saved")
+    argparser.add_argument("--protect-literals", action="store_true",
+                           help="with --optimize, leave alone all code up to the highest literal @n inside the program, "
+                                "for hand-written code that may jump to an address kept in RAM")
+    argparser.add_argument("--source-map", action="store_true",
+                           help="also write Xxx.map, mapping ROM addresses to asm lines, VM commands and functions")
+    argparser.add_argument("--cache", metavar="FILE",
+                           help="reuse the encoding of unchanged chunks stored in FILE, and update it")
+    argparser.add_argument("--binary", action="store_true",
+                           help="write a packed little-endian Xxx.hackb ROM image instead of Xxx.hack")
+    args = argparser.parse_args()
+    if args.source_map and args.optimize:
+        argparser.error("--source-map describes the unoptimized program and cannot be combined with --optimize")
+    if args.protect_literals and not args.optimize:
+        argparser.error("--protect-literals only applies with --optimize")
+    if args.stream:
+        ignored = [option for option, given in (("--single-pass", args.single_pass), ("--workers", args.workers is not None),
+                                                ("--optimize", args.optimize), ("--cache", args.cache)) if given]
+        if ignored:
+            argparser.error("--stream assembles line by line and cannot be combined with %s" % ", ".join(ignored))
+    filename = args.filename
+    name = os.path.splitext(filename)[0]
+    outfile = name + (".hackb" if args.binary else ".hack")
+    if args.source_map:
+        SourceMap.from_file(filename).save(name + ".map")
+
+    #初始化
+    code = Code()
+    symboltable = SymbolTable()
+    if args.stream:
+        stream(filename, outfile, code, symboltable, args.binary)
+        return
+    parser = Parser(filename)
+    if args.optimize:
+        optimizer = Optimizer(args.protect_literals)
+        parser.text = optimizer.optimize(parser.text)
+        parser.total_lines = len(parser.text)
+        print(optimizer.report())
+
+    if args.cache:
+        from AssemblyCache import AssemblyCache
+        cache = AssemblyCache(args.cache)
+        Res = cache.assemble(parser, code, symboltable)
+        cache.save()
+        print(cache.report())
+    elif args.workers:
+        Res = parallel(parser, code, symboltable, args.workers)
+    elif args.single_pass:
+        Res = single_pass(parser, code, symboltable)
+    else:
+        Res = two_pass(parser, code, symboltable)
+
     #存储结果
-    with open(name+".hack", "w+") as f:
-        for i in Res:
-            f.writelines(i + "\n")
\ No newline at end of file
+    if args.binary:
+        write_hackb(Res, outfile)
+    else:
+        write_hack(Res, outfile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+class Optimizer:
+    """
+    A peephole optimizer over cleaned Hack assembly, run before the label pass.
+
+    Each rule rewrites a short run of consecutive instructions into a cheaper one
+    with the same effect on A, D, M and the PC. Runs never contain a label, so no
+    jump target is moved into or out of a rewritten sequence. Code before a jump
+    to a literal address ("@133 0;JMP" in Pong.asm) is left alone as well, since
+    removing any of it would shift that address.
+
+    A literal address can also be loaded with "@n D=A", kept in RAM and jumped
+    to later, which this does not see. VMTranslator output never does that:
+    calls and returns go through labels. For hand-written code that might,
+    protect_literals treats every "@n" inside the program as a jump target,
+    at the cost of leaving most code that loads large constants untouched.
+    """
+
+    def __init__(self, protect_literals=False):
+        """
+        @attr self.rules (list of (str, method)): the rewrite rules, tried in order at each position
+        @attr self.savings (dict): rule name -> instructions removed by that rule
+        @attr self.protect_literals (bool): whether any literal "@n" inside the program is a possible jump target
+        """
+        self.protect_literals = protect_literals
+        self.rules = [
+            ("push-pop", self._push_pop),
+            ("redundant-load", self._redundant_load),
+            ("jump-to-next", self._jump_to_next),
+        ]
+        self.savings = {name: 0 for name, _ in self.rules}
+
+    def optimize(self, text):
+        """Returns a rewritten copy of the cleaned commands in text, applying the rules until none matches."""
+        while True:
+            rewritten = self._pass(text)
+            if len(rewritten) == len(text):
+                return rewritten
+            text = rewritten
+
+    def _pass(self, text):
+        """Makes one left-to-right pass over text, applying the first matching rule at each position."""
+        start = self._first_movable(text)
+        out = text[:start]
+        i = start
+        while i < len(text):
+            for name, rule in self.rules:
+                match = rule(text, i)
+                if match is not None:
+                    consumed, replacement = match
+                    out += replacement
+                    self.savings[name] += consumed - len(replacement)
+                    i += consumed
+                    break
+            else:
+                out.append(text[i])
+                i += 1
+        return out
+
+    def _first_movable(self, text):
+        """
+        Returns the index of the first command that can be rewritten without
+        moving a literal jump target: an "@n" directly followed by a jump or,
+        with protect_literals, any "@n" with n inside the program.
+        """
+        size = sum(1 for command in text if command[0] != "(")
+        target = 0
+        for i, command in enumerate(text):
+            if command[0] != "@" or not command[1:].isdigit():
+                continue
+            jumps = i + 1 < len(text) and ";" in text[i + 1]
+            if jumps or (self.protect_literals and int(command[1:]) < size):
+                target = max(target, int(command[1:]))
+        address = 0
+        for i, command in enumerate(text):
+            if address >= target:
+                return i
+            if command[0] != "(":
+                address += 1
+        return len(text)
+
+    def _writes_a(self, command):
+        """Returns True if command may change A or the PC: an A command, a label, a jump or a C command with A in dest."""
+        if command[0] in "@(" or ";" in command:
+            return True
+        return "A" in command.split("=", 1)[0] if "=" in command else False
+
+    def _push_pop(self, text, i):
+        """
+        "@SP M=M+1 @SP AM=M-1" -> "@SP A=M": the increment and decrement of SP
+        cancel out and only the final A=SP remains.
+        """
+        if text[i:i + 4] == ["@SP", "M=M+1", "@SP", "AM=M-1"]:
+            return 4, ["@SP", "A=M"]
+        return None
+
+    def _redundant_load(self, text, i):
+        """
+        "@X c1 .. cn @X" -> "@X c1 .. cn" when no ci writes A or jumps: A already holds X.
+        """
+        if text[i][0] != "@":
+            return None
+        j = i + 1
+        while j < len(text) and not self._writes_a(text[j]):
+            j += 1
+        if j >= len(text) or text[j] != text[i]:
+            return None
+        return j - i + 1, text[i:j]
+
+    def _jump_to_next(self, text, i):
+        """
+        "@L 0;JMP (L)" -> "@L (L)": jumping to the very next instruction does
+        nothing, but the code after (L) may still use the A=L the "@L" set.
+        """
+        if text[i][0] == "@" and text[i + 1:i + 2] == ["0;JMP"] and text[i + 2:i + 3] == ["(" + text[i][1:] + ")"]:
+            return 3, [text[i], text[i + 2]]
+        return None
+
+    def report(self):
+        """Returns a summary of the instructions each rule removed."""
+        lines = ["%-16s %6d" % (name, saved) for name, saved in self.savings.items()]
+        lines.append("%-16s %6d" % ("total", sum(self.savings.values())))
+        return "\n".join(lines)
@@ -1,30 +1,66 @@
 class Parser():
     """A Parser class to parse and process a given assembly file."""
 
-    def __init__(self, filename):
-        """Initializes the Parser with the given file, and processes its lines."""
-        self.text = self._read_and_process_file(filename)
+    def __init__(self, filename=None, stream=False, lines=None):
+        """
+        Initializes the Parser with the given file, and processes its lines.
+        With stream=True the lines are not kept in memory: the file is read again
+        by every call to commands(), and has_more_commands()/advance_to_next_command()
+        are not available.
+        Instead of a filename, the assembly can be handed over directly as lines,
+        an iterable of strings such as VMTranslator.asm_codes.
+        """
+        self.filename = filename
+        if lines is not None:
+            self.text = self._process_lines(lines)
+        else:
+            self.text = None if stream else self._read_and_process_file(filename)
 
         # Variables for tracking the current position and state
         self.current_address = 16
         self.current_index = 0
         self.current_line = 0
-        self.total_lines = len(self.text)
+        self.total_lines = None if stream else len(self.text)
         self.current_command = ""
+        self.current_type = ""
         self.current_comp = ""
         self.current_dest = ""
         self.current_jump = ""
 
     def _read_and_process_file(self, filename):
         """Reads the file, and processes its lines."""
+        with open(filename, "r") as file:
+            return self._process_lines(file)
+
+    def _process_lines(self, lines):
+        """Processes lines that are already in memory."""
         text = []
+        for line in lines:
+            line = self._process_line(line)
+            if line:
+                text.append(line)
+        return text
+
+    def _iter_file(self, filename):
+        """Reads the file lazily, yielding its processed lines one at a time."""
         with open(filename, "r") as file:
-            for line in file.readlines():
+            for line in file:
                 line = self._process_line(line)
                 if line:
-                    text.append(line)
-        return text
+                    yield line
     
+    def annotated_lines(self, lines):
+        """
+        Yields (line number, comment, command) for every raw line, numbered from 1,
+        where comment is the stripped text after "//" (or None) and command is the
+        processed line (or None for blank and comment-only lines).
+        """
+        for number, line in enumerate(lines, 1):
+            comment = None
+            if "//" in line:
+                comment = line.split("//", 1)[1].strip()
+            yield number, comment, self._process_line(line)
+
     def _process_line(self, line):
         """Strips leading/trailing white space, removes comments, and spaces within the line."""
         line = line.strip()
@@ -39,17 +75,30 @@ class Parser():
     def advance_to_next_command(self):
         """Advances to the next command, if there are any left."""
         if self.has_more_commands():
-            self.current_command = self.text[self.current_index]
+            self._load_command(self.text[self.current_index])
             self.current_index += 1
-            if not self._is_label_command():
-                self.current_line += 1
+
+    def commands(self):
+        """Walks the commands from the start, making each one current and yielding its type."""
+        self.current_line = 0
+        source = self._iter_file(self.filename) if self.text is None else self.text
+        for command in source:
+            self._load_command(command)
+            yield self.current_type
+
+    def _load_command(self, command):
+        """Makes command the current command."""
+        self.current_command = command
+        self.current_type = self._classify_command()
+        if self.current_type != "L":
+            self.current_line += 1
 
     def _is_label_command(self):
         """Returns True if the current command is a label command."""
         return self.current_command[0] == "("
 
-    def get_command_type(self):
-        """Returns the type of the current command."""
+    def _classify_command(self):
+        """Works out the type of the current command, splitting C commands only once."""
         if self.current_command[0] == "@":
             return "A"
         elif self._is_label_command():
@@ -58,6 +107,10 @@ class Parser():
             self._separate_c_command()
             return "C"
 
+    def get_command_type(self):
+        """Returns the type of the current command."""
+        return self.current_type
+
     def _separate_c_command(self):
         """Separates the parts of a C command."""
         dest_separator = self.current_command.find("=")
@@ -0,0 +1,69 @@
+"""
+Reading and writing Hack ROM images.
+
+A ROM image is an array('H') of 16-bit instruction words. It is stored either as
+text (Xxx.hack, one 16-character binary string per line, as the course tools
+expect) or packed (Xxx.hackb, raw little-endian 16-bit words with no header), which
+can be loaded with a single read or mapped straight into memory.
+"""
+from array import array
+from itertools import islice
+import mmap
+import sys
+
+# Words buffered per write when packing a stream of words
+WRITE_BLOCK = 4096
+
+
+def write_hack(words, filename):
+    """Writes words to filename as text, one binary string per line."""
+    with open(filename, "w") as f:
+        for word in words:
+            f.write(format(word, "016b") + "\n")
+
+
+def write_hackb(words, filename):
+    """Writes words to filename as packed little-endian 16-bit words, a block at a time."""
+    words = iter(words)
+    with open(filename, "wb") as f:
+        while True:
+            block = array("H", islice(words, WRITE_BLOCK))
+            if not block:
+                break
+            if sys.byteorder == "big":
+                block.byteswap()
+            block.tofile(f)
+
+
+def read_hack(filename):
+    """Reads a text .hack file into an array('H')."""
+    with open(filename, "r") as f:
+        return array("H", [int(line, 2) for line in f if line.strip()])
+
+
+def read_hackb(filename):
+    """Reads a packed .hackb file into an array('H')."""
+    rom = array("H")
+    with open(filename, "rb") as f:
+        rom.frombytes(f.read())
+    if sys.byteorder == "big":
+        rom.byteswap()
+    return rom
+
+
+def map_hackb(filename):
+    """
+    Maps a packed .hackb file into memory and returns a read-only 'H' memoryview
+    over it, without copying or parsing. Only valid on little-endian hosts.
+    """
+    assert sys.byteorder == "little", "mapped ROM images need a little-endian host"
+    with open(filename, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast("H")
+
+
+def load_rom(filename):
+    """Reads a .hack or .hackb file, chosen by its suffix, into an array('H')."""
+    if filename.endswith(".hackb"):
+        return read_hackb(filename)
+    return read_hack(filename)
@@ -0,0 +1,135 @@
+from Parser import Parser
+from array import array
+import json
+
+# Word counts of the VM commands VMTranslator writes as "//push constant 7"-style comments
+VM_COMMANDS = {"add": 1, "sub": 1, "neg": 1, "eq": 1, "gt": 1, "lt": 1, "and": 1, "or": 1, "not": 1,
+               "return": 1, "label": 2, "goto": 2, "if-goto": 2,
+               "push": 3, "pop": 3, "function": 3, "call": 3}
+
+
+class SourceMap:
+    """
+    Maps every ROM address of an assembled program back to where it came from:
+    the line of the .asm file, the VM command the translator's comment markers
+    say it belongs to, and the function label it sits under.
+
+    Saved as a JSON sidecar (Xxx.map) holding string tables for the VM commands and
+    functions, one (asm line, VM command index, function index) column per field,
+    with -1 meaning "none", and every label's address.
+    """
+
+    def __init__(self, source=""):
+        """
+        @attr self.source (str): the .asm file the map describes
+        @attr self.asm_lines (array): ROM address -> 1-based line in the .asm file
+        @attr self.vm_index (array): ROM address -> index in self.vm_commands, or -1
+        @attr self.function_index (array): ROM address -> index in self.functions, or -1
+        @attr self.labels (dict): label -> ROM address
+        """
+        self.source = source
+        self.asm_lines = array("i")
+        self.vm_index = array("i")
+        self.function_index = array("i")
+        self.vm_commands = []
+        self.functions = []
+        self.labels = {}
+
+    @classmethod
+    def build(cls, lines, source=""):
+        """
+        Builds the map of the program made of the raw .asm lines: the lines of a
+        file, or strings as VMTranslator keeps them in asm_codes ("\n//push constant 7"),
+        each written out followed by a newline.
+        """
+        smap = cls(source)
+        vm = function = -1
+        for number, comment, command in Parser(lines=()).annotated_lines(cls.split_lines(lines)):
+            if comment and not command and smap.is_vm_command(comment):
+                smap.vm_commands.append(comment)
+                vm = len(smap.vm_commands) - 1
+            if not command:
+                continue
+            if command[0] == "(":
+                label = command[1:-1]
+                smap.labels[label] = len(smap.asm_lines)
+                if smap.is_function(label):
+                    smap.functions.append(label)
+                    function = len(smap.functions) - 1
+                continue
+            smap.asm_lines.append(number)
+            smap.vm_index.append(vm)
+            smap.function_index.append(function)
+        return smap
+
+    @classmethod
+    def from_file(cls, filename):
+        """Builds the map of the .asm file filename."""
+        with open(filename, "r") as f:
+            return cls.build(f, filename)
+
+    @staticmethod
+    def split_lines(lines):
+        """Yields the lines of the text made of lines, each followed by a newline, so embedded newlines count."""
+        for line in lines:
+            yield from (line[:-1] if line.endswith("\n") else line).split("\n")
+
+    @staticmethod
+    def is_vm_command(comment):
+        """Returns True if a comment reads like a VM command, e.g. "push constant 7"."""
+        words = comment.split()
+        return VM_COMMANDS.get(words[0]) == len(words)
+
+    @staticmethod
+    def is_function(label):
+        """
+        Returns True if label looks like a VM function entry, Xxx.yyy without a "$"
+        suffix (and not the LOOP_Xxx.yyy local-initialisation loop of the book's compiler).
+        """
+        return "." in label and "$" not in label and not label.startswith("LOOP_")
+
+    def __len__(self):
+        return len(self.asm_lines)
+
+    def lookup(self, address):
+        """Returns (asm line, VM command, function) for a ROM address; missing parts are None."""
+        vm = self.vm_index[address]
+        function = self.function_index[address]
+        return (self.asm_lines[address],
+                self.vm_commands[vm] if vm >= 0 else None,
+                self.functions[function] if function >= 0 else None)
+
+    def function_at(self, address):
+        """Returns the function the instruction at a ROM address belongs to, or None."""
+        if 0 <= address < len(self.function_index) and self.function_index[address] >= 0:
+            return self.functions[self.function_index[address]]
+        return None
+
+    def save(self, filename):
+        """Writes the map to filename as compact JSON."""
+        data = {
+            "version": 1,
+            "source": self.source,
+            "vm_commands": self.vm_commands,
+            "functions": self.functions,
+            "labels": self.labels,
+            "asm_lines": self.asm_lines.tolist(),
+            "vm_index": self.vm_index.tolist(),
+            "function_index": self.function_index.tolist(),
+        }
+        with open(filename, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, filename):
+        """Reads a map written by save()."""
+        with open(filename, "r") as f:
+            data = json.load(f)
+        smap = cls(data["source"])
+        smap.vm_commands = data["vm_commands"]
+        smap.functions = data["functions"]
+        smap.labels = data["labels"]
+        smap.asm_lines = array("i", data["asm_lines"])
+        smap.vm_index = array("i", data["vm_index"])
+        smap.function_index = array("i", data["function_index"])
+        return smap